@@ -0,0 +1,295 @@
+from fastapi import APIRouter, status, Depends, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+import os
+
+from utils.auth import get_current_admin
+from utils.slow_query import slow_queries
+from utils.profiler import profiler_lock, profile_worker
+from utils import memory
+from utils.similar_books import refresh_similar_books
+from utils.popularity import popularity
+from repositories.archive import archive_history
+from repositories.models import ScheduledRuns
+from startup.db_config import async_session_factory
+from sqlalchemy.future import select
+from utils.scheduler import scheduler, schedule_entry, prometheus_metrics as schedule_metrics
+
+
+admin_router = APIRouter()
+
+@admin_router.get("/slow-queries/")
+async def get_slow_queries(user_info = Depends(get_current_admin)):
+    try:
+        if user_info[1] != '':
+            raise Exception(user_info[1])
+        return {
+            'resp_msg': 'Slow queries (most recent first):',
+            'resp_data': list(reversed(slow_queries))
+        }
+    except Exception as e:
+        return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content = {
+            'resp_msg': str(e),
+            'resp_data': None
+        }
+    )
+
+@admin_router.delete("/slow-queries/")
+async def clear_slow_queries(user_info = Depends(get_current_admin)):
+    try:
+        if user_info[1] != '':
+            raise Exception(user_info[1])
+        slow_queries.clear()
+        return {
+            'resp_msg': 'Slow query log cleared.',
+            'resp_data': None
+        }
+    except Exception as e:
+        return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content = {
+            'resp_msg': str(e),
+            'resp_data': None
+        }
+    )
+
+@admin_router.get("/profile/")
+async def profile(request: Request, seconds: float = 10, interval_ms: float = 10,
+                  user_info = Depends(get_current_admin)):
+    try:
+        if user_info[1] != '':
+            raise Exception(user_info[1])
+        if not 0 < seconds <= 60:
+            raise Exception("seconds must be between 0 and 60.")
+        if not 1 <= interval_ms <= 1000:
+            raise Exception("interval_ms must be between 1 and 1000.")
+        if profiler_lock.locked():
+            raise Exception("A profile is already running on this worker.")
+        async with profiler_lock:
+            profiler = await profile_worker(request.app, seconds, interval_ms / 1000)
+        # collapsed stacks, readable by flamegraph.pl, speedscope and inferno
+        return PlainTextResponse(
+            profiler.collapsed(),
+            headers={
+                'Content-Disposition': f'attachment; filename="profile-{os.getpid()}.folded"',
+                'X-Profile-Samples': str(profiler.samples)
+            })
+    except Exception as e:
+        return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content = {
+            'resp_msg': str(e),
+            'resp_data': None
+        }
+    )
+
+@admin_router.get("/memory/")
+async def memory_usage(history: int = 60, user_info = Depends(get_current_admin)):
+    try:
+        if user_info[1] != '':
+            raise Exception(user_info[1])
+        samples = list(memory.memory_samples)
+        return {
+            'resp_msg': 'Memory usage of this worker:',
+            'resp_data': {
+                'current': memory.take_sample(count_objects=False),
+                'history': samples[-history:] if history > 0 else []
+            }
+        }
+    except Exception as e:
+        return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content = {
+            'resp_msg': str(e),
+            'resp_data': None
+        }
+    )
+
+@admin_router.get("/memory/metrics")
+async def memory_metrics(user_info = Depends(get_current_admin)):
+    try:
+        if user_info[1] != '':
+            raise Exception(user_info[1])
+        return PlainTextResponse(memory.prometheus_metrics(), media_type="text/plain; version=0.0.4")
+    except Exception as e:
+        return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content = {
+            'resp_msg': str(e),
+            'resp_data': None
+        }
+    )
+
+@admin_router.post("/memory/tracemalloc/start")
+async def start_tracemalloc(frames: int = 1, user_info = Depends(get_current_admin)):
+    try:
+        if user_info[1] != '':
+            raise Exception(user_info[1])
+        if not 1 <= frames <= 50:
+            raise Exception("frames must be between 1 and 50.")
+        memory.start_tracing(frames)
+        return {
+            'resp_msg': 'tracemalloc started.',
+            'resp_data': {'frames': frames}
+        }
+    except Exception as e:
+        return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content = {
+            'resp_msg': str(e),
+            'resp_data': None
+        }
+    )
+
+@admin_router.post("/memory/tracemalloc/stop")
+async def stop_tracemalloc(user_info = Depends(get_current_admin)):
+    try:
+        if user_info[1] != '':
+            raise Exception(user_info[1])
+        memory.stop_tracing()
+        return {
+            'resp_msg': 'tracemalloc stopped.',
+            'resp_data': None
+        }
+    except Exception as e:
+        return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content = {
+            'resp_msg': str(e),
+            'resp_data': None
+        }
+    )
+
+@admin_router.post("/memory/snapshot")
+async def take_memory_snapshot(user_info = Depends(get_current_admin)):
+    try:
+        if user_info[1] != '':
+            raise Exception(user_info[1])
+        return {
+            'resp_msg': 'Baseline snapshot taken.',
+            'resp_data': memory.take_baseline_snapshot()
+        }
+    except Exception as e:
+        return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content = {
+            'resp_msg': str(e),
+            'resp_data': None
+        }
+    )
+
+@admin_router.get("/memory/snapshot/diff")
+async def memory_snapshot_diff(group_by: str = "lineno", limit: int = 25, user_info = Depends(get_current_admin)):
+    try:
+        if user_info[1] != '':
+            raise Exception(user_info[1])
+        return {
+            'resp_msg': 'Allocation growth since the baseline snapshot:',
+            'resp_data': memory.snapshot_diff(group_by, limit)
+        }
+    except Exception as e:
+        return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content = {
+            'resp_msg': str(e),
+            'resp_data': None
+        }
+    )
+
+@admin_router.post("/similar-books/refresh")
+async def refresh_similar(full: bool = False, user_info = Depends(get_current_admin)):
+    try:
+        if user_info[1] != '':
+            raise Exception(user_info[1])
+        refreshed = await refresh_similar_books(full=full)
+        return {
+            'resp_msg': 'Similar books refreshed.',
+            'resp_data': {'books': refreshed}
+        }
+    except Exception as e:
+        return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content = {
+            'resp_msg': str(e),
+            'resp_data': None
+        }
+    )
+
+@admin_router.post("/popularity/rebuild")
+async def rebuild_popularity(user_info = Depends(get_current_admin)):
+    try:
+        if user_info[1] != '':
+            raise Exception(user_info[1])
+        await popularity.rebuild(replace=True)
+        await popularity.load()
+        return {
+            'resp_msg': 'Book popularity rebuilt from history.',
+            'resp_data': None
+        }
+    except Exception as e:
+        return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content = {
+            'resp_msg': str(e),
+            'resp_data': None
+        }
+    )
+
+@admin_router.post("/archive/run")
+async def run_archive(user_info = Depends(get_current_admin)):
+    try:
+        if user_info[1] != '':
+            raise Exception(user_info[1])
+        counts = await archive_history()
+        return {
+            'resp_msg': 'Old history archived.',
+            'resp_data': counts
+        }
+    except Exception as e:
+        return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content = {
+            'resp_msg': str(e),
+            'resp_data': None
+        }
+    )
+
+@admin_router.get("/schedules/")
+async def get_schedules(user_info = Depends(get_current_admin)):
+    async with async_session_factory() as session:
+        try:
+            if user_info[1] != '':
+                raise Exception(user_info[1])
+            result = await session.execute(select(ScheduledRuns))
+            runs = {run.name: run for run in result.scalars().all()}
+            return {
+                'resp_msg': 'Periodic tasks (last runs are cluster-wide, next_due is as seen by this worker):',
+                'resp_data': [schedule_entry(task, runs.get(name)) for name, task in scheduler.tasks.items()]
+            }
+        except Exception as e:
+            return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content = {
+                'resp_msg': str(e),
+                'resp_data': None
+            }
+        )
+
+@admin_router.get("/schedules/metrics")
+async def get_schedule_metrics(user_info = Depends(get_current_admin)):
+    async with async_session_factory() as session:
+        try:
+            if user_info[1] != '':
+                raise Exception(user_info[1])
+            result = await session.execute(select(ScheduledRuns).order_by(ScheduledRuns.name))
+            return PlainTextResponse(schedule_metrics(result.scalars().all()),
+                                     media_type="text/plain; version=0.0.4")
+        except Exception as e:
+            return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content = {
+                'resp_msg': str(e),
+                'resp_data': None
+            }
+        )
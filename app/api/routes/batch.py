@@ -0,0 +1,107 @@
+from fastapi import APIRouter, status, Depends, Request
+from fastapi.responses import JSONResponse
+import asyncio
+import json
+
+from startup.db_config import Config
+from api.schemas.batch import BatchRequest, BatchItem
+from utils.auth import get_current_user
+from utils.routing import find_route
+
+
+batch_router = APIRouter()
+
+async def run_sub_request(request: Request, item: BatchItem, principal: dict, semaphore: asyncio.Semaphore):
+    path, _, query_string = item.path.partition("?")
+    headers = [(b"content-type", b"application/json")]
+    # credentials and the replica routing preferences of the batch apply to every item
+    for name in ("authorization", "cookie", "x-read-consistency"):
+        value = request.headers.get(name)
+        if value:
+            headers.append((name.encode(), value.encode()))
+    body = json.dumps(item.body).encode() if item.body is not None else b""
+    scope = {
+        "type": "http",
+        "asgi": request.scope.get("asgi", {"version": "3.0"}),
+        "http_version": request.scope.get("http_version", "1.1"),
+        "method": item.method,
+        "scheme": request.url.scheme,
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query_string.encode(),
+        "headers": headers,
+        "client": request.scope.get("client"),
+        "server": request.scope.get("server"),
+        "principal": principal,
+    }
+
+    route = find_route(request.app, scope)
+    if route is None or not getattr(getattr(route, "endpoint", None), "read_only", False):
+        return {
+            'id': item.id,
+            'status': status.HTTP_400_BAD_REQUEST,
+            'body': {'resp_msg': f"{item.method} {path} cannot be used in a batch.", 'resp_data': None}
+        }
+
+    response = {"status": 500, "body": b"", "json": False}
+    done = asyncio.Event()
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["json"] = any(name == b"content-type" and value.startswith(b"application/json")
+                                   for name, value in message["headers"])
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    # every sub-request holds one pooled connection while it runs
+    async with semaphore:
+        try:
+            await request.app(scope, receive, send)
+        except Exception:
+            # the app's error middleware sends its 500 and re-raises; one failing item must not fail the batch
+            return {
+                'id': item.id,
+                'status': 500,
+                'body': {'resp_msg': 'Internal Server Error', 'resp_data': None}
+            }
+        finally:
+            done.set()
+    return {
+        'id': item.id,
+        'status': response["status"],
+        'body': json.loads(response["body"]) if response["json"] and response["body"] else response["body"].decode()
+    }
+
+@batch_router.post("")
+async def batch(request: Request, batch_request: BatchRequest, user_info = Depends(get_current_user)):
+    try:
+        if user_info[1] != '':
+            raise Exception(user_info[1])
+        if len(batch_request.requests) > Config.BATCH_MAX_ITEMS:
+            raise Exception(f"A batch can contain at most {Config.BATCH_MAX_ITEMS} requests.")
+        semaphore = asyncio.Semaphore(Config.BATCH_MAX_CONCURRENCY)
+        results = await asyncio.gather(*(run_sub_request(request, item, user_info[0], semaphore)
+                                         for item in batch_request.requests))
+        return {
+            'resp_msg': 'Batch processed.',
+            'resp_data': results
+        }
+    except Exception as e:
+        return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content = {
+            'resp_msg': str(e),
+            'resp_data': None
+        }
+    )
@@ -1,22 +1,31 @@
-from fastapi import APIRouter, HTTPException,status,Header, Depends
+from fastapi import APIRouter, HTTPException,status,Header, Depends, Request, Query
 from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import text, and_,func,asc,desc
+from sqlalchemy import text, and_,func,asc,desc,tuple_
+from sqlalchemy.orm import load_only
 from sqlmodel import SQLModel
 from typing import List
 import uuid
 from sqlalchemy.exc import IntegrityError
 
-from startup.db_config import engine,async_session_factory
+from startup.db_config import engine,async_session_factory,Config
 from api.schemas.book import AddBook,SearchBook,UpdateBook,UIDBooks,FilterBook
-from repositories.models import Users, Books
+from repositories.models import Users, Books, BookCopies, BookSimilarities
+from repositories.reservations import lock_book, add_copies, remove_copies, remove_barcodes
+from middleware.idempotency import idempotent
+from utils.routing import read_only
 from utils.auth import get_current_user
+from utils.response_cache import catalog_cache
+from utils.text_search import text_search
+from utils.popularity import popularity
+from utils.suggest import suggest_index, publish_book_changes
 
 
 book_router = APIRouter()
 
 @book_router.post("/")
+@idempotent
 async def add_book(request: AddBook, user_info = Depends(get_current_user)):
     async with async_session_factory() as session:
         try:
@@ -34,17 +43,26 @@ async def add_book(request: AddBook, user_info = Depends(get_current_user)):
             user = result.scalar_one_or_none()
             if not user:
                 raise Exception("User not found.")
+            if len(request.barcodes) > request.total_copies:
+                raise Exception("There are more barcodes than copies of this book.")
             
             new_book = Books(
                 title=request.title,
                 author=request.author,
                 category=request.category,
                 summary=request.summary,
+                total_copies=request.total_copies,
+                available_copies=request.total_copies,
                 admin_id=uid
             )
 
             session.add(new_book)
+            session.add_all([BookCopies(book=new_book, barcode=barcode) for barcode in request.barcodes])
+            await session.flush()
+            await publish_book_changes(session, 'upsert', [new_book])
             await session.commit()
+            catalog_cache.clear()
+            text_search.index_books([new_book])
             session.refresh(new_book)
             return {
                 'resp_msg': 'The book has been successfully added to the e-library',
@@ -53,7 +71,9 @@ async def add_book(request: AddBook, user_info = Depends(get_current_user)):
                     'author':new_book.author,
                     'category':new_book.category,
                     'summary':new_book.summary,
-                    'availability':new_book.availability
+                    'availability':new_book.availability,
+                    'total_copies':new_book.total_copies,
+                    'available_copies':new_book.available_copies
                 }
             }
         except Exception as e:
@@ -66,6 +86,7 @@ async def add_book(request: AddBook, user_info = Depends(get_current_user)):
         )
 
 @book_router.post("/multiple/")
+@idempotent
 async def add_multiple_book(request: list[AddBook], user_info = Depends(get_current_user)):
     async with async_session_factory() as session:
         try:
@@ -94,6 +115,8 @@ async def add_multiple_book(request: list[AddBook], user_info = Depends(get_curr
                     empty_fields.add("Category")
                 if not book_request.summary.strip():
                     empty_fields.add("Summary")
+                if len(book_request.barcodes) > book_request.total_copies:
+                    raise Exception(f"There are more barcodes than copies of {book_request.title}.")
             if empty_fields:
                 raise Exception(f"{', '.join(empty_fields)} field(s) cannot be empty.")
 
@@ -104,20 +127,27 @@ async def add_multiple_book(request: list[AddBook], user_info = Depends(get_curr
                     author=book_request.author,
                     category=book_request.category,
                     summary=book_request.summary,
+                    total_copies=book_request.total_copies,
+                    available_copies=book_request.total_copies,
                     admin_id=uid
                 )
                 new_books.append(new_book)
                 session.add(new_book)
+                session.add_all([BookCopies(book=new_book, barcode=barcode) for barcode in book_request.barcodes])
 
-
+            await session.flush()
+            await publish_book_changes(session, 'upsert', new_books)
             await session.commit()
+            catalog_cache.clear()
+            text_search.index_books(new_books)
             session.refresh(new_book)
             return {
                 'resp_msg': 'The book has been successfully added to the e-library',
                 'resp_data': [{
                     'title':book.title,
                     'author':book.author,
-                    'category':book.category
+                    'category':book.category,
+                    'total_copies':book.total_copies
                 } for book in new_books]
             }
         except Exception as e:
@@ -131,22 +161,64 @@ async def add_multiple_book(request: list[AddBook], user_info = Depends(get_curr
 
 from sqlalchemy import func
 
+FACET_COLUMNS = {'category': Books.category, 'author': Books.author, 'availability': Books.availability}
+
+async def facet_counts(session, filters, facets):
+    # the unfiltered catalogue is the same for every page, keep it with the cached listings
+    cache_key = 'facets:' + ','.join(sorted(facets))
+    if not filters:
+        cached = catalog_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    # one grouped query for every facet; grouping() tells the grouping sets apart
+    columns = [FACET_COLUMNS[name] for name in facets]
+    grouped = (select(*columns,
+                      func.grouping(*columns).label('grouping_id'),
+                      func.count().label('count'))
+               .where(*filters)
+               .group_by(func.grouping_sets(*[tuple_(column) for column in columns]))
+               .subquery())
+    ranked = select(grouped, func.row_number().over(partition_by=grouped.c.grouping_id,
+                                                    order_by=desc(grouped.c['count'])).label('rank')).subquery()
+    result = await session.execute(select(ranked)
+                                   .where(ranked.c.rank <= Config.FACET_LIMIT)
+                                   .order_by(ranked.c.grouping_id, ranked.c.rank))
+
+    everything = (1 << len(columns)) - 1
+    masks = {everything ^ (1 << (len(columns) - 1 - i)): name for i, name in enumerate(facets)}
+    counts = {name: [] for name in facets}
+    for row in result.mappings():
+        name = masks[row['grouping_id']]
+        counts[name].append({'value': row[name], 'count': row['count']})
+    if not filters:
+        catalog_cache.set(cache_key, counts)
+    return counts
+
 @book_router.post("/filter")
-async def search_book_filter(request: FilterBook):
+@read_only
+async def search_book_filter(request: FilterBook, http_request: Request):
+    cache_key = 'filter:' + request.model_dump_json()
+    cached = catalog_cache.get(cache_key)
+    if cached is not None:
+        return cached.response(http_request)
     async with async_session_factory() as session:
         try:
             offset = (request.page - 1) * request.limit
+            fields = request.selected_fields()
 
-            # Base query with filters
-            base_query = select(Books)
+            filters = []
             if request.title:
-                base_query = base_query.where(Books.title.ilike(f'%{request.title}%'))
+                filters.append(Books.title.ilike(f'%{request.title}%'))
             if request.author:
-                base_query = base_query.where(Books.author.ilike(f'%{request.author}%'))
+                filters.append(Books.author.ilike(f'%{request.author}%'))
             if request.category:
-                base_query = base_query.where(Books.category.ilike(f'%{request.category}%'))
+                filters.append(Books.category.ilike(f'%{request.category}%'))
             if request.availability is not None:
-                base_query = base_query.where(Books.availability == request.availability)
+                filters.append(Books.availability == request.availability)
+
+            # Base query with filters
+            base_query = select(Books).options(load_only(*[getattr(Books, name) for name in fields])).where(*filters)
 
             # Total count query
             count_query = select(func.count()).select_from(base_query.subquery())
@@ -162,19 +234,16 @@ async def search_book_filter(request: FilterBook):
             if not books_result:
                 raise Exception("No books found matching the given criteria.")
 
-            return {
+            content = {
                 'resp_msg': 'Books based on filter.',
-                'resp_data': [{
-                    'title': book.title,
-                    'author': book.author,
-                    'category': book.category,
-                    'summary': book.summary,
-                    'availability': book.availability
-                } for book in books_result],
+                'resp_data': [{name: getattr(book, name) for name in fields} for book in books_result],
                 'total': total_count,
                 'page': request.page,
                 'limit': request.limit
             }
+            if request.facets:
+                content['facets'] = await facet_counts(session, filters, request.facets)
+            return catalog_cache.put(cache_key, content).response(http_request)
 
         except Exception as e:
             return JSONResponse(
@@ -186,6 +255,7 @@ async def search_book_filter(request: FilterBook):
             )
 
 @book_router.post("/by-uid")
+@read_only
 async def search_book_filter(request: list[UIDBooks], user_info=Depends(get_current_user)):
     async with async_session_factory() as session:
         try:
@@ -215,7 +285,9 @@ async def search_book_filter(request: list[UIDBooks], user_info=Depends(get_curr
                         'author': book.author,
                         'category': book.category,
                         'summary': book.summary,
-                        'availability': book.availability
+                        'availability': book.availability,
+                        'total_copies': book.total_copies,
+                        'available_copies': book.available_copies
                     } for book in books_result
                 ]
             }
@@ -230,23 +302,210 @@ async def search_book_filter(request: list[UIDBooks], user_info=Depends(get_curr
 
 
 @book_router.get("/available")
-async def available_book():
+@read_only
+async def available_book(http_request: Request):
+    # the random sample is shared by everyone until the entry expires
+    cached = catalog_cache.get('available')
+    if cached is not None:
+        return cached.response(http_request)
     async with async_session_factory() as session:
         try:
-            result = await session.execute(select(Books).order_by(func.random()).where(Books.availability == True).limit(10))
+            result = await session.execute(select(Books).order_by(func.random()).where(Books.available_copies > 0).limit(10))
             books_result = result.scalars().all()
             if not books_result:
                 raise Exception("No books available.")
-            return {
+            return catalog_cache.put('available', {
                 'resp_msg': 'Here is the list of available books.',
                 'resp_data': [{
                         'title': book.title,
                         'author': book.author,
                         'category': book.category,
                         'summary': book.summary,
-                        'availability': book.availability
+                        'availability': book.availability,
+                        'total_copies': book.total_copies,
+                        'available_copies': book.available_copies
                     } for book in books_result
                 ]
+            }).response(http_request)
+        except Exception as e:
+            return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content = {
+                'resp_msg': str(e),
+                'resp_data': None
+            }
+        )
+
+@book_router.get("/{book_id}/similar")
+@read_only
+async def similar_books(book_id: uuid.UUID, limit: int = Query(10, ge=1, le=50)):
+    async with async_session_factory() as session:
+        try:
+            result = await session.execute(
+                select(Books, BookSimilarities.score)
+                .join(BookSimilarities, BookSimilarities.similar_book_id == Books.uid)
+                .where(BookSimilarities.book_id == book_id)
+                .order_by(BookSimilarities.rank)
+                .limit(limit))
+            similar = result.all()
+            if not similar:
+                raise Exception("No similar books found.")
+            return {
+                'resp_msg': 'Readers who borrowed this book also borrowed:',
+                'resp_data': [{
+                        'uid': book.uid,
+                        'title': book.title,
+                        'author': book.author,
+                        'category': book.category,
+                        'availability': book.availability,
+                        'available_copies': book.available_copies,
+                        'score': round(score, 4)
+                    } for book, score in similar
+                ]
+            }
+        except Exception as e:
+            return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content = {
+                'resp_msg': str(e),
+                'resp_data': None
+            }
+        )
+
+@book_router.get("/suggest")
+@read_only
+async def suggest_books(q: str = Query(..., min_length=1), limit: int = Query(8, ge=1, le=20)):
+    try:
+        suggestions = suggest_index.suggest(q, limit)
+        if not suggestions:
+            raise Exception("No suggestions found.")
+        return {
+            'resp_msg': 'Suggestions:',
+            'resp_data': suggestions
+        }
+    except Exception as e:
+        return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content = {
+            'resp_msg': str(e),
+            'resp_data': None
+        }
+    )
+
+@book_router.get("/trending")
+@read_only
+async def trending_books(limit: int = Query(10, ge=1, le=Config.POPULARITY_LEADERBOARD_SIZE)):
+    try:
+        books_result = popularity.leaderboards['trending'][:limit]
+        if not books_result:
+            raise Exception("No trending books yet.")
+        return {
+            'resp_msg': 'Trending books:',
+            'resp_data': books_result
+        }
+    except Exception as e:
+        return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content = {
+            'resp_msg': str(e),
+            'resp_data': None
+        }
+    )
+
+@book_router.get("/most-borrowed")
+@read_only
+async def most_borrowed_books(limit: int = Query(10, ge=1, le=Config.POPULARITY_LEADERBOARD_SIZE)):
+    try:
+        books_result = popularity.leaderboards['most_borrowed'][:limit]
+        if not books_result:
+            raise Exception("No books have been borrowed yet.")
+        return {
+            'resp_msg': 'Most borrowed books:',
+            'resp_data': books_result
+        }
+    except Exception as e:
+        return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content = {
+            'resp_msg': str(e),
+            'resp_data': None
+        }
+    )
+
+@book_router.get("/top-rated")
+@read_only
+async def top_rated_books(limit: int = Query(10, ge=1, le=Config.POPULARITY_LEADERBOARD_SIZE)):
+    try:
+        books_result = popularity.leaderboards['top_rated'][:limit]
+        if not books_result:
+            raise Exception("No books have been rated yet.")
+        return {
+            'resp_msg': 'Top rated books:',
+            'resp_data': books_result
+        }
+    except Exception as e:
+        return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content = {
+            'resp_msg': str(e),
+            'resp_data': None
+        }
+    )
+
+def ranked_books(books_result, matches):
+    books = {book.uid: book for book in books_result}
+    return [{
+            'uid': uid,
+            'title': books[uid].title,
+            'author': books[uid].author,
+            'category': books[uid].category,
+            'availability': books[uid].availability,
+            'available_copies': books[uid].available_copies,
+            'score': round(score, 4)
+        } for uid, score in matches if uid in books
+    ]
+
+@book_router.get("/more-like-this")
+@read_only
+async def more_like_this_text(q: str = Query(..., min_length=1), limit: int = Query(10, ge=1, le=50)):
+    async with async_session_factory() as session:
+        try:
+            matches = text_search.similar((q,), limit)
+            result = await session.execute(select(Books).where(Books.uid.in_([uid for uid, _ in matches])))
+            books_result = ranked_books(result.scalars().all(), matches)
+            if not books_result:
+                raise Exception("No similar books found.")
+            return {
+                'resp_msg': 'Books similar to the query:',
+                'resp_data': books_result
+            }
+        except Exception as e:
+            return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content = {
+                'resp_msg': str(e),
+                'resp_data': None
+            }
+        )
+
+@book_router.get("/{book_id}/more-like-this")
+@read_only
+async def more_like_this_book(book_id: uuid.UUID, limit: int = Query(10, ge=1, le=50)):
+    async with async_session_factory() as session:
+        try:
+            result = await session.execute(select(Books).where(Books.uid == book_id))
+            book = result.scalar_one_or_none()
+            if not book:
+                raise Exception("Book not found.")
+            matches = text_search.similar((book.title, book.author, book.category, book.summary), limit,
+                                          exclude=book.uid)
+            result = await session.execute(select(Books).where(Books.uid.in_([uid for uid, _ in matches])))
+            books_result = ranked_books(result.scalars().all(), matches)
+            if not books_result:
+                raise Exception("No similar books found.")
+            return {
+                'resp_msg': 'Books with a similar description:',
+                'resp_data': books_result
             }
         except Exception as e:
             return JSONResponse(
@@ -258,6 +517,7 @@ async def available_book():
         )
 
 @book_router.put("/")
+@idempotent
 async def update_book(request: UpdateBook, user_info = Depends(get_current_user)):
     async with async_session_factory() as session:
         try:
@@ -276,8 +536,7 @@ async def update_book(request: UpdateBook, user_info = Depends(get_current_user)
             if not user:
                 raise Exception("User not found.")
             
-            result = await session.execute(select(Books).where(Books.uid == request.uid))
-            book_result = result.scalar_one_or_none()
+            book_result = await lock_book(session, request.uid)
             if not book_result:
                 raise Exception("Book not found.")
             
@@ -301,9 +560,22 @@ async def update_book(request: UpdateBook, user_info = Depends(get_current_user)
                 book_result.category = request.category
             if request.summary:
                 book_result.summary = request.summary
+
+            # copies are counted in the database, see repositories/reservations.py
+            if request.removed_barcodes:
+                await remove_barcodes(session, book_result, request.removed_barcodes)
+            # the counter updates bypass the session, so the delta is taken once before any of them
+            delta = (request.total_copies or book_result.total_copies) - book_result.total_copies
+            if delta < 0:
+                await remove_copies(session, book_result, -delta)
+            if delta > 0 or request.barcodes:
+                await add_copies(session, book_result, max(delta, 0), request.barcodes)
         
             session.add(book_result)
+            await publish_book_changes(session, 'upsert', [book_result])
             await session.commit()
+            catalog_cache.clear()
+            text_search.index_books([book_result])
             await session.refresh(book_result)
             return {
                 'resp_msg': "The book's detail has been updated successfully.",
@@ -311,7 +583,9 @@ async def update_book(request: UpdateBook, user_info = Depends(get_current_user)
                     'title':book_result.title,
                     'author':book_result.author,
                     'category':book_result.category,
-                    'summary':book_result.summary
+                    'summary':book_result.summary,
+                    'total_copies':book_result.total_copies,
+                    'available_copies':book_result.available_copies
                 }
             }
         except Exception as e:
@@ -324,6 +598,7 @@ async def update_book(request: UpdateBook, user_info = Depends(get_current_user)
         )
 
 @book_router.delete("/{book_id}")
+@idempotent
 async def delete_book(book_id: uuid.UUID, user_info = Depends(get_current_user)):
     async with async_session_factory() as session:
         try:
@@ -348,7 +623,9 @@ async def delete_book(book_id: uuid.UUID, user_info = Depends(get_current_user))
                 raise Exception("Book not found.")
             
             await session.delete(book_result)
+            await publish_book_changes(session, 'delete', [book_result])
             await session.commit()
+            catalog_cache.clear()
             return {
                 'resp_msg': 'The book has been deleted.',
                 'resp_data': None
@@ -371,6 +648,7 @@ async def delete_book(book_id: uuid.UUID, user_info = Depends(get_current_user))
         )
 
 @book_router.post("/by-title")
+@read_only
 async def book_by_title(request: SearchBook, user_info = Depends(get_current_user)):
     async with async_session_factory() as session:
         try:
@@ -401,7 +679,9 @@ async def book_by_title(request: SearchBook, user_info = Depends(get_current_use
                         'author': book.author,
                         'category': book.category,
                         'summary': book.summary,
-                        'availability': book.availability
+                        'availability': book.availability,
+                        'total_copies': book.total_copies,
+                        'available_copies': book.available_copies
                     } for book in books_result
                 ]
             }
@@ -0,0 +1,36 @@
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse
+
+from startup.warmup import readiness, warm_up_pool, ping_db
+
+
+health_router = APIRouter()
+
+@health_router.get("/healthz")
+async def healthz():
+    return {
+        'resp_msg': 'alive',
+        'resp_data': None
+    }
+
+@health_router.get("/readyz")
+async def readyz():
+    try:
+        if not readiness.warmed_up:
+            if readiness.lock.locked():
+                raise Exception("Warming up the connection pool.")
+            # a failed warm-up at startup is retried here so the worker can recover
+            await warm_up_pool()
+        await ping_db()
+        return {
+            'resp_msg': 'ready',
+            'resp_data': None
+        }
+    except Exception as e:
+        return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content = {
+            'resp_msg': str(e) or e.__class__.__name__,
+            'resp_data': None
+        }
+    )
@@ -0,0 +1,148 @@
+from fastapi import APIRouter, status, Depends
+from fastapi.responses import JSONResponse, FileResponse
+from sqlalchemy.future import select
+from sqlalchemy import func, desc
+import uuid
+import os
+
+from startup.db_config import async_session_factory
+from api.schemas.job import SubmitJob, ListJobs
+from repositories.models import Jobs
+from middleware.idempotency import idempotent
+from utils.auth import get_current_admin
+from utils.jobs import job_runner, job_entry
+from utils.job_kinds import export_path
+
+
+job_router = APIRouter()
+
+@job_router.post("/")
+@idempotent
+async def submit_job(request: SubmitJob, user_info = Depends(get_current_admin)):
+    async with async_session_factory() as session:
+        try:
+            if user_info[1] != '':
+                raise Exception(user_info[1])
+            job = await job_runner.submit(session, request.kind, request.params, user_info[0].get('uid'))
+            await session.commit()
+            return JSONResponse(
+                status_code=status.HTTP_202_ACCEPTED,
+                content={
+                    'resp_msg': 'The job has been queued.',
+                    'resp_data': {'uid': str(job.uid), 'kind': job.kind, 'status': job.status}
+                },
+                headers={'Location': f"/api/v1/jobs/{job.uid}"}
+            )
+        except Exception as e:
+            return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content = {
+                'resp_msg': str(e),
+                'resp_data': None
+            }
+        )
+
+@job_router.post("/list")
+async def list_jobs(request: ListJobs, user_info = Depends(get_current_admin)):
+    async with async_session_factory() as session:
+        try:
+            if user_info[1] != '':
+                raise Exception(user_info[1])
+            offset = (request.page - 1) * request.limit
+            filters = []
+            if request.status:
+                filters.append(Jobs.status == request.status)
+            if request.kind:
+                filters.append(Jobs.kind == request.kind)
+
+            total_count = (await session.execute(select(func.count()).select_from(Jobs).where(*filters))).scalar()
+            result = await session.execute(
+                select(Jobs).where(*filters).order_by(desc(Jobs.created_at)).offset(offset).limit(request.limit))
+            return {
+                'resp_msg': 'Jobs (most recent first):',
+                'resp_data': [job_entry(job) for job in result.scalars().all()],
+                'total': total_count,
+                'page': request.page,
+                'limit': request.limit
+            }
+        except Exception as e:
+            return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content = {
+                'resp_msg': str(e),
+                'resp_data': None
+            }
+        )
+
+@job_router.get("/{job_id}")
+async def get_job(job_id: uuid.UUID, user_info = Depends(get_current_admin)):
+    async with async_session_factory() as session:
+        try:
+            if user_info[1] != '':
+                raise Exception(user_info[1])
+            job = await session.get(Jobs, job_id)
+            if not job:
+                raise Exception("Job not found.")
+            return {
+                'resp_msg': 'Job status:',
+                'resp_data': job_entry(job)
+            }
+        except Exception as e:
+            return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content = {
+                'resp_msg': str(e),
+                'resp_data': None
+            }
+        )
+
+@job_router.post("/{job_id}/cancel")
+async def cancel_job(job_id: uuid.UUID, user_info = Depends(get_current_admin)):
+    async with async_session_factory() as session:
+        try:
+            if user_info[1] != '':
+                raise Exception(user_info[1])
+            result = await session.execute(select(Jobs).where(Jobs.uid == job_id).with_for_update())
+            job = result.scalar_one_or_none()
+            if not job:
+                raise Exception("Job not found.")
+            await job_runner.cancel(session, job)
+            await session.commit()
+            return {
+                'resp_msg': 'The job has been cancelled.' if job.status == 'cancelled' else
+                            'Cancellation requested, the job will stop shortly.',
+                'resp_data': job_entry(job)
+            }
+        except Exception as e:
+            return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content = {
+                'resp_msg': str(e),
+                'resp_data': None
+            }
+        )
+
+@job_router.get("/{job_id}/download")
+async def download_job_result(job_id: uuid.UUID, user_info = Depends(get_current_admin)):
+    async with async_session_factory() as session:
+        try:
+            if user_info[1] != '':
+                raise Exception(user_info[1])
+            job = await session.get(Jobs, job_id)
+            if not job or job.kind != 'export_books':
+                raise Exception("Export job not found.")
+            if job.status != 'succeeded':
+                raise Exception(f"The export is {job.status}.")
+            path = export_path(job.uid)
+            if not os.path.exists(path):
+                # exports are written to the disk of the worker that ran them
+                raise Exception(f"The export file is not on this worker, it was written by {job.worker}.")
+            return FileResponse(path, media_type="text/csv", filename=os.path.basename(path))
+        except Exception as e:
+            return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content = {
+                'resp_msg': str(e),
+                'resp_data': None
+            }
+        )
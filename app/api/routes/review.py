@@ -12,12 +12,17 @@ from datetime import datetime,timedelta
 from startup.db_config import engine,async_session_factory
 from api.schemas.review import AddReview,GetReview,UpdateReview,GetBookReview
 from repositories.models import Users, Books,Transactions,BookReviews
+from middleware.idempotency import idempotent
+from utils.routing import read_only
 from utils.auth import get_current_user
+from utils.rate_limit import rate_limit
+from utils.popularity import popularity
 
 
 review_router = APIRouter()
 
-@review_router.post("/")
+@review_router.post("/", dependencies=[Depends(rate_limit("review"))])
+@idempotent
 async def add_review(request: AddReview, user_info = Depends(get_current_user)):
     async with async_session_factory() as session:
         try:
@@ -51,6 +56,7 @@ async def add_review(request: AddReview, user_info = Depends(get_current_user)):
 
             session.add(new_review)
             await session.commit()
+            popularity.record_rating(new_review.book_id, float(new_review.rating), 1)
             return {
                 'resp_msg': 'Your review has been posted successfully!',
                 'resp_data': {
@@ -71,6 +77,7 @@ async def add_review(request: AddReview, user_info = Depends(get_current_user)):
         )
 
 @review_router.get("/")
+@read_only
 async def get_review(request: GetReview, user_info = Depends(get_current_user)):
     async with async_session_factory() as session:
         try:
@@ -114,6 +121,7 @@ async def get_review(request: GetReview, user_info = Depends(get_current_user)):
         )
 
 @review_router.get("/book")
+@read_only
 async def get_book_review(request: GetBookReview, user_info = Depends(get_current_user)):
     async with async_session_factory() as session:
         try:
@@ -157,7 +165,8 @@ async def get_book_review(request: GetBookReview, user_info = Depends(get_curren
             }
         )
 
-@review_router.put("/")
+@review_router.put("/", dependencies=[Depends(rate_limit("review"))])
+@idempotent
 async def update_review(request: UpdateReview, user_info = Depends(get_current_user)):
     async with async_session_factory() as session:
         try:
@@ -180,12 +189,14 @@ async def update_review(request: UpdateReview, user_info = Depends(get_current_u
             if not review_result:
                 raise Exception("Review not found.")
             book_result = review_result.review_book
+            previous_rating = float(review_result.rating)
             if request.rating:
                 review_result.rating = request.rating
             if request.description:
                 review_result.description = request.description
             session.add(review_result)
             await session.commit()
+            popularity.record_rating(review_result.book_id, float(review_result.rating) - previous_rating, 0)
             await session.refresh(review_result)
             return {
                 'resp_msg': 'Review updated.',
@@ -209,6 +220,7 @@ async def update_review(request: UpdateReview, user_info = Depends(get_current_u
         )
 
 @review_router.delete("/")
+@idempotent
 async def delete_review(request: GetReview, user_info = Depends(get_current_user)):
     async with async_session_factory() as session:
         try:
@@ -233,6 +245,7 @@ async def delete_review(request: GetReview, user_info = Depends(get_current_user
             
             await session.delete(review_result)
             await session.commit()
+            popularity.record_rating(review_result.book_id, -float(review_result.rating), -1)
             return {
                 'resp_msg': 'Review deleted.',
                 'resp_data': None
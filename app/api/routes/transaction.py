@@ -1,22 +1,97 @@
 from fastapi import APIRouter, HTTPException,status,Header, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy import text, and_,func,asc,desc
 from sqlalchemy.orm import selectinload
 from sqlmodel import SQLModel
-from typing import List
+from typing import List, Optional
 import uuid
 from datetime import datetime,timedelta
 
 from startup.db_config import engine,async_session_factory
-from api.schemas.transaction import RequestBorrow,ReturnBook,PendingRequest,Pagination
-from repositories.models import Users, Books,Transactions, Requests
+from api.schemas.transaction import (RequestBorrow,ReturnBook,PendingRequest,AcceptRequest,RequestPage,ProcessedRequestPage,
+                                     OngoingTransactionPage,FinishedTransactionPage)
+from repositories.models import Users, Books,Transactions, Requests, TransactionsArchive, RequestsArchive
+from repositories.archive import page_across
+from middleware.idempotency import idempotent
+from utils.routing import read_only
 from utils.auth import get_current_user,get_current_admin
+from utils.rate_limit import rate_limit
+from utils.response_cache import catalog_cache
+from utils.request_events import request_events, publish_request_event
+from repositories.reservations import (lock_book, queue_length, pending_count, claim_copy, requeue_unserved,
+                                       find_copy, release_copy)
+from utils.popularity import popularity
 
 transaction_router = APIRouter()
 
-@transaction_router.post("/borrow-request/")
+# response fields of the listings, see the *Page schemas for what each one allows
+REQUEST_FIELDS = {
+    'uid': lambda req: req.uid,
+    'username': lambda req: req.request_user.username,
+    'name': lambda req: req.request_user.name,
+    'book_title': lambda req: req.borrowed_book.title,
+    'date_request': lambda req: req.requested_at.date().isoformat(),
+    'time_request': lambda req: req.requested_at.time().isoformat(timespec='minutes'),
+    'date_update': lambda req: req.updated_at.date().isoformat(),
+    'time_update': lambda req: req.updated_at.time().isoformat(timespec='minutes'),
+    'duration': lambda req: req.duration,
+    'description': lambda req: req.description,
+    'status': lambda req: req.status
+}
+
+TRANSACTION_FIELDS = {
+    'uid': lambda trx: trx.uid,
+    'name': lambda trx: trx.transaction_from_request.request_user.name,
+    'book_title': lambda trx: trx.transaction_from_request.borrowed_book.title,
+    'date_create': lambda trx: trx.created_at.date().isoformat(),
+    'time_create': lambda trx: trx.created_at.time().isoformat(timespec='minutes'),
+    'date_returned': lambda trx: trx.returned_at.date().isoformat(),
+    'time_returned': lambda trx: trx.returned_at.time().isoformat(timespec='minutes'),
+    'due_date': lambda trx: trx.due_date.date().isoformat(),
+    'is_overdue': lambda trx: trx.is_overdue
+}
+
+def request_loaders(fields, model=Requests):
+    # only join what the requested fields read
+    options = []
+    if 'username' in fields or 'name' in fields:
+        options.append(selectinload(model.request_user))
+    if 'book_title' in fields:
+        options.append(selectinload(model.borrowed_book))
+    return options
+
+def transaction_loaders(fields, model=Transactions, request_model=Requests):
+    options = []
+    if 'name' in fields:
+        options.append(selectinload(model.transaction_from_request).selectinload(request_model.request_user))
+    if 'book_title' in fields:
+        options.append(selectinload(model.transaction_from_request).selectinload(request_model.borrowed_book))
+    return options
+
+# archived rows have the same attributes, so the listings of finished work read both tables
+def processed_request_sources(fields, user_id=None):
+    hot_filters, archive_filters = [Requests.status.in_(["accepted", "rejected"])], []
+    if user_id is not None:
+        hot_filters.append(Requests.user_id == user_id)
+        archive_filters.append(RequestsArchive.user_id == user_id)
+    return [(Requests, hot_filters, request_loaders(fields)),
+            (RequestsArchive, archive_filters, request_loaders(fields, RequestsArchive))]
+
+def finished_transaction_sources(fields, user_id=None):
+    hot_filters, archive_filters = [Transactions.returned_at.is_not(None)], []
+    if user_id is not None:
+        hot_filters.append(Transactions.transaction_from_request.has(Requests.user_id == user_id))
+        archive_filters.append(TransactionsArchive.transaction_from_request.has(RequestsArchive.user_id == user_id))
+    return [(Transactions, hot_filters, transaction_loaders(fields)),
+            (TransactionsArchive, archive_filters, transaction_loaders(fields, TransactionsArchive, RequestsArchive))]
+
+def pick_fields(getters, fields, obj):
+    return {name: getters[name](obj) for name in fields}
+
+@transaction_router.post("/borrow-request/", dependencies=[Depends(rate_limit("borrow-request"))])
+@idempotent
 async def borrow_request(request: RequestBorrow, user_info = Depends(get_current_user)):
     async with async_session_factory() as session:
         try:
@@ -30,33 +105,52 @@ async def borrow_request(request: RequestBorrow, user_info = Depends(get_current
             user_borrow = result.scalar_one_or_none()
             if not user_borrow:
                 raise Exception("User not found.")
-            result = await session.execute(select(Books).where(Books.uid == request.book_id))
-            book_result = result.scalar_one_or_none()
+            book_result = await lock_book(session, request.book_id)
             if not book_result:
                 raise Exception("Book not found.")
-            if book_result.availability == False:
-                raise Exception("Book is not available.")
             
-            result = await session.execute(select(Requests).where((Requests.book_id == request.book_id) & (Requests.user_id == uid) & (Requests.status =='pending')))
-            req_result = result.scalar_one_or_none()
+            result = await session.execute(select(Requests).where((Requests.book_id == request.book_id) & (Requests.user_id == uid) & (Requests.status.in_(['pending', 'queued']))))
+            req_result = result.scalars().first()
+            if req_result and req_result.status == 'queued':
+                raise Exception("You're already in the waiting list for this book.")
             if req_result:
                 raise Exception("You're already requesting for this book, please wait for your request to be processed.")
 
+            # with no free copy left every copy is lent out or held for the head of the queue
+            queue_position = None
+            if book_result.available_copies == 0:
+                queue_position = await queue_length(session, book_result.uid) + 1
+
             new_request = Requests(
                 user_id=user_borrow.uid,
                 book_id=book_result.uid,
                 requested_at=datetime.utcnow(),
-                duration=request.duration
+                duration=request.duration,
+                status='pending' if queue_position is None else 'queued'
             )
                         
             session.add(new_request)
+            await session.flush()
+            if queue_position is None:
+                await publish_request_event(session, 'request_created', {
+                    'uid': new_request.uid,
+                    'username': user_borrow.username,
+                    'name': user_borrow.name,
+                    'book_title': book_result.title,
+                    'requested_at': new_request.requested_at,
+                    'duration': new_request.duration
+                })
             await session.commit()
+            popularity.record_borrow_request(book_result.uid)
             return {
-                'resp_msg': 'Request is sent!',
+                'resp_msg': 'Request is sent!' if queue_position is None else
+                            'Every copy of this book is currently borrowed, you have been added to the waiting list.',
                 'resp_data': {
                     'borrower':user_borrow.username,
                     'borrowed_book':book_result.title,
-                    'duration':new_request.duration
+                    'duration':new_request.duration,
+                    'status':new_request.status,
+                    'queue_position':queue_position
                 }
             }
         except Exception as e:
@@ -69,7 +163,8 @@ async def borrow_request(request: RequestBorrow, user_info = Depends(get_current
         )
 
 @transaction_router.post("/pending-request/")
-async def pending_request(request: Pagination, user_info = Depends(get_current_admin)):
+@read_only
+async def pending_request(request: RequestPage, user_info = Depends(get_current_admin)):
     async with async_session_factory() as session:
         try:
             if user_info[1] != '':
@@ -84,8 +179,9 @@ async def pending_request(request: Pagination, user_info = Depends(get_current_a
             
 
             offset = (request.page - 1) * request.limit
+            fields = request.selected_fields()
             base_query = (select(Requests)
-                          .options(selectinload(Requests.borrowed_book),selectinload(Requests.request_user))
+                          .options(*request_loaders(fields))
                           .where(Requests.status == "pending"))
 
             count_query = select(func.count()).select_from(base_query.subquery())
@@ -102,16 +198,7 @@ async def pending_request(request: Pagination, user_info = Depends(get_current_a
 
             return {
                 'resp_msg': 'Pending request:',
-                'resp_data': [{
-                    'uid':request.uid,
-                    'username':request.request_user.username,
-                    'name':request.request_user.name,
-                    'book_title':request.borrowed_book.title,
-                    'date_request': request.requested_at.date().isoformat(),
-                    'time_request': request.requested_at.time().isoformat(timespec='minutes'),
-                    'duration':request.duration,
-                    'status':request.status
-                } for request in request_result],
+                'resp_data': [pick_fields(REQUEST_FIELDS, fields, req) for req in request_result],
                 'total': total_count,
                 'page': request.page,
                 'limit': request.limit
@@ -125,8 +212,28 @@ async def pending_request(request: Pagination, user_info = Depends(get_current_a
             }
         )
 
+@transaction_router.get("/pending-request/events")
+async def pending_request_events(user_info = Depends(get_current_admin), last_event_id: Optional[str] = Header(None)):
+    try:
+        if user_info[1] != '':
+            raise Exception(user_info[1])
+        return StreamingResponse(
+            request_events.stream(last_event_id),
+            media_type="text/event-stream",
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    except Exception as e:
+        return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content = {
+            'resp_msg': str(e),
+            'resp_data': None
+        }
+    )
+
 @transaction_router.post("/processed-request/")
-async def processed_request(request: Pagination, user_info = Depends(get_current_admin)):
+@read_only
+async def processed_request(request: ProcessedRequestPage, user_info = Depends(get_current_admin)):
     async with async_session_factory() as session:
         try:
             if user_info[1] != '':
@@ -139,38 +246,17 @@ async def processed_request(request: Pagination, user_info = Depends(get_current
             if not user_admin:
                 raise Exception("User not found.")
             
-            base_query = (select(Requests)
-                          .options(selectinload(Requests.borrowed_book),selectinload(Requests.request_user))
-                          .where(Requests.status.in_(["accepted","rejected"])))
-
+            fields = request.selected_fields()
             offset = (request.page - 1) * request.limit
-            count_query = select(func.count()).select_from(base_query.subquery())
-            total_result = await session.execute(count_query)
-            total_count = total_result.scalar()
-
-            # Paginated data
-            result = await session.execute(
-                base_query.offset(offset).limit(request.limit).order_by(asc(Requests.requested_at)))
-            request_result = result.scalars().all()
+            total_count, request_result = await page_across(
+                session, processed_request_sources(fields), 'requested_at', offset, request.limit)
 
             if not request_result:
                 raise Exception("No processed request is found.")
 
             return {
                 'resp_msg': 'Processed request:',
-                'resp_data': [{
-                    'uid':request.uid,
-                    'username':request.request_user.username,
-                    'name':request.request_user.name,
-                    'book_title':request.borrowed_book.title,
-                    'date_request': request.requested_at.date().isoformat(),
-                    'time_request': request.requested_at.time().isoformat(timespec='minutes'),
-                    'date_update': request.updated_at.date().isoformat(),
-                    'time_update': request.updated_at.time().isoformat(timespec='minutes'),
-                    'duration':request.duration,
-                    'description':request.description,
-                    'status':request.status
-                } for request in request_result],
+                'resp_data': [pick_fields(REQUEST_FIELDS, fields, req) for req in request_result],
                 'total': total_count,
                 'page': request.page,
                 'limit': request.limit
@@ -185,7 +271,8 @@ async def processed_request(request: Pagination, user_info = Depends(get_current
         )
 
 @transaction_router.post("/accept/")
-async def accept(request: PendingRequest, user_info = Depends(get_current_admin)):
+@idempotent
+async def accept(request: AcceptRequest, user_info = Depends(get_current_admin)):
     async with async_session_factory() as session:
         try:
             if user_info[1] != '':
@@ -198,35 +285,30 @@ async def accept(request: PendingRequest, user_info = Depends(get_current_admin)
             if not user_admin:
                 raise Exception("User not found.")
             
-            result = await session.execute(select(Requests)
-                                           .options(selectinload(Requests.borrowed_book))
-                                           .where(Requests.uid == request.request_id))
+            result = await session.execute(select(Requests).where(Requests.uid == request.request_id))
             request_result = result.scalar_one_or_none()
             if not request_result:
                 raise Exception("No request found.")
+            if request_result.status == "queued":
+                raise Exception("This request is waiting in the queue until the book is returned.")
             if request_result.status != "pending":
                 raise Exception("This request has already been processed.")
 
-            book_result = request_result.borrowed_book
-            if not book_result:
-                raise Exception("Book not found.")
-            if book_result.availability == False:
+            copy = None
+            if request.barcode:
+                copy = await find_copy(session, request_result.book_id, request.barcode)
+            claimed = await claim_copy(session, request_result.book_id)
+            if not claimed:
                 raise Exception("Book is not available.")
-            book_result.availability = False
-
-            result = await session.execute(
-                select(Requests)
-                .options(selectinload(Requests.borrowed_book))
-                .where(
-                    Requests.book_id == book_result.uid,
-                    Requests.uid != request.request_id,
-                    Requests.status == "pending"
-                )
-            )
-            rejected_requests = result.scalars().all()
-            for req in rejected_requests:
-                req.status = "rejected"
-                req.description = "This request is automatically rejected because the book has already been borrowed"
+            available_copies, held_copies = claimed
+
+            queued_requests = []
+            if available_copies == 0:
+                queued_requests = await requeue_unserved(session, request_result.book_id, held_copies,
+                                                         request_result.uid)
+            for req in queued_requests:
+                req.status = "queued"
+                req.updated_at = datetime.utcnow()
             
             due_date = datetime.utcnow() + timedelta(days=request_result.duration)
             due_date = due_date.replace(hour=23, minute=59, second=59, microsecond=999999)
@@ -234,7 +316,8 @@ async def accept(request: PendingRequest, user_info = Depends(get_current_admin)
             new_transaction = Transactions(
                 admin_id=user_admin.uid,
                 request_id=request_result.uid,
-                due_date=due_date
+                due_date=due_date,
+                copy_id=copy.uid if copy else None
             )
 
             request_result.status = "accepted"
@@ -242,24 +325,30 @@ async def accept(request: PendingRequest, user_info = Depends(get_current_admin)
             if request.description:
                 request_result.description = request.description
             session.add(new_transaction)
+            await publish_request_event(session, 'request_accepted', {'uid': request_result.uid})
+            for req in queued_requests:
+                await publish_request_event(session, 'request_queued', {'uid': req.uid})
             
             await session.commit()
+            catalog_cache.clear()
+            popularity.record_accept(request_result.book_id)
             return {
                     'resp_msg': 'Request accepted!',
                     'resp_data': {'New transaction':{
                         'request_id':new_transaction.request_id,
                         'created_at': new_transaction.created_at,
-                        'due_date': new_transaction.due_date
-                    },'Rejected Requests':
+                        'due_date': new_transaction.due_date,
+                        'barcode': copy.barcode if copy else None,
+                        'available_copies': available_copies
+                    },'Queued Requests':
                     [
                     {   'uid':req.uid,
                         'user_id': req.user_id,
                         'book_id': req.book_id,
                         'status': req.status,
-                        'description': req.description,
                         'date_update': req.updated_at.date().isoformat(),
                         'time_update': req.updated_at.time().isoformat(timespec='minutes'),
-                    } for req in rejected_requests
+                    } for req in queued_requests
                 ]
                     }
                 }
@@ -273,6 +362,7 @@ async def accept(request: PendingRequest, user_info = Depends(get_current_admin)
         )
 
 @transaction_router.post("/reject/")
+@idempotent
 async def reject(request: PendingRequest, user_info = Depends(get_current_admin)):
     async with async_session_factory() as session:
         try:
@@ -289,15 +379,28 @@ async def reject(request: PendingRequest, user_info = Depends(get_current_admin)
             request_result = result.scalar_one_or_none()
             if not request_result:
                 raise Exception("No request found.")
-            if request_result.status != "pending":
+            if request_result.status not in ("pending", "queued"):
                 raise Exception("This request has already been processed.")
+            was_pending = request_result.status == "pending"
 
             request_result.status = "rejected"
             request_result.updated_at = datetime.utcnow()
             if request.description:
                 request_result.description = request.description
             session.add(request_result)
+            await publish_request_event(session, 'request_rejected', {'uid': request_result.uid})
+
+            # a held copy nobody pending is left to claim goes on to the next one in the queue
+            released = False
+            if was_pending:
+                book_result = await lock_book(session, request_result.book_id)
+                released = (book_result is not None
+                            and book_result.held_copies > await pending_count(session, book_result.uid))
+                if released:
+                    await release_copy(session, book_result, from_hold=True)
             await session.commit()
+            if released:
+                catalog_cache.clear()
             return {
                     'resp_msg': 'Request rejected!',
                     'resp_data': {
@@ -320,7 +423,8 @@ async def reject(request: PendingRequest, user_info = Depends(get_current_admin)
         )
 
 @transaction_router.post("/ongoing-transaction/")
-async def ongoing_transaction(request : Pagination, user_info = Depends(get_current_admin)):
+@read_only
+async def ongoing_transaction(request : OngoingTransactionPage, user_info = Depends(get_current_admin)):
     async with async_session_factory() as session:
         try:
             if user_info[1] != '':
@@ -333,9 +437,9 @@ async def ongoing_transaction(request : Pagination, user_info = Depends(get_curr
             if not user_admin:
                 raise Exception("User not found.")
             
+            fields = request.selected_fields()
             base_query = (select(Transactions)
-                          .options(selectinload(Transactions.transaction_from_request).selectinload(Requests.borrowed_book),
-                                   selectinload(Transactions.transaction_from_request).selectinload(Requests.request_user))
+                          .options(*transaction_loaders(fields))
                           .where(Transactions.returned_at.is_(None)))
             
             offset = (request.page - 1) * request.limit
@@ -353,14 +457,7 @@ async def ongoing_transaction(request : Pagination, user_info = Depends(get_curr
 
             return {
                 'resp_msg': 'Ongoing transactions:',
-                'resp_data': [{
-                    'uid':trx.uid,
-                    'name':trx.transaction_from_request.request_user.name,
-                    'book_title':trx.transaction_from_request.borrowed_book.title,
-                    'date_create': trx.created_at.date().isoformat(),      # 'YYYY-MM-DD'
-                    'time_create': trx.created_at.time().isoformat(timespec='minutes'),  # 'HH:MM'
-                    'due_date': trx.due_date.date().isoformat()
-                } for trx in transaction_result],
+                'resp_data': [pick_fields(TRANSACTION_FIELDS, fields, trx) for trx in transaction_result],
                 'total': total_count,
                 'page': request.page,
                 'limit': request.limit
@@ -375,7 +472,8 @@ async def ongoing_transaction(request : Pagination, user_info = Depends(get_curr
         )
 
 @transaction_router.post("/finished-transaction/")
-async def finished_transaction(request : Pagination, user_info = Depends(get_current_admin)):
+@read_only
+async def finished_transaction(request : FinishedTransactionPage, user_info = Depends(get_current_admin)):
     async with async_session_factory() as session:
         try:
             if user_info[1] != '':
@@ -388,33 +486,16 @@ async def finished_transaction(request : Pagination, user_info = Depends(get_cur
             if not user_admin:
                 raise Exception("User not found.")
             
-            base_query = (select(Transactions)
-                            .options(selectinload(Transactions.transaction_from_request).selectinload(Requests.borrowed_book),
-                                    selectinload(Transactions.transaction_from_request).selectinload(Requests.request_user))
-                            .where(Transactions.returned_at.is_not(None)))
+            fields = request.selected_fields()
             offset = (request.page - 1) * request.limit
-            count_query = select(func.count()).select_from(base_query.subquery())
-            total_result = await session.execute(count_query)
-            total_count = total_result.scalar()
-
-            # Paginated data
-            result = await session.execute(
-                base_query.offset(offset).limit(request.limit).order_by(asc(Transactions.due_date)))
-            transaction_result = result.scalars().all()
+            total_count, transaction_result = await page_across(
+                session, finished_transaction_sources(fields), 'due_date', offset, request.limit)
             if not transaction_result:
                 raise Exception("There is no finished transactions.")
 
             return {
                 'resp_msg': 'Finished transactions:',
-                'resp_data': [{
-                    'uid':trx.uid,
-                    'name':trx.transaction_from_request.request_user.name,
-                    'book_title':trx.transaction_from_request.borrowed_book.title,
-                    'date_returned': trx.returned_at.date().isoformat(),
-                    'time_returned': trx.returned_at.time().isoformat(timespec='minutes'),
-                    'due_date': trx.due_date.date().isoformat(),
-                    'is_overdue': trx.is_overdue
-                } for trx in transaction_result],
+                'resp_data': [pick_fields(TRANSACTION_FIELDS, fields, trx) for trx in transaction_result],
                 'total': total_count,
                 'page': request.page,
                 'limit': request.limit
@@ -428,7 +509,8 @@ async def finished_transaction(request : Pagination, user_info = Depends(get_cur
             }
         )
 @transaction_router.post("/user-ongoing-transaction/")
-async def user_ongoing_transaction(request : Pagination, user_info = Depends(get_current_user)):
+@read_only
+async def user_ongoing_transaction(request : OngoingTransactionPage, user_info = Depends(get_current_user)):
     async with async_session_factory() as session:
         try:
             if user_info[1] != '':
@@ -441,9 +523,9 @@ async def user_ongoing_transaction(request : Pagination, user_info = Depends(get
             if not user:
                 raise Exception("User not found.")
             
+            fields = request.selected_fields()
             base_query = (select(Transactions)
-                            .options(selectinload(Transactions.transaction_from_request).selectinload(Requests.borrowed_book),
-                                    selectinload(Transactions.transaction_from_request).selectinload(Requests.request_user))
+                            .options(*transaction_loaders(fields))
                             .where(Transactions.returned_at.is_(None),
                                     Requests.request_user.has(uid=user.uid)))
             offset = (request.page - 1) * request.limit
@@ -460,14 +542,7 @@ async def user_ongoing_transaction(request : Pagination, user_info = Depends(get
 
             return {
                 'resp_msg': 'Ongoing transactions:',
-                'resp_data': [{
-                    'uid':trx.uid,
-                    'name':trx.transaction_from_request.request_user.name,
-                    'book_title':trx.transaction_from_request.borrowed_book.title,
-                    'date_create': trx.created_at.date().isoformat(),
-                    'time_create': trx.created_at.time().isoformat(timespec='minutes'),
-                    'due_date': trx.due_date.date().isoformat()
-                } for trx in transaction_result],
+                'resp_data': [pick_fields(TRANSACTION_FIELDS, fields, trx) for trx in transaction_result],
                 'total': total_count,
                 'page': request.page,
                 'limit': request.limit
@@ -482,7 +557,8 @@ async def user_ongoing_transaction(request : Pagination, user_info = Depends(get
         )
 
 @transaction_router.post("/user-finished-transaction/")
-async def user_finished_transaction(request : Pagination,user_info = Depends(get_current_user)):
+@read_only
+async def user_finished_transaction(request : FinishedTransactionPage,user_info = Depends(get_current_user)):
     async with async_session_factory() as session:
         try:
             if user_info[1] != '':
@@ -495,34 +571,16 @@ async def user_finished_transaction(request : Pagination,user_info = Depends(get
             if not user:
                 raise Exception("User not found.")
             
-            base_query =(select(Transactions)
-                            .options(selectinload(Transactions.transaction_from_request).selectinload(Requests.borrowed_book),
-                                    selectinload(Transactions.transaction_from_request).selectinload(Requests.request_user))
-                            .where(Transactions.returned_at.is_not(None),
-                                    Requests.request_user.has(uid=user.uid)))
+            fields = request.selected_fields()
             offset = (request.page - 1) * request.limit
-            count_query = select(func.count()).select_from(base_query.subquery())
-            total_result = await session.execute(count_query)
-            total_count = total_result.scalar()
-
-            # Paginated data
-            result = await session.execute(
-                base_query.offset(offset).limit(request.limit) .order_by(asc(Transactions.due_date)))
-            transaction_result = result.scalars().all()
+            total_count, transaction_result = await page_across(
+                session, finished_transaction_sources(fields, user.uid), 'due_date', offset, request.limit)
             if not transaction_result:
                 raise Exception("You have no finished transaction.")
 
             return {
                 'resp_msg': 'Finished transactions:',
-                'resp_data': [{
-                    'uid':trx.uid,
-                    'name':trx.transaction_from_request.request_user.name,
-                    'book_title':trx.transaction_from_request.borrowed_book.title,
-                    'date_returned': trx.returned_at.date().isoformat(),
-                    'time_returned': trx.returned_at.time().isoformat(timespec='minutes'),
-                    'due_date': trx.due_date.date().isoformat(),
-                    'is_overdue': trx.is_overdue
-                } for trx in transaction_result],
+                'resp_data': [pick_fields(TRANSACTION_FIELDS, fields, trx) for trx in transaction_result],
                 'total': total_count,
                 'page': request.page,
                 'limit': request.limit
@@ -537,6 +595,7 @@ async def user_finished_transaction(request : Pagination,user_info = Depends(get
         )
 
 @transaction_router.post("/return/")
+@idempotent
 async def return_book(request: ReturnBook, user_info = Depends(get_current_admin)):
     async with async_session_factory() as session:
         try:
@@ -559,6 +618,7 @@ async def return_book(request: ReturnBook, user_info = Depends(get_current_admin
                     selectinload(Transactions.transaction_from_request)
                     .selectinload(Requests.request_user)
                 )
+                .options(selectinload(Transactions.issued_copy))
                 .where(Transactions.uid == request.transaction_id))
 
             transaction_result = result.scalar_one_or_none()
@@ -575,7 +635,8 @@ async def return_book(request: ReturnBook, user_info = Depends(get_current_admin
             if not borrowed_book:
                 raise Exception("Book information is missing from the transaction.")
             
-            borrowed_book.availability = True
+            borrowed_book = await lock_book(session, borrowed_book.uid)
+            next_request = await release_copy(session, borrowed_book)
             transaction_result.returned_at = datetime.utcnow()
 
             if transaction_result.returned_at > transaction_result.due_date:
@@ -587,6 +648,7 @@ async def return_book(request: ReturnBook, user_info = Depends(get_current_admin
             
             session.add(transaction_result)
             await session.commit()
+            catalog_cache.clear()
             return {
                 'resp_msg': response_msg,
                 'resp_data': {
@@ -597,7 +659,9 @@ async def return_book(request: ReturnBook, user_info = Depends(get_current_admin
                     'date_returned':transaction_result.returned_at.date().isoformat(),
                     'time_returned': transaction_result.returned_at.time().isoformat(timespec='minutes'),
                     'due_date':transaction_result.due_date.date().isoformat(),
-                    'is_overdue':transaction_result.is_overdue
+                    'is_overdue':transaction_result.is_overdue,
+                    'barcode':transaction_result.issued_copy.barcode if transaction_result.issued_copy else None,
+                    'next_request_id':next_request.uid if next_request else None
                 }
             }
         except Exception as e:
@@ -610,7 +674,8 @@ async def return_book(request: ReturnBook, user_info = Depends(get_current_admin
         )
 
 @transaction_router.post("/user-pending-request/")
-async def user_pending_request(request : Pagination, user_info = Depends(get_current_user)):
+@read_only
+async def user_pending_request(request : RequestPage, user_info = Depends(get_current_user)):
     async with async_session_factory() as session:
         try:
             if user_info[1] != '':
@@ -624,7 +689,8 @@ async def user_pending_request(request : Pagination, user_info = Depends(get_cur
                 raise Exception("User not found.")
             
             offset = (request.page - 1) * request.limit
-            base_query = select(Requests).options(selectinload(Requests.borrowed_book),selectinload(Requests.request_user)).where(Requests.status == "pending",Requests.request_user.has(uid=user.uid))
+            fields = request.selected_fields()
+            base_query = select(Requests).options(*request_loaders(fields)).where(Requests.status.in_(["pending", "queued"]),Requests.request_user.has(uid=user.uid))
             count_query = select(func.count()).select_from(base_query)
             total_result = await session.execute(count_query)
             total_count = total_result.scalar()
@@ -638,16 +704,7 @@ async def user_pending_request(request : Pagination, user_info = Depends(get_cur
 
             return {
                 'resp_msg': 'Pending request:',
-                'resp_data': [{
-                    'uid':request.uid,
-                    'username':request.request_user.username,
-                    'name':request.request_user.name,
-                    'book_title':request.borrowed_book.title,
-                    'date_request': request.requested_at.date().isoformat(),
-                    'time_request': request.requested_at.time().isoformat(timespec='minutes'),
-                    'duration':request.duration,
-                    'status':request.status
-                } for request in request_result],
+                'resp_data': [pick_fields(REQUEST_FIELDS, fields, req) for req in request_result],
                 'total': total_count,
                 'page': request.page,
                 'limit': request.limit
@@ -662,7 +719,8 @@ async def user_pending_request(request : Pagination, user_info = Depends(get_cur
         )
 
 @transaction_router.post("/user-processed-request/")
-async def user_processed_request(request : Pagination, user_info = Depends(get_current_user)):
+@read_only
+async def user_processed_request(request : ProcessedRequestPage, user_info = Depends(get_current_user)):
     async with async_session_factory() as session:
         try:
             if user_info[1] != '':
@@ -675,37 +733,16 @@ async def user_processed_request(request : Pagination, user_info = Depends(get_c
             if not user:
                 raise Exception("User not found.")
             
-            base_query = (select(Requests)
-                            .options(selectinload(Requests.borrowed_book),selectinload(Requests.request_user))
-                            .where(Requests.status.in_(["accepted","rejected"]),
-                                    Requests.request_user.has(uid=user.uid)))
+            fields = request.selected_fields()
             offset = (request.page - 1) * request.limit
-            count_query = select(func.count()).select_from(base_query.subquery())
-            total_result = await session.execute(count_query)
-            total_count = total_result.scalar()
-
-            # Paginated data
-            result = await session.execute(
-                base_query.offset(offset).limit(request.limit).order_by(asc(Requests.requested_at)))
-            request_result = result.scalars().all()
+            total_count, request_result = await page_across(
+                session, processed_request_sources(fields, user.uid), 'requested_at', offset, request.limit)
             if not request_result:
                 raise Exception("You have no processed request.")
 
             return {
                 'resp_msg': 'Processed request:',
-                'resp_data': [{
-                    'uid':request.uid,
-                    'username':request.request_user.username,
-                    'name':request.request_user.name,
-                    'book_title':request.borrowed_book.title,
-                    'date_request': request.requested_at.date().isoformat(),
-                    'time_request': request.requested_at.time().isoformat(timespec='minutes'),
-                    'date_update': request.updated_at.date().isoformat(),
-                    'time_update': request.updated_at.time().isoformat(timespec='minutes'),
-                    'duration':request.duration,
-                    'description':request.description,
-                    'status':request.status
-                } for request in request_result],
+                'resp_data': [pick_fields(REQUEST_FIELDS, fields, req) for req in request_result],
                 'total': total_count,
                 'page': request.page,
                 'limit': request.limit
@@ -11,13 +11,15 @@ from jose import jwt, JWTError, ExpiredSignatureError
 
 from startup.db_config import engine,async_session_factory,Config
 from api.schemas.user import RequestRegisterUser,LoginUser
-from repositories.models import Users, Books,Transactions, Requests
+from repositories.models import Users, Books,Transactions, Requests, TransactionsArchive, RequestsArchive
+from utils.routing import read_only
 from utils.auth import get_password_hash,verify_password,create_access_token,decode_token,get_current_user
+from utils.rate_limit import rate_limit
 
 
 user_router = APIRouter()
 
-@user_router.post("/register-user/")
+@user_router.post("/register-user/", dependencies=[Depends(rate_limit("register"))])
 async def register_user(request: RequestRegisterUser):
     async with engine.begin() as conn:
         try:
@@ -64,7 +66,7 @@ async def register_user(request: RequestRegisterUser):
             }
         )
 
-@user_router.post("/login/")
+@user_router.post("/login/", dependencies=[Depends(rate_limit("login"))])
 async def login(request: LoginUser):
     async with engine.begin() as conn:
         try: 
@@ -106,6 +108,7 @@ async def login(request: LoginUser):
         )
 
 @user_router.get("/info/")
+@read_only
 async def info(user_info = Depends(get_current_user)):
     async with engine.begin() as conn:
         try:    
@@ -140,6 +143,7 @@ async def info(user_info = Depends(get_current_user)):
         )
 
 @user_router.get("/summary/")
+@read_only
 async def info(user_info = Depends(get_current_user)):
     async with async_session_factory() as session:
         try:
@@ -192,8 +196,18 @@ async def info(user_info = Depends(get_current_user)):
                                     Requests.request_user.has(uid=user.uid)))
             count_query = select(func.count()).select_from(base_query.subquery())
             total_finished_trx = await session.execute(count_query)
-            total_finished_trx = total_finished_trx.scalar()   
-            
+            total_finished_trx = total_finished_trx.scalar()
+
+            # the archiver moves a finished transaction together with its accepted request
+            base_query =(select(TransactionsArchive)
+                            .where(TransactionsArchive.transaction_from_request.has(RequestsArchive.user_id == user.uid)))
+            count_query = select(func.count()).select_from(base_query.subquery())
+            total_archived_trx = await session.execute(count_query)
+            total_archived_trx = total_archived_trx.scalar()
+            total_books_borrowed += total_archived_trx
+            total_accepted_req += total_archived_trx
+            total_finished_trx += total_archived_trx
+
             return {
                 'resp_msg': 'Success',
                 'resp_data': {
@@ -216,6 +230,7 @@ async def info(user_info = Depends(get_current_user)):
         )
 
 @user_router.get("/check-token/")
+@read_only
 async def check_token(authorization: str = Header(None)):
     if not authorization:
         raise HTTPException(
@@ -255,6 +270,7 @@ async def check_token(authorization: str = Header(None)):
         )
     
 @user_router.get("/check-admin/")
+@read_only
 async def check_admin(user_info = Depends(get_current_user)):
     async with engine.begin() as conn:
         try:    
@@ -0,0 +1,11 @@
+from pydantic import BaseModel, Field
+from typing import Any, List, Literal, Optional
+
+class BatchItem(BaseModel):
+    id: Optional[str] = None
+    method: Literal["GET", "POST"] = "GET"
+    path: str
+    body: Optional[Any] = None
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem] = Field(min_length=1)
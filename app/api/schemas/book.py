@@ -1,13 +1,17 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import datetime
 import uuid
 
+from api.schemas.fields import FieldSelection
+
 class AddBook(BaseModel):
     title: str
     author: str
     category: str
     summary: str
+    total_copies: int = Field(1, ge=1)
+    barcodes: List[str] = []
     
     class Config:
         orm_mode = True
@@ -18,13 +22,17 @@ class SearchBook(BaseModel):
     category: Optional[str] = None
     availability: Optional[bool] = None
 
-class FilterBook(BaseModel):
+class FilterBook(FieldSelection):
     page: int
     limit: int
     title: Optional[str] = None
     author: Optional[str] = None
     category: Optional[str] = None
     availability: Optional[bool] = None
+    facets: Optional[List[Literal['category', 'author', 'availability']]] = None
+
+    FIELDS = ('uid', 'title', 'author', 'category', 'summary', 'availability', 'total_copies', 'available_copies')
+    DEFAULT_FIELDS = ('title', 'author', 'category', 'summary', 'availability', 'total_copies', 'available_copies')
 
 class UpdateBook(BaseModel):
     uid:uuid.UUID
@@ -32,6 +40,9 @@ class UpdateBook(BaseModel):
     author: Optional[str] = None
     category: Optional[str] = None
     summary: Optional[str] = None
+    total_copies: Optional[int] = Field(None, ge=1)
+    barcodes: List[str] = []
+    removed_barcodes: List[str] = []
 
 class UIDBooks(BaseModel):
     uid:uuid.UUID
\ No newline at end of file
@@ -0,0 +1,26 @@
+from pydantic import BaseModel, field_validator
+from typing import ClassVar, List, Optional, Tuple
+
+class FieldSelection(BaseModel):
+    fields: Optional[List[str]] = None
+
+    # response fields a listing can return, and those it returns without `fields`
+    FIELDS: ClassVar[Tuple[str, ...]] = ()
+    DEFAULT_FIELDS: ClassVar[Optional[Tuple[str, ...]]] = None
+
+    @field_validator("fields")
+    @classmethod
+    def known_fields(cls, value):
+        if value is None:
+            return value
+        unknown = [name for name in value if name not in cls.FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(unknown)}. Allowed: {', '.join(cls.FIELDS)}.")
+        if not value:
+            raise ValueError("At least one field must be requested.")
+        return value
+
+    def selected_fields(self) -> List[str]:
+        if self.fields is None:
+            return list(self.DEFAULT_FIELDS if self.DEFAULT_FIELDS is not None else self.FIELDS)
+        return [name for name in self.FIELDS if name in self.fields]
@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+from typing import Any, Dict, Literal, Optional
+
+class SubmitJob(BaseModel):
+    kind: str
+    params: Dict[str, Any] = {}
+
+class ListJobs(BaseModel):
+    page: int = 1
+    limit: int = 20
+    status: Optional[Literal['queued', 'running', 'succeeded', 'failed', 'cancelled']] = None
+    kind: Optional[str] = None
@@ -3,6 +3,8 @@ from typing import List, Optional
 from datetime import datetime
 import uuid
 
+from api.schemas.fields import FieldSelection
+
 class RequestBorrow(BaseModel):
     book_id: uuid.UUID
     duration: int
@@ -17,12 +19,29 @@ class PendingRequest(BaseModel):
     class Config:
         orm_mode = True
 
+class AcceptRequest(PendingRequest):
+    # the copy handed out, when the library tracks barcodes
+    barcode: Optional[str] = None
+
 class ReturnBook(BaseModel):
     transaction_id: uuid.UUID
     
     class Config:
         orm_mode = True
 
-class Pagination(BaseModel):
+class Pagination(FieldSelection):
     page: int
-    limit: int
\ No newline at end of file
+    limit: int
+
+class RequestPage(Pagination):
+    FIELDS = ('uid', 'username', 'name', 'book_title', 'date_request', 'time_request', 'duration', 'status')
+
+class ProcessedRequestPage(Pagination):
+    FIELDS = ('uid', 'username', 'name', 'book_title', 'date_request', 'time_request',
+              'date_update', 'time_update', 'duration', 'description', 'status')
+
+class OngoingTransactionPage(Pagination):
+    FIELDS = ('uid', 'name', 'book_title', 'date_create', 'time_create', 'due_date')
+
+class FinishedTransactionPage(Pagination):
+    FIELDS = ('uid', 'name', 'book_title', 'date_returned', 'time_returned', 'due_date', 'is_overdue')
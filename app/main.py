@@ -4,13 +4,34 @@ from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 import uvicorn
-from contextlib import asynccontextmanager
+import asyncio
+from contextlib import asynccontextmanager, suppress
 
 import startup.db_config as db_config
 from api.routes.user import user_router
 from api.routes.books import book_router
 from api.routes.transaction import transaction_router
 from api.routes.review import review_router
+from api.routes.admin import admin_router
+from api.routes.health import health_router
+from api.routes.batch import batch_router
+from api.routes.jobs import job_router
+from middleware.query_counter import QueryCounterMiddleware
+from middleware.idempotency import IdempotencyMiddleware
+from middleware.compression import CompressionMiddleware
+from middleware.replica import ReplicaRoutingMiddleware
+from middleware.timeouts import StatementTimeoutMiddleware
+from utils.memory import sample_memory_periodically
+from startup.warmup import warm_up_pool
+from utils.pg_listener import pg_listener
+from utils.suggest import suggest_index
+from utils.text_search import text_search
+from utils.popularity import popularity
+from utils.replica import replica_monitor
+from utils.rate_limit import RateLimitExceeded
+from utils.jobs import job_runner
+from utils.scheduler import scheduler
+import utils.schedules  # registers the periodic tasks
 
 # from startup.db_config import init_db
 
@@ -20,7 +41,25 @@ from api.routes.review import review_router
 async def life_span(app:FastAPI):
     print("server is starting...")
     await db_config.init_db()
+    try:
+        await warm_up_pool()
+        print("connection pool is warmed up")
+    except Exception as e:
+        print(f"connection pool warm-up failed, /readyz will retry: {e}")
+    memory_sampler = asyncio.create_task(sample_memory_periodically())
+    event_listener = asyncio.create_task(pg_listener.run())
+    suggest_loader = suggest_index.schedule_load()
+    text_index = asyncio.create_task(text_search.run())
+    popularity_snapshots = asyncio.create_task(popularity.run())
+    replica_lag = asyncio.create_task(replica_monitor.run())
+    jobs = asyncio.create_task(job_runner.run())
+    periodic_tasks = asyncio.create_task(scheduler.run())
     yield
+    for task in (memory_sampler, event_listener, suggest_loader, text_index, popularity_snapshots, replica_lag, jobs,
+                 periodic_tasks):
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
     print("server has been stopped")
 
 
@@ -32,6 +71,12 @@ app = FastAPI(title="Template Core API",
     license_info=None,
     lifespan=life_span)
 
+app.add_middleware(StatementTimeoutMiddleware)
+app.add_middleware(ReplicaRoutingMiddleware)
+app.add_middleware(IdempotencyMiddleware)
+app.add_middleware(QueryCounterMiddleware)
+app.add_middleware(CompressionMiddleware)
+
 origins = ["*"]
 app.add_middleware(
     CORSMiddleware,
@@ -39,6 +84,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "Idempotent-Replayed", "X-Read-Source"],
 )
 
 @app.exception_handler(RequestValidationError)
@@ -62,10 +108,25 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         content=jsonable_encoder(modified_response),
     )
 
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_exception_handler(request: Request, exc: RateLimitExceeded):
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={
+            "resp_data": None,
+            "resp_msg": str(exc)
+        },
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+app.include_router(health_router)
 app.include_router(user_router, prefix = "/api/v1/user")
 app.include_router(book_router, prefix = "/api/v1/books")
 app.include_router(transaction_router, prefix = "/api/v1/transaction")
 app.include_router(review_router, prefix = "/api/v1/review")
+app.include_router(admin_router, prefix = "/api/v1/admin")
+app.include_router(batch_router, prefix = "/api/v1/batch")
+app.include_router(job_router, prefix = "/api/v1/jobs")
 
 if __name__ == "__main__":
     uvicorn.run('main:app', host="0.0.0.0", port=8004, reload=True)  
\ No newline at end of file
@@ -0,0 +1,55 @@
+from starlette.datastructures import Headers, MutableHeaders
+
+from startup.db_config import Config
+from utils.compression import negotiate, compress
+
+_SKIPPED_TYPES = ("text/event-stream", "image/", "video/", "audio/", "application/zip", "application/gzip")
+
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def compressing_send(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                start_message = message
+                passthrough = ("content-encoding" in headers
+                               or headers.get("content-type", "").startswith(_SKIPPED_TYPES))
+                if passthrough:
+                    await send(message)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < Config.COMPRESSION_MIN_SIZE:
+                # streamed bodies are left alone
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = compress(encoding, body)
+            headers = MutableHeaders(scope=start_message)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, compressing_send)
@@ -0,0 +1,159 @@
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+from starlette.requests import Request
+
+from startup.db_config import engine, Config
+from utils.auth import client_identity
+from utils.routing import route_flag
+
+logger = logging.getLogger(__name__)
+
+_REPLAYED_HEADERS = ("content-type",)
+# the request may well succeed when retried, so these are not remembered either
+_TRANSIENT_STATUSES = (408, 409, 425, 429)
+
+CLAIM = text("""
+    INSERT INTO idempotency_keys (key, request_hash, status, created_at, expires_at)
+    VALUES (:key, :request_hash, 'in_progress', :now, :expires_at)
+    ON CONFLICT (key) DO NOTHING
+    RETURNING key""")
+FETCH = text("""
+    SELECT request_hash, status, response_status, response_headers, response_body, expires_at
+    FROM idempotency_keys WHERE key = :key""")
+COMPLETE = text("""
+    UPDATE idempotency_keys
+    SET status = 'completed', response_status = :response_status,
+        response_headers = CAST(:response_headers AS JSONB), response_body = :response_body
+    WHERE key = :key""")
+RELEASE = text("DELETE FROM idempotency_keys WHERE key = :key")
+RELEASE_EXPIRED = text("DELETE FROM idempotency_keys WHERE key = :key AND expires_at < :now")
+PURGE_EXPIRED = text("DELETE FROM idempotency_keys WHERE expires_at < :now")
+
+
+def idempotent(endpoint):
+    # marks a route whose effect may be replayed from a stored response when the
+    # client sends an Idempotency-Key header
+    endpoint.idempotent = True
+    return endpoint
+
+
+async def _execute(statement, params):
+    async with engine.begin() as conn:
+        return (await conn.execute(statement, params)).first()
+
+
+async def purge_expired_keys() -> int:
+    # run by the scheduler (utils/schedules.py)
+    async with engine.begin() as conn:
+        return (await conn.execute(PURGE_EXPIRED, {"now": datetime.utcnow()})).rowcount
+
+
+async def _send_stored(send, record):
+    headers = [(name.encode(), value.encode()) for name, value in (record.response_headers or {}).items()]
+    headers.append((b"idempotent-replayed", b"true"))
+    await send({"type": "http.response.start", "status": record.response_status, "headers": headers})
+    await send({"type": "http.response.body", "body": record.response_body or b""})
+
+
+async def _send_error(send, status_code, message):
+    body = json.dumps({'resp_msg': message, 'resp_data': None}, separators=(',', ':')).encode()
+    await send({"type": "http.response.start", "status": status_code,
+                "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": body})
+
+
+class IdempotencyMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.in_flight = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH", "DELETE"):
+            await self.app(scope, receive, send)
+            return
+        request = Request(scope)
+        client_key = request.headers.get("idempotency-key")
+        if not client_key or not route_flag(scope["app"], scope, "idempotent"):
+            await self.app(scope, receive, send)
+            return
+        if len(client_key) > 255:
+            await _send_error(send, 400, "Idempotency-Key must be at most 255 characters.")
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body", False):
+                break
+
+        async def replay_receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        key = f"{client_identity(request)}:{client_key}"
+        request_hash = hashlib.sha256(f"{scope['method']} {scope['path']}\n".encode() + body).hexdigest()
+
+        deadline = time.monotonic() + Config.IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            now = datetime.utcnow()
+            claimed = await _execute(CLAIM, {"key": key, "request_hash": request_hash, "now": now,
+                                             "expires_at": now + timedelta(seconds=Config.IDEMPOTENCY_TTL_SECONDS)})
+            if claimed:
+                break
+            record = await _execute(FETCH, {"key": key})
+            if record is None:
+                continue
+            if record.expires_at < now:
+                await _execute(RELEASE_EXPIRED, {"key": key, "now": now})
+                continue
+            if record.request_hash != request_hash:
+                await _send_error(send, 422, "This Idempotency-Key was already used for a different request.")
+                return
+            if record.status == "completed":
+                await _send_stored(send, record)
+                return
+            # the first request with this key is still running, here or on another worker
+            if time.monotonic() >= deadline:
+                await _send_error(send, 409, "A request with this Idempotency-Key is still being processed.")
+                return
+            event = self.in_flight.get(key)
+            try:
+                if event is not None:
+                    await asyncio.wait_for(event.wait(), timeout=deadline - time.monotonic())
+                else:
+                    await asyncio.sleep(0.1)
+            except asyncio.TimeoutError:
+                pass
+
+        self.in_flight[key] = asyncio.Event()
+        response = {"status": 500, "headers": {}, "body": b""}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = {name.decode().lower(): value.decode() for name, value in message["headers"]
+                                       if name.decode().lower() in _REPLAYED_HEADERS}
+            elif message["type"] == "http.response.body":
+                response["body"] += message.get("body", b"")
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+            if response["status"] >= 500 or response["status"] in _TRANSIENT_STATUSES:
+                # failures are not remembered so that the client can retry them
+                await _execute(RELEASE, {"key": key})
+            else:
+                await _execute(COMPLETE, {"key": key, "response_status": response["status"],
+                                          "response_headers": json.dumps(response["headers"]),
+                                          "response_body": response["body"]})
+        except BaseException:
+            await _execute(RELEASE, {"key": key})
+            raise
+        finally:
+            self.in_flight.pop(key).set()
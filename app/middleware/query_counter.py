@@ -0,0 +1,99 @@
+import time
+import logging
+from contextvars import ContextVar
+from typing import Optional
+
+from starlette.datastructures import MutableHeaders
+
+from startup.db_config import Config, listens_for_all
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    __slots__ = ("count", "db_time", "scope")
+
+    def __init__(self, scope=None):
+        self.count = 0
+        self.db_time = 0.0
+        self.scope = scope
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.db_time * 1000:.2f};desc="{self.count} queries"'
+
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def current_query_stats() -> Optional[QueryStats]:
+    return _current_stats.get()
+
+
+@listens_for_all("before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_start = time.perf_counter()
+
+
+@listens_for_all("after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_stats.get()
+    if stats is None or context is None:
+        return
+    stats.count += 1
+    stats.db_time += time.perf_counter() - getattr(context, "_query_start", time.perf_counter())
+
+
+def route_path(scope) -> str:
+    route = scope.get("route")
+    return route.path if route is not None else scope.get("path", "")
+
+
+class QueryCounterMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats(scope)
+        token = _current_stats.set(stats)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", stats.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_stats.reset(token)
+            path = route_path(scope)
+            budget = Config.QUERY_BUDGETS.get(path, Config.QUERY_BUDGET)
+            if stats.count > budget:
+                logger.warning("%s %s ran %d queries (budget %d, %.1f ms in db)",
+                               scope["method"], path, stats.count, budget, stats.db_time * 1000)
+
+
+def parse_query_count(response) -> int:
+    for entry in response.headers.get("Server-Timing", "").split(","):
+        name, _, params = entry.strip().partition(";")
+        if name == "db":
+            for param in params.split(";"):
+                key, _, value = param.partition("=")
+                if key == "desc":
+                    return int(value.strip('"').split()[0])
+    raise AssertionError("Response has no db entry in its Server-Timing header.")
+
+
+def assert_max_queries(response, max_queries: int):
+    # for tests: fail when a route starts issuing more statements than it used to
+    count = parse_query_count(response)
+    if count > max_queries:
+        raise AssertionError(
+            f"{response.request.method} {response.request.url.path} ran {count} queries, "
+            f"expected at most {max_queries}.")
+    return count
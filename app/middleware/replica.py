@@ -0,0 +1,45 @@
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import cookie_parser
+
+from startup.db_config import replica_engine, read_from_replica, request_commits, Config
+from utils.replica import replica_monitor
+from utils.routing import route_flag
+
+# a client that just wrote reads from the primary for a while (read-your-writes);
+# "X-Read-Consistency: primary" asks for the primary on a single request
+STICKY_COOKIE = "read_primary"
+
+
+class ReplicaRoutingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or replica_engine is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        read_only = route_flag(scope["app"], scope, "read_only")
+        wants_primary = (headers.get("x-read-consistency", "").lower() == "primary"
+                         or STICKY_COOKIE in cookie_parser(headers.get("cookie", "")))
+        use_replica = read_only and not wants_primary and replica_monitor.usable
+        commits = []
+
+        async def send_with_route(message):
+            if message["type"] == "http.response.start":
+                response_headers = MutableHeaders(scope=message)
+                if read_only:
+                    response_headers.append("X-Read-Source", "replica" if use_replica else "primary")
+                elif commits:
+                    response_headers.append(
+                        "Set-Cookie",
+                        f"{STICKY_COOKIE}=1; Max-Age={Config.REPLICA_STICKY_SECONDS}; Path=/; HttpOnly; SameSite=Lax")
+            await send(message)
+
+        tokens = read_from_replica.set(use_replica), request_commits.set(commits)
+        try:
+            await self.app(scope, receive, send_with_route)
+        finally:
+            read_from_replica.reset(tokens[0])
+            request_commits.reset(tokens[1])
@@ -0,0 +1,100 @@
+import asyncio
+import json
+from contextvars import ContextVar
+from typing import Optional
+
+from startup.db_config import Config, statement_timeout_ms, listens_for_all
+from utils.routing import find_route
+
+# postgres error codes that mean "try again later" rather than "bad request"
+TIMEOUT_SQLSTATES = {'57014'}  # query_canceled, raised by statement_timeout
+UNAVAILABLE_SQLSTATES = {'53300', '57P01', '57P02', '57P03'}  # too many connections, server shutting down
+
+# the handlers turn every exception into a 400; the failure is remembered here so
+# the response can be replaced with a 503/504
+_db_failure: ContextVar[Optional[list]] = ContextVar("db_failure", default=None)
+
+
+@listens_for_all("handle_error")
+def _remember_failure(exception_context):
+    failures = _db_failure.get()
+    if failures is None:
+        return
+    sqlstate = getattr(exception_context.original_exception, 'sqlstate', None)
+    if sqlstate in TIMEOUT_SQLSTATES:
+        failures.append(504)
+    elif sqlstate in UNAVAILABLE_SQLSTATES or exception_context.is_disconnect:
+        failures.append(503)
+
+
+def route_timeout(route, read_only: bool) -> int:
+    if route is not None and route.path in Config.STATEMENT_TIMEOUTS_MS:
+        return Config.STATEMENT_TIMEOUTS_MS[route.path]
+    return Config.STATEMENT_TIMEOUT_READ_MS if read_only else Config.STATEMENT_TIMEOUT_WRITE_MS
+
+
+async def _send_failure(send, status_code):
+    message = ('The database took too long to answer, please narrow the request or try again later.'
+               if status_code == 504 else 'The database is unavailable, please try again later.')
+    body = json.dumps({'resp_msg': message, 'resp_data': None}).encode()
+    await send({"type": "http.response.start", "status": status_code,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                            (b"retry-after", b"5")]})
+    await send({"type": "http.response.body", "body": body})
+
+
+class StatementTimeoutMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = find_route(scope["app"], scope)
+        read_only = bool(getattr(getattr(route, "endpoint", None), "read_only", False))
+        failures = []
+        replaced = False
+
+        async def send_or_replace(message):
+            nonlocal replaced
+            if message["type"] == "http.response.start" and failures and message["status"] == 400:
+                replaced = True
+                await _send_failure(send, failures[-1])
+            if not replaced:
+                await send(message)
+
+        tokens = statement_timeout_ms.set(route_timeout(route, read_only)), _db_failure.set(failures)
+        try:
+            if read_only:
+                await self._cancel_on_disconnect(scope, receive, send_or_replace)
+            else:
+                # a write runs to the end even without a client, so its outcome never depends on timing
+                await self.app(scope, receive, send_or_replace)
+        finally:
+            statement_timeout_ms.reset(tokens[0])
+            _db_failure.reset(tokens[1])
+
+    async def _cancel_on_disconnect(self, scope, receive, send):
+        # the handler reads from a queue fed by a watcher that also notices the client leaving;
+        # cancelling the handler cancels the statement it is waiting on
+        messages = asyncio.Queue()
+        handler = asyncio.ensure_future(self.app(scope, messages.get, send))
+
+        async def watch():
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    handler.cancel()
+                    return
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if not handler.cancelled() or not watcher.done():
+                raise
+        finally:
+            watcher.cancel()
@@ -0,0 +1,82 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import text, func, literal_column, union_all
+from sqlalchemy.future import select
+
+from startup.db_config import engine, Config
+
+# Moves one batch of finished transactions, together with their requests, to the
+# archive tables. Everything happens in one statement so a row is never in both
+# places or in neither; SKIP LOCKED lets several workers archive side by side.
+_ARCHIVE_TRANSACTIONS = text("""
+    WITH moved AS (
+        DELETE FROM transactions
+        WHERE uid IN (SELECT uid FROM transactions WHERE returned_at < :cutoff
+                      ORDER BY returned_at LIMIT :batch_size FOR UPDATE SKIP LOCKED)
+        RETURNING uid, admin_id, request_id, created_at, due_date, returned_at, is_overdue, copy_id
+    ), moved_requests AS (
+        DELETE FROM requests WHERE uid IN (SELECT request_id FROM moved)
+        RETURNING uid, user_id, book_id, requested_at, updated_at, duration, status, description
+    ), archived_requests AS (
+        INSERT INTO requests_archive (uid, user_id, book_id, requested_at, updated_at, duration, status,
+                                      description, archived_at)
+        SELECT uid, user_id, book_id, requested_at, updated_at, duration, status, description, :now
+        FROM moved_requests
+    )
+    INSERT INTO transactions_archive (uid, admin_id, request_id, created_at, due_date, returned_at, is_overdue,
+                                      copy_id, archived_at)
+    SELECT uid, admin_id, request_id, created_at, due_date, returned_at, is_overdue, copy_id, :now
+    FROM moved
+""")
+
+# rejected requests are not kept at all once they are past the retention period
+_PURGE_REJECTED = text("""
+    DELETE FROM requests
+    WHERE uid IN (SELECT uid FROM requests WHERE status = 'rejected' AND updated_at < :cutoff
+                  ORDER BY updated_at LIMIT :batch_size FOR UPDATE SKIP LOCKED)
+""")
+
+archive_lock = asyncio.Lock()
+
+
+async def _in_batches(statement, params) -> int:
+    # one short transaction per batch, so the hot tables are never locked for long
+    total = 0
+    while True:
+        async with engine.begin() as conn:
+            count = (await conn.execute(statement, {**params, 'batch_size': Config.ARCHIVE_BATCH_SIZE})).rowcount
+        total += count
+        if count < Config.ARCHIVE_BATCH_SIZE:
+            return total
+
+
+async def archive_history() -> dict:
+    async with archive_lock:
+        now = datetime.utcnow()
+        archived = await _in_batches(_ARCHIVE_TRANSACTIONS, {
+            'cutoff': now - timedelta(days=Config.ARCHIVE_AFTER_DAYS), 'now': now})
+        purged = await _in_batches(_PURGE_REJECTED, {
+            'cutoff': now - timedelta(days=Config.REJECTED_RETENTION_DAYS)})
+        return {'archived_transactions': archived, 'purged_rejected_requests': purged}
+
+
+async def page_across(session, sources, order_by, offset, limit):
+    # sources are (model, filters, loader options) for a hot table and its archive.
+    # One UNION ALL over the keys picks the page, then each table loads its own rows.
+    keys = union_all(*[
+        select(model.uid, getattr(model, order_by).label('sort_key'), literal_column(str(index)).label('source'))
+        .where(*filters)
+        for index, (model, filters, _) in enumerate(sources)
+    ]).subquery()
+    total_count = (await session.execute(select(func.count()).select_from(keys))).scalar()
+    page = (await session.execute(
+        select(keys).order_by(keys.c.sort_key, keys.c.uid).offset(offset).limit(limit))).all()
+
+    rows = {}
+    for index, (model, _, options) in enumerate(sources):
+        uids = [row.uid for row in page if row.source == index]
+        if uids:
+            result = await session.execute(select(model).options(*options).where(model.uid.in_(uids)))
+            rows.update({obj.uid: obj for obj in result.scalars()})
+    return total_count, [rows[row.uid] for row in page]
@@ -1,10 +1,15 @@
 from sqlmodel import SQLModel, Field, Column, Relationship
 import sqlalchemy.dialects.postgresql as pg
-from sqlalchemy import ForeignKey, CheckConstraint
+from sqlalchemy import ForeignKey, CheckConstraint, Sequence, Index, Computed, text
 from datetime import datetime
 from typing import List, Optional
 import uuid
 
+# ids of the events published on the request_events channel
+request_event_seq = Sequence("request_event_seq", metadata=SQLModel.metadata)
+# bumped by every rebuild of book_popularity, see utils/popularity.py
+popularity_generation_seq = Sequence("popularity_generation_seq", metadata=SQLModel.metadata)
+
 class Users(SQLModel, table=True):
     __tablename__ = "users"
     uid: uuid.UUID = Field(
@@ -110,12 +115,40 @@ class Books(SQLModel, table=True):
             nullable=False,
         )
     )
+    total_copies: int = Field(
+        sa_column=Column(
+            pg.INTEGER,
+            name="total_copies",
+            nullable=False,
+            default=1,
+            server_default="1"
+        )
+    )
+    available_copies: int = Field(
+        sa_column=Column(
+            pg.INTEGER,
+            name="available_copies",
+            nullable=False,
+            default=1,
+            server_default="1"
+        )
+    )
+    # copies back on the shelf but kept for a request promoted from the reservation queue
+    held_copies: int = Field(
+        sa_column=Column(
+            pg.INTEGER,
+            name="held_copies",
+            nullable=False,
+            default=0,
+            server_default="0"
+        )
+    )
     availability: bool = Field(
         sa_column=Column(
             pg.BOOLEAN,
+            Computed("available_copies > 0", persisted=True),
             name="availability",
-            nullable=False,
-            default=True
+            nullable=False
         )
     )
     summary: str = Field(
@@ -154,6 +187,54 @@ class Books(SQLModel, table=True):
     created_by_user: "Users" = Relationship(back_populates="books")
     borrow_request: List["Requests"] = Relationship(back_populates="borrowed_book")
     book_review: List["BookReviews"] = Relationship(back_populates="review_book")
+    copies: List["BookCopies"] = Relationship(back_populates="book")
+
+    # availability is computed by postgres; have it returned by every INSERT and UPDATE
+    __mapper_args__ = {"eager_defaults": True}
+    __table_args__ = (
+        # the copies that are neither available nor held are lent out
+        CheckConstraint("available_copies >= 0 AND held_copies >= 0 "
+                        "AND available_copies + held_copies <= total_copies", name="ck_books_copies"),
+    )
+
+class BookCopies(SQLModel, table=True):
+    __tablename__ = "book_copies"
+    # optional barcodes for the physical copies of a book, see Books.total_copies
+    uid: uuid.UUID = Field(
+        sa_column=Column(
+            pg.UUID,
+            name="uid",
+            nullable=False,
+            primary_key=True,
+            default=uuid.uuid4
+        )
+    )
+    book_id: uuid.UUID = Field(
+        sa_column=Column(
+            pg.UUID,
+            ForeignKey("books.uid", ondelete="CASCADE"),
+            nullable=False,
+            index=True
+        )
+    )
+    barcode: str = Field(
+        sa_column=Column(
+            pg.VARCHAR,
+            name="barcode",
+            nullable=False,
+            unique=True
+        )
+    )
+    created_at: datetime = Field(
+        sa_column=Column(
+            pg.TIMESTAMP,
+            name="created_at",
+            default=datetime.utcnow,
+            nullable=False
+        )
+    )
+
+    book: "Books" = Relationship(back_populates="copies")
 
 class Requests(SQLModel, table=True):
     __tablename__ = "requests"
@@ -227,6 +308,13 @@ class Requests(SQLModel, table=True):
     borrowed_book: "Books" = Relationship(back_populates="borrow_request")
     accepted_request: "Transactions" = Relationship(back_populates="transaction_from_request")
 
+    __table_args__ = (
+        # reservation queue lookups, see repositories/reservations.py
+        Index("ix_requests_book_status_requested_at", "book_id", "status", "requested_at"),
+        # retention of rejected requests, see repositories/archive.py
+        Index("ix_requests_rejected_updated_at", "updated_at", postgresql_where=text("status = 'rejected'")),
+    )
+
 class Transactions(SQLModel, table=True):
     __tablename__ = "transactions"
     uid: uuid.UUID = Field(
@@ -282,6 +370,13 @@ class Transactions(SQLModel, table=True):
             nullable=False
         )
     )
+    copy_id: Optional[uuid.UUID] = Field(
+        sa_column=Column(
+            pg.UUID,
+            ForeignKey("book_copies.uid", ondelete="SET NULL"),
+            nullable=True  # only set when the admin scanned a barcode
+        )
+    )
 
     # Relationships
     admin_user: "Users" = Relationship(
@@ -289,6 +384,160 @@ class Transactions(SQLModel, table=True):
         sa_relationship_kwargs={"foreign_keys": "Transactions.admin_id"}
     )
     transaction_from_request: "Requests" = Relationship(back_populates="accepted_request")
+    issued_copy: Optional["BookCopies"] = Relationship()
+
+    __table_args__ = (
+        # a copy can only be on one open loan at a time
+        Index("ux_transactions_open_copy", "copy_id", unique=True, postgresql_where=text("returned_at IS NULL")),
+        # archiving candidates, see repositories/archive.py
+        Index("ix_transactions_returned_at", "returned_at"),
+    )
+
+# Finished transactions and their requests are moved here once they are old enough
+# (see repositories/archive.py), which keeps the hot tables and their indexes small.
+# The columns mirror Requests and Transactions so the listings can read either.
+class RequestsArchive(SQLModel, table=True):
+    __tablename__ = "requests_archive"
+    uid: uuid.UUID = Field(
+        sa_column=Column(
+            pg.UUID,
+            name="uid",
+            nullable=False,
+            primary_key=True
+        )
+    )
+    user_id: uuid.UUID = Field(
+        sa_column=Column(
+            pg.UUID,
+            ForeignKey("users.uid"),
+            nullable=False,
+            index=True
+        )
+    )
+    book_id: uuid.UUID = Field(
+        sa_column=Column(
+            pg.UUID,
+            ForeignKey("books.uid"),
+            nullable=False
+        )
+    )
+    requested_at: datetime = Field(
+        sa_column=Column(
+            pg.TIMESTAMP,
+            name="requested_at",
+            nullable=False,
+            index=True
+        )
+    )
+    updated_at: datetime = Field(
+        sa_column=Column(
+            pg.TIMESTAMP,
+            name="updated_at",
+            nullable=False
+        )
+    )
+    duration: int = Field(
+        sa_column=Column(
+            pg.INTEGER,
+            name="duration",
+            nullable=False
+        )
+    )
+    status: str = Field(
+        sa_column=Column(
+            pg.VARCHAR,
+            name="status",
+            nullable=False
+        )
+    )
+    description: str = Field(
+        sa_column=Column(
+            pg.VARCHAR,
+            name="description",
+            nullable=True
+        )
+    )
+    archived_at: datetime = Field(
+        sa_column=Column(
+            pg.TIMESTAMP,
+            name="archived_at",
+            nullable=False
+        )
+    )
+
+    request_user: "Users" = Relationship()
+    borrowed_book: "Books" = Relationship()
+
+class TransactionsArchive(SQLModel, table=True):
+    __tablename__ = "transactions_archive"
+    uid: uuid.UUID = Field(
+        sa_column=Column(
+            pg.UUID,
+            name="uid",
+            nullable=False,
+            primary_key=True
+        )
+    )
+    admin_id: uuid.UUID = Field(
+        sa_column=Column(
+            pg.UUID,
+            ForeignKey("users.uid"),
+            nullable=False
+        )
+    )
+    request_id: uuid.UUID = Field(
+        sa_column=Column(
+            pg.UUID,
+            ForeignKey("requests_archive.uid"),
+            nullable=False,
+            index=True
+        )
+    )
+    created_at: datetime = Field(
+        sa_column=Column(
+            pg.TIMESTAMP,
+            name="created_at",
+            nullable=True
+        )
+    )
+    due_date: datetime = Field(
+        sa_column=Column(
+            pg.TIMESTAMP,
+            name="due_date",
+            nullable=False,
+            index=True
+        )
+    )
+    returned_at: datetime = Field(
+        sa_column=Column(
+            pg.TIMESTAMP,
+            name="returned_at",
+            nullable=True
+        )
+    )
+    is_overdue: bool = Field(
+        sa_column=Column(
+            pg.BOOLEAN,
+            name="is_overdue",
+            nullable=False
+        )
+    )
+    copy_id: Optional[uuid.UUID] = Field(
+        sa_column=Column(
+            pg.UUID,
+            name="copy_id",
+            nullable=True  # copies can be deleted, the archive keeps the id only
+        )
+    )
+    archived_at: datetime = Field(
+        sa_column=Column(
+            pg.TIMESTAMP,
+            name="archived_at",
+            nullable=False
+        )
+    )
+
+    transaction_from_request: "RequestsArchive" = Relationship()
 
 
 class BookReviews(SQLModel, table=True):
@@ -351,4 +600,419 @@ class BookReviews(SQLModel, table=True):
 
     # Relationships
     review_user: "Users" = Relationship(back_populates="user_review")
-    review_book: "Books" = Relationship(back_populates="book_review")
\ No newline at end of file
+    review_book: "Books" = Relationship(back_populates="book_review")
+
+class BookSimilarities(SQLModel, table=True):
+    __tablename__ = "book_similarities"
+    # top-K co-borrowed books per book, rebuilt by utils/similar_books.py
+    book_id: uuid.UUID = Field(
+        sa_column=Column(
+            pg.UUID,
+            ForeignKey("books.uid", ondelete="CASCADE"),
+            nullable=False,
+            primary_key=True
+        )
+    )
+    rank: int = Field(
+        sa_column=Column(
+            pg.SMALLINT,
+            name="rank",
+            nullable=False,
+            primary_key=True
+        )
+    )
+    similar_book_id: uuid.UUID = Field(
+        sa_column=Column(
+            pg.UUID,
+            ForeignKey("books.uid", ondelete="CASCADE"),
+            nullable=False
+        )
+    )
+    score: float = Field(
+        sa_column=Column(
+            pg.REAL,
+            name="score",
+            nullable=False
+        )
+    )
+    updated_at: datetime = Field(
+        sa_column=Column(
+            pg.TIMESTAMP,
+            name="updated_at",
+            nullable=False
+        )
+    )
+
+class BookPopularity(SQLModel, table=True):
+    __tablename__ = "book_popularity"
+    # merged snapshots of the per-worker counters in utils/popularity.py
+    book_id: uuid.UUID = Field(
+        sa_column=Column(
+            pg.UUID,
+            ForeignKey("books.uid", ondelete="CASCADE"),
+            nullable=False,
+            primary_key=True
+        )
+    )
+    # ln(decayed borrow activity) + lambda * epoch seconds, so it orders by
+    # current popularity without being rewritten as time passes
+    trend_key: float = Field(
+        sa_column=Column(
+            pg.DOUBLE_PRECISION,
+            name="trend_key",
+            nullable=True,
+            index=True
+        )
+    )
+    borrow_count: int = Field(
+        sa_column=Column(
+            pg.INTEGER,
+            name="borrow_count",
+            nullable=False,
+            index=True
+        )
+    )
+    rating_sum: float = Field(
+        sa_column=Column(
+            pg.DOUBLE_PRECISION,
+            name="rating_sum",
+            nullable=False
+        )
+    )
+    rating_count: int = Field(
+        sa_column=Column(
+            pg.INTEGER,
+            name="rating_count",
+            nullable=False
+        )
+    )
+    updated_at: datetime = Field(
+        sa_column=Column(
+            pg.TIMESTAMP,
+            name="updated_at",
+            nullable=False
+        )
+    )
+
+class RateLimitBuckets(SQLModel, table=True):
+    __tablename__ = "rate_limit_buckets"
+    # only used by the shared rate limiter backend; losing it on a crash is fine
+    __table_args__ = {"prefixes": ["UNLOGGED"]}
+    key: str = Field(
+        sa_column=Column(
+            pg.VARCHAR,
+            name="key",
+            nullable=False,
+            primary_key=True
+        )
+    )
+    tokens: float = Field(
+        sa_column=Column(
+            pg.DOUBLE_PRECISION,
+            name="tokens",
+            nullable=False
+        )
+    )
+    allowed: bool = Field(
+        sa_column=Column(
+            pg.BOOLEAN,
+            name="allowed",
+            nullable=False
+        )
+    )
+    updated_at: datetime = Field(
+        sa_column=Column(
+            pg.TIMESTAMP(timezone=True),
+            name="updated_at",
+            nullable=False
+        )
+    )
+
+class IdempotencyKeys(SQLModel, table=True):
+    __tablename__ = "idempotency_keys"
+    key: str = Field(
+        sa_column=Column(
+            pg.VARCHAR,
+            name="key",
+            nullable=False,
+            primary_key=True
+        )
+    )
+    request_hash: str = Field(
+        sa_column=Column(
+            pg.VARCHAR,
+            name="request_hash",
+            nullable=False
+        )
+    )
+    status: str = Field(
+        sa_column=Column(
+            pg.VARCHAR,
+            name="status",
+            nullable=False,
+            server_default="in_progress"
+        )
+    )
+    response_status: int = Field(
+        sa_column=Column(
+            pg.INTEGER,
+            name="response_status",
+            nullable=True
+        )
+    )
+    response_headers: dict = Field(
+        sa_column=Column(
+            pg.JSONB,
+            name="response_headers",
+            nullable=True
+        )
+    )
+    response_body: bytes = Field(
+        sa_column=Column(
+            pg.BYTEA,
+            name="response_body",
+            nullable=True
+        )
+    )
+    created_at: datetime = Field(
+        sa_column=Column(
+            pg.TIMESTAMP,
+            name="created_at",
+            default=datetime.utcnow,
+            nullable=False
+        )
+    )
+    expires_at: datetime = Field(
+        sa_column=Column(
+            pg.TIMESTAMP,
+            name="expires_at",
+            nullable=False,
+            index=True
+        )
+    )
+
+    __table_args__ = (
+        CheckConstraint("status IN ('in_progress', 'completed')", name="valid_idempotency_status_check"),
+    )
+
+class Jobs(SQLModel, table=True):
+    __tablename__ = "jobs"
+    uid: uuid.UUID = Field(
+        sa_column=Column(
+            pg.UUID,
+            name="uid",
+            nullable=False,
+            primary_key=True,
+            default=uuid.uuid4
+        )
+    )
+    kind: str = Field(
+        sa_column=Column(
+            pg.VARCHAR,
+            name="kind",
+            nullable=False
+        )
+    )
+    params: dict = Field(
+        sa_column=Column(
+            pg.JSONB,
+            name="params",
+            nullable=False,
+            server_default=text("'{}'::jsonb")
+        )
+    )
+    status: str = Field(
+        sa_column=Column(
+            pg.VARCHAR,
+            name="status",
+            nullable=False,
+            server_default="queued"
+        )
+    )
+    progress: float = Field(
+        sa_column=Column(
+            pg.DOUBLE_PRECISION,
+            name="progress",
+            nullable=False,
+            server_default="0"
+        )
+    )
+    message: str = Field(
+        sa_column=Column(
+            pg.VARCHAR,
+            name="message",
+            nullable=True
+        )
+    )
+    result: dict = Field(
+        sa_column=Column(
+            pg.JSONB,
+            name="result",
+            nullable=True
+        )
+    )
+    error: str = Field(
+        sa_column=Column(
+            pg.VARCHAR,
+            name="error",
+            nullable=True
+        )
+    )
+    cancel_requested: bool = Field(
+        sa_column=Column(
+            pg.BOOLEAN,
+            name="cancel_requested",
+            nullable=False,
+            server_default="false"
+        )
+    )
+    worker: str = Field(
+        sa_column=Column(
+            pg.VARCHAR,
+            name="worker",
+            nullable=True
+        )
+    )
+    created_by: uuid.UUID = Field(
+        sa_column=Column(
+            pg.UUID,
+            ForeignKey("users.uid", ondelete="SET NULL"),
+            name="created_by",
+            nullable=True
+        )
+    )
+    created_at: datetime = Field(
+        sa_column=Column(
+            pg.TIMESTAMP,
+            name="created_at",
+            default=datetime.utcnow,
+            nullable=False
+        )
+    )
+    started_at: datetime = Field(
+        sa_column=Column(
+            pg.TIMESTAMP,
+            name="started_at",
+            nullable=True
+        )
+    )
+    heartbeat_at: datetime = Field(
+        sa_column=Column(
+            pg.TIMESTAMP,
+            name="heartbeat_at",
+            nullable=True
+        )
+    )
+    finished_at: datetime = Field(
+        sa_column=Column(
+            pg.TIMESTAMP,
+            name="finished_at",
+            nullable=True
+        )
+    )
+
+    __table_args__ = (
+        CheckConstraint("status IN ('queued', 'running', 'succeeded', 'failed', 'cancelled')",
+                        name="valid_job_status_check"),
+        # workers claim the oldest queued job, the stale-job check scans running ones
+        Index("ix_jobs_status_created_at", "status", "created_at"),
+    )
+
+class ScheduledRuns(SQLModel, table=True):
+    __tablename__ = "scheduled_runs"
+    name: str = Field(
+        sa_column=Column(
+            pg.VARCHAR,
+            name="name",
+            nullable=False,
+            primary_key=True
+        )
+    )
+    last_scheduled_at: datetime = Field(
+        sa_column=Column(
+            pg.TIMESTAMP,
+            name="last_scheduled_at",
+            nullable=False
+        )
+    )
+    last_started_at: datetime = Field(
+        sa_column=Column(
+            pg.TIMESTAMP,
+            name="last_started_at",
+            nullable=False
+        )
+    )
+    last_finished_at: datetime = Field(
+        sa_column=Column(
+            pg.TIMESTAMP,
+            name="last_finished_at",
+            nullable=False
+        )
+    )
+    last_status: str = Field(
+        sa_column=Column(
+            pg.VARCHAR,
+            name="last_status",
+            nullable=False
+        )
+    )
+    last_error: str = Field(
+        sa_column=Column(
+            pg.VARCHAR,
+            name="last_error",
+            nullable=True
+        )
+    )
+    last_duration_ms: float = Field(
+        sa_column=Column(
+            pg.DOUBLE_PRECISION,
+            name="last_duration_ms",
+            nullable=False
+        )
+    )
+    last_lag_ms: float = Field(
+        sa_column=Column(
+            pg.DOUBLE_PRECISION,
+            name="last_lag_ms",
+            nullable=False
+        )
+    )
+    worker: str = Field(
+        sa_column=Column(
+            pg.VARCHAR,
+            name="worker",
+            nullable=False
+        )
+    )
+    run_count: int = Field(
+        sa_column=Column(
+            pg.INTEGER,
+            name="run_count",
+            nullable=False,
+            server_default="0"
+        )
+    )
+    failure_count: int = Field(
+        sa_column=Column(
+            pg.INTEGER,
+            name="failure_count",
+            nullable=False,
+            server_default="0"
+        )
+    )
+    missed_count: int = Field(
+        sa_column=Column(
+            pg.INTEGER,
+            name="missed_count",
+            nullable=False,
+            server_default="0"
+        )
+    )
+    total_duration_ms: float = Field(
+        sa_column=Column(
+            pg.DOUBLE_PRECISION,
+            name="total_duration_ms",
+            nullable=False,
+            server_default="0"
+        )
+    )
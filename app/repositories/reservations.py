@@ -0,0 +1,158 @@
+from sqlalchemy import func, update, case
+from sqlalchemy.future import select
+from sqlalchemy.orm import selectinload
+
+from repositories.models import Books, BookCopies, Requests, Transactions
+from utils.request_events import publish_request_event
+
+# A book has total_copies copies: available_copies are on the shelf for anyone,
+# held_copies are on the shelf but kept for requests promoted from the reservation
+# queue, and the rest are lent out. Requests made while no copy is available wait
+# in a FIFO queue with status "queued" (ordered by requested_at, served by
+# ix_requests_book_status_requested_at). A copy that comes back goes to the head
+# of the queue, which becomes a normal pending request holding that copy until an
+# admin accepts or rejects it. The queue is only ever non-empty while
+# available_copies is 0.
+
+
+async def lock_book(session, book_id):
+    result = await session.execute(select(Books).where(Books.uid == book_id)
+                                   .with_for_update().execution_options(populate_existing=True))
+    return result.scalar_one_or_none()
+
+
+async def queue_length(session, book_id) -> int:
+    result = await session.execute(
+        select(func.count()).select_from(Requests).where(Requests.book_id == book_id, Requests.status == "queued"))
+    return result.scalar()
+
+
+async def pending_count(session, book_id) -> int:
+    result = await session.execute(
+        select(func.count()).select_from(Requests).where(Requests.book_id == book_id, Requests.status == "pending"))
+    return result.scalar()
+
+
+async def claim_copy(session, book_id):
+    # takes a held copy if there is one, otherwise a free one; no row comes back when
+    # every copy is lent out. The update keeps the book's row lock until commit.
+    result = await session.execute(
+        update(Books)
+        .where(Books.uid == book_id, Books.available_copies + Books.held_copies > 0)
+        .values(held_copies=Books.held_copies - case((Books.held_copies > 0, 1), else_=0),
+                available_copies=Books.available_copies - case((Books.held_copies > 0, 0), else_=1))
+        .returning(Books.available_copies, Books.held_copies)
+        .execution_options(synchronize_session=False))
+    return result.one_or_none()
+
+
+async def requeue_unserved(session, book_id, held_copies, exclude):
+    # with nothing left on the shelf only the oldest pending requests, one per held
+    # copy, can still be served; the others go back to the queue
+    result = await session.execute(
+        select(Requests)
+        .where(Requests.book_id == book_id, Requests.uid != exclude, Requests.status == "pending")
+        .order_by(Requests.requested_at)
+        .offset(held_copies))
+    return result.scalars().all()
+
+
+async def find_copy(session, book_id, barcode):
+    result = await session.execute(select(BookCopies).where(BookCopies.barcode == barcode))
+    copy = result.scalar_one_or_none()
+    if not copy or copy.book_id != book_id:
+        raise Exception("No copy of this book has that barcode.")
+    result = await session.execute(
+        select(Transactions.uid).where(Transactions.copy_id == copy.uid, Transactions.returned_at.is_(None)))
+    if result.scalar_one_or_none() is not None:
+        raise Exception("This copy is already lent out.")
+    return copy
+
+
+async def remove_barcodes(session, book, barcodes):
+    result = await session.execute(
+        select(BookCopies).where(BookCopies.book_id == book.uid, BookCopies.barcode.in_(barcodes)))
+    copies = result.scalars().all()
+    if len(copies) != len(set(barcodes)):
+        raise Exception("No copy of this book has that barcode.")
+    result = await session.execute(
+        select(Transactions.uid).where(Transactions.copy_id.in_([copy.uid for copy in copies]),
+                                       Transactions.returned_at.is_(None)).limit(1))
+    if result.scalar_one_or_none() is not None:
+        raise Exception("A copy that is lent out can't be removed.")
+    for copy in copies:
+        await session.delete(copy)
+    await session.flush()
+
+
+async def add_copies(session, book, count, barcodes=()):
+    # the caller must hold the book's row lock (see lock_book)
+    if count < 0:
+        raise Exception("The number of copies to add cannot be negative.")
+    # book.total_copies may be stale after remove_copies, read the stored total
+    total = (await session.execute(select(Books.total_copies).where(Books.uid == book.uid))).scalar()
+    result = await session.execute(select(func.count()).select_from(BookCopies).where(BookCopies.book_id == book.uid))
+    if result.scalar() + len(barcodes) > total + count:
+        raise Exception("There are more barcodes than copies of this book.")
+    session.add_all([BookCopies(book_id=book.uid, barcode=barcode) for barcode in barcodes])
+    if count:
+        await session.execute(update(Books).where(Books.uid == book.uid)
+                              .values(total_copies=Books.total_copies + count)
+                              .execution_options(synchronize_session=False))
+        for _ in range(count):
+            await release_copy(session, book)
+
+
+async def remove_copies(session, book, count):
+    # only copies on the shelf and not held for anyone can be written off
+    result = await session.execute(
+        update(Books)
+        .where(Books.uid == book.uid, Books.available_copies >= count, Books.total_copies > count)
+        .values(total_copies=Books.total_copies - count, available_copies=Books.available_copies - count)
+        .returning(Books.uid)
+        .execution_options(synchronize_session=False))
+    if result.scalar_one_or_none() is None:
+        raise Exception("Only copies that are on the shelf can be removed, and at least one copy must remain.")
+    result = await session.execute(select(func.count()).select_from(BookCopies).where(BookCopies.book_id == book.uid))
+    if result.scalar() > book.total_copies - count:
+        raise Exception("There are more barcodes than copies of this book.")
+
+
+async def release_copy(session, book, from_hold=False):
+    # the caller must hold the book's row lock (see lock_book). A copy coming back from
+    # a loan, or from a rejected holder, goes to the head of the queue if anyone waits.
+    result = await session.execute(
+        select(Requests)
+        .options(selectinload(Requests.request_user))
+        .where(Requests.book_id == book.uid, Requests.status == "queued")
+        .order_by(Requests.requested_at)
+        .limit(1))
+    next_request = result.scalar_one_or_none()
+
+    if from_hold:
+        condition = Books.held_copies > 0
+        values = {} if next_request else {'held_copies': Books.held_copies - 1,
+                                          'available_copies': Books.available_copies + 1}
+    else:
+        condition = Books.available_copies + Books.held_copies < Books.total_copies
+        values = ({'held_copies': Books.held_copies + 1} if next_request else
+                  {'available_copies': Books.available_copies + 1})
+    if values:
+        result = await session.execute(
+            update(Books).where(Books.uid == book.uid, condition).values(values)
+            .returning(Books.uid).execution_options(synchronize_session=False))
+        if result.scalar_one_or_none() is None:
+            raise Exception("Every copy of this book is already on the shelf.")
+    if not next_request:
+        return None
+
+    next_request.status = "pending"
+    await publish_request_event(session, 'request_created', {
+        'uid': next_request.uid,
+        'username': next_request.request_user.username,
+        'name': next_request.request_user.name,
+        'book_title': book.title,
+        'requested_at': next_request.requested_at,
+        'duration': next_request.duration
+    })
+    return next_request
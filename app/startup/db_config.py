@@ -1,6 +1,9 @@
+from contextvars import ContextVar
+from typing import Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
+from sqlalchemy import text, event
 from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import SQLModel
 from repositories.models import Users
@@ -13,6 +16,82 @@ class Settings(BaseSettings):
     POSTGRES_DB: str
     JWT_SECRET: str
     JWT_ALGORITHM: str
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_PING_TIMEOUT: float = 2
+    # optional streaming replica for read-only routes; pointing it at the primary is fine for local runs
+    POSTGRES_REPLICA_HOST: Optional[str] = None
+    POSTGRES_REPLICA_PORT: Optional[int] = None
+    REPLICA_MAX_LAG_SECONDS: float = 5
+    REPLICA_LAG_CHECK_SECONDS: float = 2
+    REPLICA_STICKY_SECONDS: int = 10
+    # server-side statement_timeout per route class, 0 disables; STATEMENT_TIMEOUTS_MS overrides single paths
+    STATEMENT_TIMEOUT_READ_MS: int = 5000
+    STATEMENT_TIMEOUT_WRITE_MS: int = 15000
+    STATEMENT_TIMEOUTS_MS: dict[str, int] = {}
+    QUERY_BUDGET: int = 10
+    QUERY_BUDGETS: dict[str, int] = {}
+    SLOW_QUERY_MS: float = 500
+    SLOW_QUERY_EXPLAIN_SAMPLE_RATE: float = 1.0
+    SLOW_QUERY_EXPLAIN_TIMEOUT_MS: int = 10000
+    SLOW_QUERY_BUFFER_SIZE: int = 200
+    MEMORY_SAMPLE_INTERVAL: float = 60
+    MEMORY_SAMPLE_HISTORY: int = 1440
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: str = "memory"
+    RATE_LIMITS: dict[str, str] = {}
+    IDEMPOTENCY_TTL_SECONDS: int = 86400
+    IDEMPOTENCY_WAIT_SECONDS: float = 30
+    BATCH_MAX_ITEMS: int = 20
+    BATCH_MAX_CONCURRENCY: int = 3
+    COMPRESSION_MIN_SIZE: int = 1024
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_LEVEL: int = 5
+    COMPRESSION_ZSTD_LEVEL: int = 3
+    CATALOG_CACHE_TTL: float = 30
+    CATALOG_CACHE_MAX_ENTRIES: int = 1000
+    FACET_LIMIT: int = 20
+    SSE_HEARTBEAT_SECONDS: float = 15
+    SSE_CLIENT_BUFFER: int = 100
+    SSE_REPLAY_SIZE: int = 1000
+    SIMILAR_BOOKS_TOP_K: int = 20
+    SIMILAR_BOOKS_REFRESH_SECONDS: float = 900
+    TFIDF_STORE_DIR: str = "data/tfidf"
+    TFIDF_FEATURES: int = 2 ** 20
+    TFIDF_WORKERS: int = 2
+    TFIDF_CHUNK_SIZE: int = 20000
+    TFIDF_QUERY_TERMS: int = 32
+    TFIDF_MAX_DELTA: int = 5000
+    TFIDF_REBUILD_SECONDS: float = 86400
+    TFIDF_CHECK_SECONDS: float = 60
+    # book_popularity has to be rebuilt (admin endpoint) after changing the half-life
+    POPULARITY_HALF_LIFE_HOURS: float = 72
+    POPULARITY_REQUEST_WEIGHT: float = 1
+    POPULARITY_ACCEPT_WEIGHT: float = 3
+    POPULARITY_RATING_PRIOR: float = 5
+    POPULARITY_SNAPSHOT_SECONDS: float = 60
+    POPULARITY_LEADERBOARD_SIZE: int = 100
+    SUGGEST_KEY_LENGTH: int = 40
+    SUGGEST_MAX_ENTRIES: int = 2_000_000
+    # finished transactions are archived this long after the return, rejected requests deleted
+    ARCHIVE_AFTER_DAYS: int = 365
+    REJECTED_RETENTION_DAYS: int = 180
+    ARCHIVE_BATCH_SIZE: int = 1000
+    ARCHIVE_INTERVAL_SECONDS: float = 3600
+    # background jobs: each worker runs at most JOBS_CONCURRENCY of them at a time
+    JOBS_CONCURRENCY: int = 2
+    JOBS_POLL_SECONDS: float = 5
+    JOBS_HEARTBEAT_SECONDS: float = 10
+    JOBS_STALE_SECONDS: float = 60
+    JOBS_PROGRESS_INTERVAL_SECONDS: float = 1
+    JOBS_BATCH_SIZE: int = 1000
+    JOBS_EXPORT_DIR: str = "data/exports"
+    # cluster-wide periodic tasks; SCHEDULES overrides a task's timing by name
+    # ("*/15 * * * *", "@every 10m" or "off")
+    SCHEDULER_ENABLED: bool = True
+    SCHEDULER_JITTER_SECONDS: float = 5
+    SCHEDULER_GRACE_SECONDS: float = 60
+    SCHEDULES: dict[str, str] = {}
 
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -28,16 +107,103 @@ DATABASE_URL = (
 )
 
 # Now creating the engine using the new DATABASE_URL
-engine = create_async_engine(DATABASE_URL, echo=True)
+engine = create_async_engine(DATABASE_URL, echo=True,
+                             pool_size=Config.DB_POOL_SIZE,
+                             max_overflow=Config.DB_MAX_OVERFLOW)
+
+replica_engine = None
+if Config.POSTGRES_REPLICA_HOST:
+    replica_engine = create_async_engine(
+        f"postgresql+asyncpg://{Config.POSTGRES_USER}:{Config.POSTGRES_PASSWORD}@"
+        f"{Config.POSTGRES_REPLICA_HOST}:{Config.POSTGRES_REPLICA_PORT or Config.POSTGRES_PORT}/{Config.POSTGRES_DB}",
+        echo=True,
+        pool_size=Config.DB_POOL_SIZE,
+        max_overflow=Config.DB_MAX_OVERFLOW)
+
+engines = [engine] if replica_engine is None else [engine, replica_engine]
+
+
+def listens_for_all(identifier):
+    # event.listens_for on the primary and, when configured, the replica
+    def decorate(fn):
+        for bound in engines:
+            event.listen(bound.sync_engine, identifier, fn)
+        return fn
+    return decorate
+
+
+# set for each request by middleware/replica.py
+read_from_replica: ContextVar[bool] = ContextVar("read_from_replica", default=False)
+request_commits: ContextVar[Optional[list]] = ContextVar("request_commits", default=None)
+# set for each request by middleware/timeouts.py
+statement_timeout_ms: ContextVar[int] = ContextVar("statement_timeout_ms", default=0)
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if replica_engine is not None and read_from_replica.get():
+            return replica_engine.sync_engine
+        return engine.sync_engine
+
+
+@event.listens_for(RoutingSession, "after_begin")
+def _apply_statement_timeout(session, transaction, connection):
+    timeout = statement_timeout_ms.get()
+    if timeout:
+        # SET LOCAL ends with the transaction, the pooled connection keeps no trace of it
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout)}")
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _remember_commit(session):
+    commits = request_commits.get()
+    if commits is not None:
+        commits.append(session)
+
 
 # Create session factory
 async_session_factory = sessionmaker(
-    bind=engine,
     class_=AsyncSession,
+    sync_session_class=RoutingSession,
     expire_on_commit=False  # Prevents expiration of objects after commit
 )
 
+# columns create_all cannot add to tables created by an older version
+MIGRATIONS = [
+    # single copy per book -> copy counters; an unavailable book was either lent out
+    # or held for the request promoted from its queue
+    text("""
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                       WHERE table_name = 'books' AND column_name = 'total_copies') THEN
+            ALTER TABLE books ADD COLUMN total_copies INTEGER NOT NULL DEFAULT 1,
+                              ADD COLUMN available_copies INTEGER NOT NULL DEFAULT 1,
+                              ADD COLUMN held_copies INTEGER NOT NULL DEFAULT 0;
+            UPDATE books SET available_copies = 0,
+                             held_copies = CASE WHEN EXISTS (
+                                 SELECT 1 FROM transactions JOIN requests ON requests.uid = transactions.request_id
+                                 WHERE requests.book_id = books.uid AND transactions.returned_at IS NULL)
+                             THEN 0 ELSE 1 END
+            WHERE NOT availability;
+            ALTER TABLE books DROP COLUMN availability;
+            ALTER TABLE books ADD COLUMN availability BOOLEAN GENERATED ALWAYS AS (available_copies > 0) STORED,
+                              ADD CONSTRAINT ck_books_copies CHECK (available_copies >= 0 AND held_copies >= 0
+                                  AND available_copies + held_copies <= total_copies);
+        END IF;
+    END $$
+    """),
+    text("ALTER TABLE transactions ADD COLUMN IF NOT EXISTS copy_id UUID "
+         "REFERENCES book_copies(uid) ON DELETE SET NULL"),
+]
+
 async def init_db():
     async with engine.begin() as conn:
         print('creating all table')
         await conn.run_sync(SQLModel.metadata.create_all)
+        for migration in MIGRATIONS:
+            await conn.execute(migration)
+        # create_all skips tables that already exist, indexes added to them later still need creating
+        await conn.run_sync(lambda sync_conn: [index.create(sync_conn, checkfirst=True)
+                                               for table in SQLModel.metadata.sorted_tables
+                                               for index in table.indexes])
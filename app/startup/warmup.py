@@ -0,0 +1,61 @@
+import asyncio
+import uuid
+from contextlib import AsyncExitStack
+
+from sqlalchemy import text
+from sqlalchemy.future import select
+
+from startup.db_config import engine, Config
+from repositories.models import Users, Books, Requests, Transactions, BookReviews
+
+
+class Readiness:
+    def __init__(self):
+        self.warmed_up = False
+        self.error = None
+        self.lock = asyncio.Lock()
+
+
+readiness = Readiness()
+
+# The lookups nearly every route starts with. Running them once per pooled
+# connection with sentinel keys is cheap (unique/primary key probes) and leaves
+# the statements prepared in the asyncpg statement cache of each connection.
+_NIL = uuid.UUID(int=0)
+HOT_STATEMENTS = [
+    select(Users).where(Users.username == ''),
+    select(Books).where(Books.uid == _NIL),
+    select(Requests).where(Requests.uid == _NIL),
+    select(Transactions).where(Transactions.uid == _NIL),
+    select(BookReviews).where(BookReviews.uid == _NIL),
+]
+
+
+async def _prepare(conn):
+    for statement in HOT_STATEMENTS:
+        await conn.execute(statement)
+    await conn.rollback()
+
+
+async def warm_up_pool():
+    async with readiness.lock:
+        if readiness.warmed_up:
+            return
+        try:
+            # hold every connection at once so the pool really opens DB_POOL_SIZE of them
+            async with AsyncExitStack() as stack:
+                connections = [await stack.enter_async_context(engine.connect())
+                               for _ in range(Config.DB_POOL_SIZE)]
+                await asyncio.gather(*(_prepare(conn) for conn in connections))
+            readiness.warmed_up = True
+            readiness.error = None
+        except Exception as e:
+            readiness.error = str(e)
+            raise
+
+
+async def ping_db():
+    async def ping():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    await asyncio.wait_for(ping(), timeout=Config.DB_PING_TIMEOUT)
@@ -1,7 +1,7 @@
 from passlib.context import CryptContext
 from jose import jwt,JWTError
 from datetime import datetime,timedelta
-from fastapi import Header,HTTPException,status
+from fastapi import Header,HTTPException,status,Request
 from fastapi.responses import JSONResponse
 
 from startup.db_config import Config
@@ -30,7 +30,11 @@ def decode_token(token:str):
                        algorithms=Config.JWT_ALGORITHM)
     return token_data
 
-def get_current_user(authorization: str = Header(None)):
+def get_current_user(request: Request, authorization: str = Header(None)):
+    # sub-requests of /api/v1/batch arrive already authenticated
+    principal = request.scope.get("principal")
+    if principal is not None:
+        return principal,''
     if not authorization:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -48,7 +52,12 @@ def get_current_user(authorization: str = Header(None)):
     except Exception as e:
         return {},str(e)
     
-def get_current_admin(authorization: str = Header(None)):
+def get_current_admin(request: Request, authorization: str = Header(None)):
+    principal = request.scope.get("principal")
+    if principal is not None:
+        if principal.get("role") != "admin":
+            return {},"You do not have permission to access this feature."
+        return principal,''
     if not authorization:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -66,4 +75,16 @@ def get_current_admin(authorization: str = Header(None)):
             raise Exception("You do not have permission to access this feature.")
         return payload,''
     except Exception as e:
-        return {},str(e)
\ No newline at end of file
+        return {},str(e)
+
+def client_identity(request: Request) -> str:
+    authorization = request.headers.get("authorization", "")
+    token_type, _, token = authorization.partition(" ")
+    if token_type.lower() == "bearer" and token:
+        try:
+            uid = decode_token(token).get("uid")
+            if uid:
+                return f"user:{uid}"
+        except Exception:
+            pass
+    return f"ip:{request.client.host if request.client else 'unknown'}"
@@ -0,0 +1,59 @@
+import gzip
+
+from startup.db_config import Config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _gzip(data: bytes) -> bytes:
+    return gzip.compress(data, compresslevel=Config.COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+def _brotli(data: bytes) -> bytes:
+    return brotli.compress(data, quality=Config.COMPRESSION_BROTLI_LEVEL)
+
+
+def _zstd(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=Config.COMPRESSION_ZSTD_LEVEL).compress(data)
+
+
+# in order of preference when the client accepts several
+COMPRESSORS = {}
+if brotli is not None:
+    COMPRESSORS["br"] = _brotli
+if zstandard is not None:
+    COMPRESSORS["zstd"] = _zstd
+COMPRESSORS["gzip"] = _gzip
+
+
+def negotiate(accept_encoding: str):
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in COMPRESSORS:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(encoding: str, data: bytes) -> bytes:
+    return COMPRESSORS[encoding](data)
@@ -0,0 +1,148 @@
+import asyncio
+import csv
+import os
+from contextlib import suppress
+from datetime import datetime
+
+from pydantic import TypeAdapter
+from sqlalchemy import text, func
+from sqlalchemy.future import select
+
+from startup.db_config import engine, async_session_factory, Config
+from api.schemas.book import AddBook
+from repositories.models import Books, BookCopies, Transactions
+from repositories.archive import archive_history
+from utils.jobs import job_kind
+from utils.popularity import popularity
+from utils.similar_books import refresh_similar_books
+from utils.response_cache import catalog_cache
+from utils.text_search import text_search
+from utils.suggest import publish_book_changes
+
+# one batch per transaction, like the archiver, so a long sweep never holds many row locks
+_FLAG_OVERDUE = text("""
+    UPDATE transactions SET is_overdue = true
+    WHERE uid IN (SELECT uid FROM transactions
+                  WHERE returned_at IS NULL AND due_date < :now AND is_overdue IS NOT TRUE
+                  LIMIT :batch_size FOR UPDATE SKIP LOCKED)
+""")
+
+EXPORT_COLUMNS = ('uid', 'title', 'author', 'category', 'summary', 'total_copies', 'available_copies')
+
+
+def export_path(job_id) -> str:
+    return os.path.join(Config.JOBS_EXPORT_DIR, f"books-{job_id}.csv")
+
+
+async def flag_overdue_loans(progress=None) -> int:
+    now = datetime.utcnow()
+    async with engine.connect() as conn:
+        total = (await conn.execute(select(func.count()).select_from(Transactions).where(
+            Transactions.returned_at.is_(None), Transactions.due_date < now,
+            Transactions.is_overdue.isnot(True)))).scalar()
+    flagged = 0
+    while True:
+        async with engine.begin() as conn:
+            count = (await conn.execute(_FLAG_OVERDUE, {'now': now, 'batch_size': Config.JOBS_BATCH_SIZE})).rowcount
+        flagged += count
+        if progress is not None:
+            await progress(flagged, total)
+        if count < Config.JOBS_BATCH_SIZE:
+            return flagged
+
+
+@job_kind('overdue_sweep')
+async def overdue_sweep(job):
+    return {'flagged': await flag_overdue_loans(job.progress)}
+
+
+@job_kind('archive_history')
+async def archive(job):
+    return await archive_history()
+
+
+@job_kind('popularity_rebuild')
+async def rebuild_popularity(job):
+    await popularity.rebuild(replace=True)
+    await popularity.load()
+
+
+@job_kind('similar_books_refresh')
+async def refresh_similar(job, full: bool = False):
+    return {'books': await refresh_similar_books(full=full)}
+
+
+@job_kind('import_books')
+async def import_books(job, books: list):
+    requests = TypeAdapter(list[AddBook]).validate_python(books)
+    for book_request in requests:
+        if not all(value.strip() for value in (book_request.title, book_request.author,
+                                               book_request.category, book_request.summary)):
+            raise Exception(f"Title, author, category and summary cannot be empty ({book_request.title}).")
+        if len(book_request.barcodes) > book_request.total_copies:
+            raise Exception(f"There are more barcodes than copies of {book_request.title}.")
+
+    imported = 0
+    try:
+        for start in range(0, len(requests), Config.JOBS_BATCH_SIZE):
+            new_books = []
+            async with async_session_factory() as session:
+                for book_request in requests[start:start + Config.JOBS_BATCH_SIZE]:
+                    new_book = Books(
+                        title=book_request.title,
+                        author=book_request.author,
+                        category=book_request.category,
+                        summary=book_request.summary,
+                        total_copies=book_request.total_copies,
+                        available_copies=book_request.total_copies,
+                        admin_id=job.created_by
+                    )
+                    new_books.append(new_book)
+                    session.add(new_book)
+                    session.add_all([BookCopies(book=new_book, barcode=barcode)
+                                     for barcode in book_request.barcodes])
+                await session.flush()
+                await publish_book_changes(session, 'upsert', new_books)
+                await session.commit()
+            imported += len(new_books)
+            text_search.index_books(new_books)
+            await job.progress(imported, len(requests), f"{imported} of {len(requests)} books imported")
+    finally:
+        # batches committed before a failure or a cancel stay in the catalog
+        if imported:
+            catalog_cache.clear()
+    return {'imported': imported}
+
+
+@job_kind('export_books')
+async def export_books(job, category: str = None):
+    filters = [Books.category == category] if category else []
+    async with engine.connect() as conn:
+        total = (await conn.execute(select(func.count()).select_from(Books).where(*filters))).scalar()
+
+    os.makedirs(Config.JOBS_EXPORT_DIR, exist_ok=True)
+    path = export_path(job.uid)
+    exported, last_uid = 0, None
+    try:
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(EXPORT_COLUMNS)
+            while True:
+                # keyset pagination, each page is a short query instead of one long-lived cursor
+                query = select(*[getattr(Books, column) for column in EXPORT_COLUMNS]).where(*filters)
+                if last_uid is not None:
+                    query = query.where(Books.uid > last_uid)
+                async with engine.connect() as conn:
+                    rows = (await conn.execute(query.order_by(Books.uid).limit(Config.JOBS_BATCH_SIZE))).all()
+                if not rows:
+                    break
+                await asyncio.to_thread(writer.writerows, rows)
+                exported += len(rows)
+                last_uid = rows[-1].uid
+                await job.progress(exported, total, f"{exported} of {total} books exported")
+    except BaseException:
+        # a cancelled or failed export leaves nothing half-written behind
+        with suppress(FileNotFoundError):
+            os.remove(path)
+        raise
+    return {'file': os.path.basename(path), 'rows': exported}
@@ -0,0 +1,230 @@
+import asyncio
+import inspect
+import json
+import os
+import socket
+import time
+from contextlib import suppress
+from datetime import datetime, timedelta
+
+from sqlalchemy import text, update
+import sqlalchemy.dialects.postgresql as pg
+
+from startup.db_config import engine, Config
+from repositories.models import Jobs
+from utils.pg_listener import pg_listener
+
+# Long admin operations run as jobs instead of inside the request. A job is a row
+# in the jobs table; every worker runs a JobRunner that claims queued rows with
+# SKIP LOCKED, so a job runs exactly once whichever worker picks it up, and at
+# most JOBS_CONCURRENCY jobs run per worker. Submitting and cancelling notify the
+# "jobs" channel to wake the runners up, the periodic poll and heartbeat only
+# catch what a lost notification missed.
+
+CHANNEL = "jobs"
+
+_NOTIFY = text("SELECT pg_notify(:channel, :payload)")
+
+_CLAIM = text("""
+    UPDATE jobs SET status = 'running', started_at = :now, heartbeat_at = :now, worker = :worker
+    WHERE uid = (SELECT uid FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1 FOR UPDATE SKIP LOCKED)
+    RETURNING uid, kind, params, created_by
+""").columns(uid=pg.UUID, kind=pg.VARCHAR, params=pg.JSONB, created_by=pg.UUID)
+
+# a job whose worker stopped sending heartbeats died with it; running it again could
+# repeat half-done work, so it is failed and left to the admin to resubmit
+_FAIL_STALE = text("""
+    UPDATE jobs SET status = 'failed', error = 'The worker running this job stopped.', finished_at = :now
+    WHERE status = 'running' AND heartbeat_at < :cutoff
+""")
+
+_HEARTBEAT = text("""
+    UPDATE jobs SET heartbeat_at = :now WHERE uid = ANY(:uids) RETURNING uid, cancel_requested
+""")
+
+JOB_KINDS = {}
+
+
+def job_kind(name: str):
+    # registers async fn(job: JobContext, **params) -> dict | None
+    def register(fn):
+        JOB_KINDS[name] = fn
+        return fn
+    return register
+
+
+def check_params(kind: str, params: dict):
+    if kind not in JOB_KINDS:
+        raise Exception(f"Unknown job kind. Available kinds: {', '.join(sorted(JOB_KINDS))}.")
+    try:
+        inspect.signature(JOB_KINDS[kind]).bind(None, **params)
+    except TypeError as e:
+        raise Exception(f"Invalid parameters for {kind}: {e}.")
+
+
+def job_entry(job: Jobs) -> dict:
+    return {
+        'uid': job.uid,
+        'kind': job.kind,
+        'params': job.params,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'result': job.result,
+        'error': job.error,
+        'worker': job.worker,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at
+    }
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    def __init__(self, uid, created_by):
+        self.uid = uid
+        self.created_by = created_by
+        self.written_at = 0.0
+
+    async def progress(self, done: float, total: float = None, message: str = None, force: bool = False):
+        # writes are throttled; reading cancel_requested back stops the job even
+        # when the cancel notification was lost
+        now = time.monotonic()
+        if not force and now - self.written_at < Config.JOBS_PROGRESS_INTERVAL_SECONDS:
+            return
+        self.written_at = now
+        fraction = done / total if total else min(done, 1.0)
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                update(Jobs).where(Jobs.uid == self.uid)
+                .values(progress=min(fraction, 1.0), message=message, heartbeat_at=datetime.utcnow())
+                .returning(Jobs.cancel_requested))
+            if result.scalar():
+                raise JobCancelled()
+
+
+class JobRunner:
+    def __init__(self):
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.running = {}
+        self.tasks = set()
+        self.wakeup = asyncio.Event()
+        self.stopping = False
+        pg_listener.listen(CHANNEL, self._on_notify, on_reconnect=self.wakeup.set)
+
+    def _on_notify(self, payload: str):
+        message = json.loads(payload)
+        if message['op'] == 'cancel':
+            task = self.running.get(message['uid'])
+            if task is not None:
+                task.cancel()
+        else:
+            self.wakeup.set()
+
+    async def submit(self, session, kind: str, params: dict, created_by) -> Jobs:
+        check_params(kind, params)
+        job = Jobs(kind=kind, params=params, status='queued', progress=0.0, created_by=created_by)
+        session.add(job)
+        await session.flush()
+        # delivered when the caller commits
+        await session.execute(_NOTIFY, {'channel': CHANNEL, 'payload': json.dumps({'op': 'submit'})})
+        return job
+
+    async def cancel(self, session, job: Jobs):
+        if job.status == 'queued':
+            job.status = 'cancelled'
+            job.finished_at = datetime.utcnow()
+        elif job.status == 'running':
+            job.cancel_requested = True
+            await session.execute(_NOTIFY, {'channel': CHANNEL,
+                                            'payload': json.dumps({'op': 'cancel', 'uid': str(job.uid)})})
+        else:
+            raise Exception(f"The job has already {job.status}.")
+
+    async def _claim(self):
+        now = datetime.utcnow()
+        async with engine.begin() as conn:
+            return (await conn.execute(_CLAIM, {'now': now, 'worker': self.worker})).one_or_none()
+
+    async def _execute(self, job):
+        status, result, error = 'succeeded', None, None
+        try:
+            if job.kind not in JOB_KINDS:
+                raise Exception("Unknown job kind.")
+            result = await JOB_KINDS[job.kind](JobContext(job.uid, job.created_by), **job.params)
+        except (JobCancelled, asyncio.CancelledError):
+            if self.stopping:
+                status, error = 'failed', 'The worker running this job was shut down.'
+            else:
+                status = 'cancelled'
+        except Exception as e:
+            status, error = 'failed', str(e) or e.__class__.__name__
+            print(f"job {job.uid} ({job.kind}) failed: {error}")
+
+        # a cancel arriving now must not interrupt saving the outcome
+        self.running.pop(str(job.uid), None)
+        values = {'status': status, 'result': result, 'error': error, 'finished_at': datetime.utcnow()}
+        if status == 'succeeded':
+            values['progress'] = 1.0
+        try:
+            async with engine.begin() as conn:
+                # another worker's stale check may have failed the job already, that outcome stands
+                saved = (await conn.execute(
+                    update(Jobs).where(Jobs.uid == job.uid, Jobs.status == 'running', Jobs.worker == self.worker)
+                    .values(values))).rowcount
+            if not saved:
+                print(f"job {job.uid} finished as {status} but was no longer running on this worker, not saved")
+        except Exception as e:
+            # the heartbeat stops with us, the stale check will fail the job
+            print(f"job {job.uid} finished as {status} but could not be saved: {e}")
+        finally:
+            self.wakeup.set()
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(Config.JOBS_HEARTBEAT_SECONDS)
+            try:
+                now = datetime.utcnow()
+                async with engine.begin() as conn:
+                    if self.running:
+                        beats = (await conn.execute(_HEARTBEAT, {'now': now,
+                                                                 'uids': list(self.running)})).all()
+                        for uid, cancel_requested in beats:
+                            task = self.running.get(str(uid))
+                            if cancel_requested and task is not None:
+                                task.cancel()
+                    await conn.execute(_FAIL_STALE, {
+                        'now': now, 'cutoff': now - timedelta(seconds=Config.JOBS_STALE_SECONDS)})
+            except Exception as e:
+                print(f"job heartbeat failed: {e}")
+
+    async def run(self):
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            while True:
+                self.wakeup.clear()
+                try:
+                    while len(self.running) < Config.JOBS_CONCURRENCY:
+                        job = await self._claim()
+                        if job is None:
+                            break
+                        task = asyncio.create_task(self._execute(job))
+                        self.running[str(job.uid)] = task
+                        self.tasks.add(task)
+                        task.add_done_callback(self.tasks.discard)
+                except Exception as e:
+                    print(f"claiming a job failed: {e}")
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.wakeup.wait(), Config.JOBS_POLL_SECONDS)
+        finally:
+            self.stopping = True
+            heartbeat.cancel()
+            for task in self.running.values():
+                task.cancel()
+            await asyncio.gather(heartbeat, *self.tasks, return_exceptions=True)
+
+
+job_runner = JobRunner()
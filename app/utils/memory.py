@@ -0,0 +1,105 @@
+import os
+import gc
+import asyncio
+import tracemalloc
+from collections import deque
+from datetime import datetime
+
+from startup.db_config import Config
+
+memory_samples = deque(maxlen=Config.MEMORY_SAMPLE_HISTORY)
+_baseline_snapshot = None
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_IGNORED_FILES = (tracemalloc.__file__, "<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>", "<unknown>")
+
+
+def current_rss() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        import resource
+        # peak rather than current RSS, but the best we get without /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def take_sample(count_objects: bool = True) -> dict:
+    sample = {
+        'recorded_at': datetime.utcnow(),
+        'pid': os.getpid(),
+        'rss_bytes': current_rss(),
+        'gc_objects': len(gc.get_objects()) if count_objects else None,
+        'gc_counts': gc.get_count(),
+        'tracemalloc_current_bytes': None,
+        'tracemalloc_peak_bytes': None
+    }
+    if tracemalloc.is_tracing():
+        sample['tracemalloc_current_bytes'], sample['tracemalloc_peak_bytes'] = tracemalloc.get_traced_memory()
+    return sample
+
+
+async def sample_memory_periodically():
+    while True:
+        memory_samples.append(take_sample())
+        await asyncio.sleep(Config.MEMORY_SAMPLE_INTERVAL)
+
+
+def start_tracing(frames: int = 1):
+    if tracemalloc.is_tracing():
+        raise Exception("tracemalloc is already running.")
+    tracemalloc.start(frames)
+
+
+def stop_tracing():
+    global _baseline_snapshot
+    if not tracemalloc.is_tracing():
+        raise Exception("tracemalloc is not running.")
+    tracemalloc.stop()
+    _baseline_snapshot = None
+
+
+def _filtered_snapshot():
+    if not tracemalloc.is_tracing():
+        raise Exception("tracemalloc is not running, start it first.")
+    return tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, pattern) for pattern in _IGNORED_FILES])
+
+
+def take_baseline_snapshot() -> dict:
+    global _baseline_snapshot
+    _baseline_snapshot = _filtered_snapshot()
+    return {'traced_bytes': sum(stat.size for stat in _baseline_snapshot.statistics('filename')),
+            'taken_at': datetime.utcnow()}
+
+
+def snapshot_diff(group_by: str = "lineno", limit: int = 25) -> list:
+    if _baseline_snapshot is None:
+        raise Exception("No baseline snapshot, take one first.")
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise Exception("group_by must be one of lineno, filename or traceback.")
+    stats = _filtered_snapshot().compare_to(_baseline_snapshot, group_by)
+    return [{
+        'location': [f"{frame.filename}:{frame.lineno}" if group_by != "filename" else frame.filename
+                     for frame in stat.traceback],
+        'size_bytes': stat.size,
+        'size_diff_bytes': stat.size_diff,
+        'count': stat.count,
+        'count_diff': stat.count_diff
+    } for stat in stats[:limit]]
+
+
+def prometheus_metrics() -> str:
+    sample = memory_samples[-1] if memory_samples else take_sample()
+    labels = f'{{pid="{sample["pid"]}"}}'
+    lines = [
+        "# TYPE process_resident_memory_bytes gauge",
+        f"process_resident_memory_bytes{labels} {current_rss()}",
+        "# TYPE python_gc_objects gauge",
+        f"python_gc_objects{labels} {sample['gc_objects']}",
+    ]
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        lines += ["# TYPE python_tracemalloc_bytes gauge",
+                  f'python_tracemalloc_bytes{{pid="{sample["pid"]}",kind="current"}} {current}',
+                  f'python_tracemalloc_bytes{{pid="{sample["pid"]}",kind="peak"}} {peak}']
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,51 @@
+import asyncio
+
+import asyncpg
+
+from startup.db_config import Config
+
+
+class PgListener:
+    # One LISTEN connection per worker, shared by every channel. Channels are
+    # registered at import time, before life_span starts run().
+    def __init__(self):
+        self.channels = {}
+        self.reconnect_callbacks = []
+        self.connection = None
+
+    def listen(self, channel: str, callback, on_reconnect=None):
+        self.channels[channel] = callback
+        if on_reconnect is not None:
+            self.reconnect_callbacks.append(on_reconnect)
+
+    async def run(self):
+        delay, connected_before = 1, False
+        while True:
+            try:
+                self.connection = await asyncpg.connect(user=Config.POSTGRES_USER, password=Config.POSTGRES_PASSWORD,
+                                                        host=Config.POSTGRES_HOST, port=Config.POSTGRES_PORT,
+                                                        database=Config.POSTGRES_DB)
+                closed = asyncio.Event()
+                self.connection.add_termination_listener(lambda connection: closed.set())
+                for channel, callback in self.channels.items():
+                    await self.connection.add_listener(
+                        channel, lambda connection, pid, channel, payload, callback=callback: callback(payload))
+                if connected_before:
+                    # notifications sent while we were away are lost
+                    for callback in self.reconnect_callbacks:
+                        callback()
+                connected_before, delay = True, 1
+                await closed.wait()
+            except Exception as e:
+                # includes InterfaceError from a connection closing under us; CancelledError
+                # is not an Exception and still stops the listener at shutdown
+                print(f"database listener failed, reconnecting in {delay}s: {e!r}")
+            finally:
+                if self.connection is not None:
+                    self.connection.terminate()
+                    self.connection = None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+
+pg_listener = PgListener()
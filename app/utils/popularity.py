@@ -0,0 +1,246 @@
+import asyncio
+import math
+import time
+
+from sqlalchemy import text, desc, func
+from sqlalchemy.future import select
+
+from startup.db_config import engine, async_session_factory, Config
+from repositories.models import Books, BookPopularity
+from utils.pg_listener import pg_listener
+
+CHANNEL = "popularity_rebuilt"
+
+# Popularity decays exponentially with POPULARITY_HALF_LIFE_HOURS. Instead of
+# decaying every counter as time passes, activity is kept as a "trend key":
+# ln(weight) + lambda * t. Keys of different events merge with logaddexp and
+# their order never changes, so the database can keep them in a plain index.
+# Each worker collects its own increments, adds them to book_popularity every
+# POPULARITY_SNAPSHOT_SECONDS and then reloads the leaderboards from it.
+#
+# A rebuild replays the whole history, including events other workers still hold
+# as pending increments. Each rebuild takes a new generation number and announces
+# it on CHANNEL; a worker drops its pending increments when it sees a newer
+# generation, and a flush only writes while the generation it started with is
+# still current, so a lost notification can't make it count an event twice.
+
+DECAY_PER_SECOND = math.log(2) / (Config.POPULARITY_HALF_LIFE_HOURS * 3600)
+
+_MERGE_KEYS = """CASE WHEN {a} IS NULL THEN {b} WHEN {b} IS NULL THEN {a}
+                      ELSE greatest({a}, {b}) + ln(1 + exp(-least(abs({a} - {b}), 700))) END"""
+
+FLUSH = text(f"""
+    INSERT INTO book_popularity AS p (book_id, trend_key, borrow_count, rating_sum, rating_count, updated_at)
+    SELECT uid, CAST(:trend_key AS double precision), CAST(:borrow_count AS integer),
+           CAST(:rating_sum AS double precision), CAST(:rating_count AS integer), now() at time zone 'utc'
+    FROM books WHERE uid = :book_id
+    ON CONFLICT (book_id) DO UPDATE SET
+        trend_key = {_MERGE_KEYS.format(a='p.trend_key', b='excluded.trend_key')},
+        borrow_count = p.borrow_count + excluded.borrow_count,
+        rating_sum = p.rating_sum + excluded.rating_sum,
+        rating_count = p.rating_count + excluded.rating_count,
+        updated_at = excluded.updated_at
+""")
+
+_LOCK = "SELECT pg_advisory_xact_lock{}(hashtext('book_popularity'))"
+_GENERATION = text("SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM popularity_generation_seq")
+_NEXT_GENERATION = text("SELECT nextval('popularity_generation_seq')")
+_NOTIFY = text("SELECT pg_notify(:channel, CAST(:generation AS text))")
+
+REBUILD = text("""
+    WITH events AS (
+        SELECT book_id, requested_at AS happened_at, CAST(:request_weight AS double precision) AS weight FROM requests
+        UNION ALL
+        SELECT book_id, requested_at, CAST(:request_weight AS double precision) FROM requests_archive
+        UNION ALL
+        SELECT r.book_id, t.created_at, CAST(:accept_weight AS double precision) FROM transactions t JOIN requests r ON r.uid = t.request_id
+        UNION ALL
+        SELECT r.book_id, t.created_at, CAST(:accept_weight AS double precision)
+        FROM transactions_archive t JOIN requests_archive r ON r.uid = t.request_id
+    ), trend AS (
+        SELECT book_id, sum(weight * exp(greatest(
+            CAST(:decay AS double precision) * (extract(epoch FROM happened_at)::double precision - CAST(:now AS double precision)),
+            -700))) AS value
+        FROM events GROUP BY book_id
+    ), borrowed AS (
+        SELECT book_id, count(*) AS n FROM (
+            SELECT r.book_id FROM transactions t JOIN requests r ON r.uid = t.request_id
+            UNION ALL
+            SELECT r.book_id FROM transactions_archive t JOIN requests_archive r ON r.uid = t.request_id
+        ) loans GROUP BY book_id
+    ), rated AS (
+        SELECT book_id, sum(rating) AS total, count(*) AS n FROM reviews GROUP BY book_id
+    )
+    INSERT INTO book_popularity (book_id, trend_key, borrow_count, rating_sum, rating_count, updated_at)
+    SELECT b.uid,
+           CASE WHEN trend.value > 0 THEN ln(trend.value) + CAST(:decay AS double precision) * CAST(:now AS double precision) END,
+           coalesce(borrowed.n, 0), coalesce(rated.total, 0), coalesce(rated.n, 0), now() at time zone 'utc'
+    FROM books b
+    LEFT JOIN trend ON trend.book_id = b.uid
+    LEFT JOIN borrowed ON borrowed.book_id = b.uid
+    LEFT JOIN rated ON rated.book_id = b.uid
+    WHERE trend.book_id IS NOT NULL OR rated.book_id IS NOT NULL
+    ON CONFLICT (book_id) DO NOTHING
+""")
+
+
+def trend_key(weight: float, at: float) -> float:
+    return math.log(weight) + DECAY_PER_SECOND * at
+
+
+def merge_keys(a, b):
+    if a is None or b is None:
+        return b if a is None else a
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def book_entry(book, **metrics):
+    return {
+        'uid': book.uid,
+        'title': book.title,
+        'author': book.author,
+        'category': book.category,
+        'availability': book.availability,
+        'available_copies': book.available_copies,
+        **metrics
+    }
+
+
+class Popularity:
+    def __init__(self):
+        # book_id -> [trend_key, borrow_count, rating_sum, rating_count] not yet written
+        self.pending = {}
+        self.leaderboards = {'trending': [], 'most_borrowed': [], 'top_rated': []}
+        self.loaded_at = None
+        self.generation = None
+        pg_listener.listen(CHANNEL, self._on_rebuilt)
+
+    def _on_rebuilt(self, payload: str):
+        generation = int(payload)
+        if self.generation is None or generation > self.generation:
+            # the rebuild already counted everything recorded here so far
+            self.pending.clear()
+            self.generation = generation
+
+    def _pending(self, book_id):
+        return self.pending.setdefault(book_id, [None, 0, 0.0, 0])
+
+    def record_borrow_request(self, book_id):
+        entry = self._pending(book_id)
+        entry[0] = merge_keys(entry[0], trend_key(Config.POPULARITY_REQUEST_WEIGHT, time.time()))
+
+    def record_accept(self, book_id):
+        entry = self._pending(book_id)
+        entry[0] = merge_keys(entry[0], trend_key(Config.POPULARITY_ACCEPT_WEIGHT, time.time()))
+        entry[1] += 1
+
+    def record_rating(self, book_id, rating_delta: float, count_delta: int):
+        entry = self._pending(book_id)
+        entry[2] += rating_delta
+        entry[3] += count_delta
+
+    async def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        try:
+            async with engine.begin() as conn:
+                # waits for a rebuild in progress, which holds the lock exclusively
+                await conn.execute(text(_LOCK.format("_shared")))
+                generation = (await conn.execute(_GENERATION)).scalar()
+                if self.generation is None:
+                    self.generation = generation
+                if generation != self.generation:
+                    # rebuilt since these were recorded, the history has them already
+                    self.generation = generation
+                    return
+                await conn.execute(FLUSH, [
+                    {'book_id': book_id, 'trend_key': key, 'borrow_count': count,
+                     'rating_sum': rating_sum, 'rating_count': rating_count}
+                    for book_id, (key, count, rating_sum, rating_count) in pending.items()])
+        except Exception:
+            # keep the increments for the next attempt
+            for book_id, (key, count, rating_sum, rating_count) in pending.items():
+                entry = self._pending(book_id)
+                entry[0] = merge_keys(entry[0], key)
+                entry[1] += count
+                entry[2] += rating_sum
+                entry[3] += rating_count
+            raise
+
+    async def rebuild(self, replace: bool = False):
+        # the lock keeps workers that start together from scanning the history in parallel
+        async with engine.begin() as conn:
+            await conn.execute(text(_LOCK.format("")))
+            if replace:
+                await conn.execute(text("TRUNCATE book_popularity"))
+            elif (await conn.execute(select(BookPopularity.book_id).limit(1))).first():
+                return False
+            generation = (await conn.execute(_NEXT_GENERATION)).scalar()
+            await conn.execute(REBUILD, {'request_weight': Config.POPULARITY_REQUEST_WEIGHT,
+                                         'accept_weight': Config.POPULARITY_ACCEPT_WEIGHT,
+                                         'decay': DECAY_PER_SECOND, 'now': time.time()})
+            await conn.execute(_NOTIFY, {'channel': CHANNEL, 'generation': generation})
+        self._on_rebuilt(str(generation))
+        return True
+
+    async def load(self):
+        size = Config.POPULARITY_LEADERBOARD_SIZE
+        now = time.time()
+        # a session, so that select(Books, ...) rows come back as (book, value) pairs
+        async with async_session_factory() as session:
+            trending = (await session.execute(
+                select(Books, BookPopularity.trend_key)
+                .join(BookPopularity, BookPopularity.book_id == Books.uid)
+                .where(BookPopularity.trend_key.isnot(None))
+                .order_by(desc(BookPopularity.trend_key)).limit(size))).all()
+            most_borrowed = (await session.execute(
+                select(Books, BookPopularity.borrow_count)
+                .join(BookPopularity, BookPopularity.book_id == Books.uid)
+                .where(BookPopularity.borrow_count > 0)
+                .order_by(desc(BookPopularity.borrow_count)).limit(size))).all()
+            # bayesian average: few ratings are pulled towards the mean of all ratings
+            mean = (await session.execute(select(func.sum(BookPopularity.rating_sum)
+                                              / func.nullif(func.sum(BookPopularity.rating_count), 0)))).scalar()
+            prior = Config.POPULARITY_RATING_PRIOR
+            score = ((prior * (mean or 0) + BookPopularity.rating_sum) / (prior + BookPopularity.rating_count))
+            top_rated = (await session.execute(
+                select(Books, BookPopularity.rating_sum, BookPopularity.rating_count, score)
+                .join(BookPopularity, BookPopularity.book_id == Books.uid)
+                .where(BookPopularity.rating_count > 0)
+                .order_by(desc(score)).limit(size))).all()
+
+        self.leaderboards = {
+            'trending': [book_entry(book, score=round(math.exp(key - DECAY_PER_SECOND * now), 4))
+                         for book, key in trending],
+            'most_borrowed': [book_entry(book, borrow_count=count) for book, count in most_borrowed],
+            'top_rated': [book_entry(book, average_rating=round(total / count, 2), rating_count=count,
+                                     score=round(value, 4))
+                          for book, total, count, value in top_rated]
+        }
+        self.loaded_at = now
+
+    async def run(self):
+        try:
+            while True:
+                try:
+                    if self.generation is None:
+                        async with engine.connect() as conn:
+                            self.generation = (await conn.execute(_GENERATION)).scalar()
+                    if self.loaded_at is None and await self.rebuild():
+                        print("book popularity rebuilt from history")
+                    await self.flush()
+                    await self.load()
+                except Exception as e:
+                    print(f"book popularity snapshot failed: {e}")
+                await asyncio.sleep(Config.POPULARITY_SNAPSHOT_SECONDS)
+        finally:
+            if self.pending:
+                try:
+                    await self.flush()
+                except Exception as e:
+                    print(f"book popularity could not be saved on shutdown: {e}")
+
+
+popularity = Popularity()
@@ -0,0 +1,122 @@
+import os
+import sys
+import asyncio
+import threading
+from collections import Counter
+
+from startup.db_config import listens_for_all
+from middleware.query_counter import current_query_stats, route_path
+
+# statements currently awaiting the database, per route
+db_in_flight = Counter()
+profiler_lock = asyncio.Lock()
+
+_IDLE_FRAMES = {("selectors.py", "select"), ("base_events.py", "run_forever"), ("runners.py", "run")}
+
+
+def _stats_route():
+    stats = current_query_stats()
+    if stats is None or stats.scope is None:
+        return "<no request>"
+    return route_path(stats.scope)
+
+
+@listens_for_all("before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._profiler_route = _stats_route()
+        db_in_flight[context._profiler_route] += 1
+
+
+def _statement_done(context):
+    route = getattr(context, "_profiler_route", None)
+    if route is None:
+        return
+    context._profiler_route = None
+    db_in_flight[route] -= 1
+    if db_in_flight[route] <= 0:
+        del db_in_flight[route]
+
+
+@listens_for_all("after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        _statement_done(context)
+
+
+@listens_for_all("handle_error")
+def _handle_error(exception_context):
+    if exception_context.execution_context is not None:
+        _statement_done(exception_context.execution_context)
+
+
+def _label(code):
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)})"
+
+
+class SamplingProfiler:
+    def __init__(self, thread_id: int, interval: float, route_codes: dict):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.route_codes = route_codes
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self._sample(frame)
+
+    def _sample(self, frame):
+        self.samples += 1
+        leaf = frame.f_code
+        if (os.path.basename(leaf.co_filename), leaf.co_name) in _IDLE_FRAMES:
+            waiting = db_in_flight.copy()
+            if waiting:
+                for route in waiting:
+                    self.stacks[f"route:{route};<awaiting database>"] += 1
+            else:
+                self.stacks["<idle>"] += 1
+            return
+
+        stack, route = [], None
+        while frame is not None:
+            code = frame.f_code
+            if route is None and code in self.route_codes:
+                route = self.route_codes[code]
+            stack.append(_label(code))
+            frame = frame.f_back
+        stack.reverse()
+        if route is not None:
+            stack.insert(0, f"route:{route}")
+        self.stacks[";".join(stack)] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+async def profile_worker(app, seconds: float, interval: float) -> SamplingProfiler:
+    route_codes = {}
+    for route in app.routes:
+        endpoint = getattr(route, "endpoint", None)
+        if endpoint is not None and hasattr(endpoint, "__code__"):
+            route_codes[endpoint.__code__] = route.path
+
+    # the event loop runs on this thread, so that is the one worth sampling
+    profiler = SamplingProfiler(threading.get_ident(), interval, route_codes)
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.stop()
+    return profiler
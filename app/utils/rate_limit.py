@@ -0,0 +1,113 @@
+import math
+import time
+import logging
+from collections import OrderedDict
+
+from fastapi import Request
+from sqlalchemy import text
+
+from startup.db_config import engine, Config
+from utils.auth import client_identity
+
+logger = logging.getLogger(__name__)
+
+# "<requests>/<seconds>", overridable per name through Config.RATE_LIMITS
+DEFAULT_RATE_LIMITS = {
+    'login': "10/60",
+    'register': "5/60",
+    'borrow-request': "20/60",
+    'review': "20/60"
+}
+
+
+class RateLimitExceeded(Exception):
+    # turned into a 429 by the handler in main.py
+    def __init__(self, retry_after: int):
+        super().__init__("Too many requests, please try again later.")
+        self.retry_after = retry_after
+
+
+def parse_limit(limit: str):
+    count, _, seconds = limit.partition("/")
+    capacity = float(count)
+    return capacity, capacity / float(seconds or 1)
+
+
+class MemoryBackend:
+    # token buckets local to this worker, least recently hit first
+    MAX_KEYS = 100_000
+    PRUNE_INTERVAL = 60
+
+    def __init__(self):
+        self.buckets = OrderedDict()
+        self.pruned_at = time.monotonic()
+
+    def _prune(self, now):
+        # buckets that have refilled are the same as no bucket at all
+        self.pruned_at = now
+        for key, (tokens, updated, capacity, rate) in list(self.buckets.items()):
+            if tokens + (now - updated) * rate >= capacity:
+                del self.buckets[key]
+
+    async def hit(self, key, capacity, rate):
+        now = time.monotonic()
+        if now - self.pruned_at >= self.PRUNE_INTERVAL:
+            self._prune(now)
+        tokens, updated, _, _ = self.buckets.get(key, (capacity, now, capacity, rate))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.buckets[key] = (tokens, now, capacity, rate)
+        self.buckets.move_to_end(key)
+        while len(self.buckets) > self.MAX_KEYS:
+            self.buckets.popitem(last=False)
+        return allowed, tokens
+
+
+class PostgresBackend:
+    # token buckets shared by every worker through one upsert per hit
+    HIT = text("""
+        INSERT INTO rate_limit_buckets AS b (key, tokens, allowed, updated_at)
+        VALUES (:key, :capacity - 1, true, clock_timestamp())
+        ON CONFLICT (key) DO UPDATE SET
+            allowed = LEAST(:capacity, b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * :rate) >= 1,
+            tokens = LEAST(:capacity, b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * :rate)
+                     - CASE WHEN LEAST(:capacity, b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * :rate) >= 1
+                            THEN 1 ELSE 0 END,
+            updated_at = clock_timestamp()
+        RETURNING allowed, tokens""")
+
+    async def hit(self, key, capacity, rate):
+        async with engine.begin() as conn:
+            result = await conn.execute(self.HIT, {"key": key, "capacity": capacity, "rate": rate})
+            row = result.first()
+        return row.allowed, row.tokens
+
+
+# a bucket untouched for a day is full again for every configured limit, dropping it changes nothing
+PURGE_IDLE_BUCKETS = text("DELETE FROM rate_limit_buckets WHERE updated_at < clock_timestamp() - interval '1 day'")
+
+
+async def purge_idle_buckets() -> int:
+    async with engine.begin() as conn:
+        return (await conn.execute(PURGE_IDLE_BUCKETS)).rowcount
+
+
+backend = PostgresBackend() if Config.RATE_LIMIT_BACKEND == "postgres" else MemoryBackend()
+
+
+def rate_limit(name: str):
+    async def dependency(request: Request):
+        if not Config.RATE_LIMIT_ENABLED:
+            return
+        capacity, rate = parse_limit(Config.RATE_LIMITS.get(name, DEFAULT_RATE_LIMITS[name]))
+        try:
+            allowed, tokens = await backend.hit(f"{name}:{client_identity(request)}", capacity, rate)
+        except Exception as e:
+            # never lock everybody out because the shared backend is unavailable
+            logger.warning("rate limiter backend failed, allowing request: %s", e)
+            return
+        if not allowed:
+            raise RateLimitExceeded(max(1, math.ceil((1 - tokens) / rate)))
+    return dependency
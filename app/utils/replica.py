@@ -0,0 +1,49 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import text
+
+from startup.db_config import replica_engine, Config
+
+# seconds the replica is behind; 0 when it has replayed everything it received,
+# and always 0 when the "replica" is really the primary (local setups)
+_LAG = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
+
+class ReplicaMonitor:
+    def __init__(self):
+        self.lag = None
+        self.error = None
+        self.checked_at = None
+
+    @property
+    def usable(self) -> bool:
+        # an unreachable or unchecked replica counts as lagging, reads then go to the primary
+        return replica_engine is not None and self.lag is not None and self.lag <= Config.REPLICA_MAX_LAG_SECONDS
+
+    async def check(self):
+        async def lag():
+            async with replica_engine.connect() as conn:
+                return (await conn.execute(_LAG)).scalar()
+        try:
+            self.lag = float(await asyncio.wait_for(lag(), timeout=Config.DB_PING_TIMEOUT) or 0)
+            self.error = None
+        except Exception as e:
+            self.lag = None
+            self.error = str(e) or e.__class__.__name__
+        self.checked_at = datetime.utcnow()
+
+    async def run(self):
+        if replica_engine is None:
+            return
+        while True:
+            await self.check()
+            await asyncio.sleep(Config.REPLICA_LAG_CHECK_SECONDS)
+
+
+replica_monitor = ReplicaMonitor()
@@ -0,0 +1,103 @@
+import asyncio
+import json
+from collections import deque
+
+from sqlalchemy import text
+
+from startup.db_config import Config
+from utils.pg_listener import pg_listener
+
+CHANNEL = "request_events"
+
+# ids come from a sequence so every worker sees the same id for an event
+_NOTIFY = text(
+    "SELECT pg_notify(:channel, json_build_object("
+    "'id', nextval('request_event_seq'), 'event', CAST(:event AS text), 'data', CAST(:data AS json))::text)"
+)
+
+
+async def publish_request_event(session, event: str, data: dict):
+    # postgres only delivers the notification once the surrounding transaction commits
+    await session.execute(_NOTIFY, {"channel": CHANNEL, "event": event, "data": json.dumps(data, default=str)})
+
+
+def format_event(event) -> str:
+    lines = [f"id: {event['id']}"] if 'id' in event else []
+    lines.append(f"event: {event['event']}")
+    lines.append(f"data: {json.dumps(event['data'])}")
+    return "\n".join(lines) + "\n\n"
+
+
+RESET = {'event': 'reset', 'data': {}}
+
+
+class Subscriber:
+    def __init__(self):
+        self.events = deque()
+        self.ready = asyncio.Event()
+        self.overflowed = False
+
+    def push(self, event):
+        if len(self.events) >= Config.SSE_CLIENT_BUFFER:
+            self.overflowed = True
+        else:
+            self.events.append(event)
+        self.ready.set()
+
+
+class RequestEventBroker:
+    def __init__(self):
+        self.subscribers = set()
+        self.recent = deque(maxlen=Config.SSE_REPLAY_SIZE)
+
+    def _dispatch(self, event):
+        for subscriber in self.subscribers:
+            subscriber.push(event)
+
+    def _on_notify(self, payload):
+        event = json.loads(payload)
+        self.recent.append(event)
+        self._dispatch(event)
+
+    def _on_reconnect(self):
+        # whatever was published while the listener was away is lost, clients have to reload
+        self.recent.clear()
+        self._dispatch(RESET)
+
+    def subscribe(self, last_event_id=None) -> Subscriber:
+        subscriber = Subscriber()
+        if last_event_id is not None:
+            # replay by arrival order rather than by id: ids are taken before commit,
+            # so they can reach the listener slightly out of order
+            ids = [str(event['id']) for event in self.recent]
+            if last_event_id in ids:
+                for event in list(self.recent)[ids.index(last_event_id) + 1:]:
+                    subscriber.push(event)
+            else:
+                subscriber.push(RESET)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    async def stream(self, last_event_id=None):
+        subscriber = self.subscribe(last_event_id)
+        try:
+            while True:
+                if not subscriber.events and not subscriber.overflowed:
+                    subscriber.ready.clear()
+                    try:
+                        await asyncio.wait_for(subscriber.ready.wait(), Config.SSE_HEARTBEAT_SECONDS)
+                    except asyncio.TimeoutError:
+                        yield ": heartbeat\n\n"
+                        continue
+                while subscriber.events:
+                    yield format_event(subscriber.events.popleft())
+                if subscriber.overflowed:
+                    # a client this far behind is dropped; it reconnects with Last-Event-ID
+                    # and catches up from the replay buffer
+                    return
+        finally:
+            self.subscribers.discard(subscriber)
+
+
+request_events = RequestEventBroker()
+pg_listener.listen(CHANNEL, request_events._on_notify, request_events._on_reconnect)
@@ -0,0 +1,62 @@
+import time
+from collections import OrderedDict
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from startup.db_config import Config
+from utils.compression import negotiate, compress
+
+
+class CachedPayload:
+    def __init__(self, content):
+        self.body = JSONResponse(jsonable_encoder(content)).body
+        self.encoded = {}
+
+    def response(self, request: Request) -> Response:
+        headers = {"Vary": "Accept-Encoding"}
+        encoding = negotiate(request.headers.get("accept-encoding", "")) \
+            if len(self.body) >= Config.COMPRESSION_MIN_SIZE else None
+        if encoding is None:
+            return Response(self.body, media_type="application/json", headers=headers)
+        # compressed once per encoding for as long as the entry lives
+        if encoding not in self.encoded:
+            self.encoded[encoding] = compress(encoding, self.body)
+        headers["Content-Encoding"] = encoding
+        return Response(self.encoded[encoding], media_type="application/json", headers=headers)
+
+
+class ResponseCache:
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return value
+
+    def put(self, key, content) -> CachedPayload:
+        return self.set(key, CachedPayload(content))
+
+    def clear(self):
+        self.entries.clear()
+
+
+# book listings; cleared by every route that changes a book or its availability
+catalog_cache = ResponseCache(Config.CATALOG_CACHE_TTL, Config.CATALOG_CACHE_MAX_ENTRIES)
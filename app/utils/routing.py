@@ -0,0 +1,20 @@
+from starlette.routing import Match
+
+
+def read_only(endpoint):
+    # marks a route that never writes, so it may be batched (and served from a replica)
+    endpoint.read_only = True
+    return endpoint
+
+
+def find_route(app, scope):
+    for route in app.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route
+    return None
+
+
+def route_flag(app, scope, flag: str) -> bool:
+    route = find_route(app, scope)
+    return bool(getattr(getattr(route, "endpoint", None), flag, False))
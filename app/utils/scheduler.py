@@ -0,0 +1,299 @@
+import asyncio
+import math
+import os
+import random
+import socket
+import time as clock
+from contextlib import suppress
+from datetime import datetime, timedelta, time
+
+from sqlalchemy import text
+from sqlalchemy.future import select
+
+from startup.db_config import engine, Config
+from repositories.models import ScheduledRuns
+
+# Periodic work that touches shared rows runs once per tick for the whole cluster.
+# Every worker keeps a loop per task, and at each tick tries a session-level
+# advisory lock on the task's name. The worker that gets it checks
+# scheduled_runs.last_scheduled_at, so a tick another worker already ran is never
+# repeated, then runs the task and records the outcome. Ticks are computed from
+# UTC wall-clock time, not from when the worker started, so every worker agrees on
+# them. A worker that dies mid-run drops its connection, which frees the lock.
+# Missed ticks (everyone was down) are run once on start up when catch_up is set.
+
+_EPOCH = datetime(1970, 1, 1)
+_RETRY_SECONDS = 30
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+_ALIASES = {'@hourly': '0 * * * *', '@daily': '0 0 * * *', '@weekly': '0 0 * * 0', '@monthly': '0 0 1 * *'}
+
+_TRY_LOCK = text("SELECT pg_try_advisory_lock(hashtext(:key))")
+_UNLOCK = text("SELECT pg_advisory_unlock(hashtext(:key))")
+_RECORD = text("""
+    INSERT INTO scheduled_runs AS s (name, last_scheduled_at, last_started_at, last_finished_at, last_status,
+                                     last_error, last_duration_ms, last_lag_ms, worker, run_count, failure_count,
+                                     missed_count, total_duration_ms)
+    VALUES (:name, :scheduled_at, :started_at, :finished_at, :status, :error, :duration_ms, :lag_ms, :worker, 1,
+            :failed, :missed, :duration_ms)
+    ON CONFLICT (name) DO UPDATE SET
+        last_scheduled_at = excluded.last_scheduled_at,
+        last_started_at = excluded.last_started_at,
+        last_finished_at = excluded.last_finished_at,
+        last_status = excluded.last_status,
+        last_error = excluded.last_error,
+        last_duration_ms = excluded.last_duration_ms,
+        last_lag_ms = excluded.last_lag_ms,
+        worker = excluded.worker,
+        run_count = s.run_count + 1,
+        failure_count = s.failure_count + excluded.failure_count,
+        missed_count = s.missed_count + excluded.missed_count,
+        total_duration_ms = s.total_duration_ms + excluded.total_duration_ms
+""")
+
+
+class Every:
+    def __init__(self, seconds: float):
+        if seconds <= 0:
+            raise ValueError("the interval must be positive")
+        self.seconds = seconds
+
+    def next_after(self, moment: datetime) -> datetime:
+        ticks = math.floor((moment - _EPOCH).total_seconds() / self.seconds) + 1
+        return _EPOCH + timedelta(seconds=ticks * self.seconds)
+
+    def last_until(self, moment: datetime) -> datetime:
+        ticks = math.floor((moment - _EPOCH).total_seconds() / self.seconds)
+        return _EPOCH + timedelta(seconds=ticks * self.seconds)
+
+    def count_between(self, start: datetime, end: datetime) -> int:
+        # ticks in (start, end)
+        return max(0, math.ceil((end - start).total_seconds() / self.seconds) - 1)
+
+
+def _cron_field(field: str, low: int, high: int) -> list:
+    values = set()
+    for part in field.split(','):
+        part, _, step = part.partition('/')
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = map(int, part.split('-'))
+        else:
+            start = end = int(part)
+            if step:
+                end = high
+        values.update(range(start, end + 1, int(step) if step else 1))
+    if not values or min(values) < low or max(values) > high:
+        raise ValueError(f"{field} is out of range {low}-{high}")
+    return sorted(values)
+
+
+class Cron:
+    # minute hour day-of-month month day-of-week, in UTC; like cron, a day matches
+    # either day field when both are restricted
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError("a cron expression has five fields")
+        minutes = _cron_field(fields[0], 0, 59)
+        hours = _cron_field(fields[1], 0, 23)
+        self.days = set(_cron_field(fields[2], 1, 31))
+        self.months = set(_cron_field(fields[3], 1, 12))
+        self.weekdays = {day % 7 for day in _cron_field(fields[4], 0, 7)}
+        self.any_day, self.any_weekday = fields[2] == '*', fields[4] == '*'
+        self.times = [time(hour, minute) for hour in hours for minute in minutes]
+
+    def _matches(self, day) -> bool:
+        if day.month not in self.months:
+            return False
+        day_match = day.day in self.days
+        weekday_match = (day.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day_match and weekday_match
+        return day_match or weekday_match
+
+    def _search(self, moment: datetime, step: int):
+        day = moment.date()
+        times = self.times if step > 0 else self.times[::-1]
+        # eight years covers a schedule on the 29th of February
+        for _ in range(366 * 8):
+            if self._matches(day):
+                for at in times:
+                    candidate = datetime.combine(day, at)
+                    if (candidate > moment) if step > 0 else (candidate <= moment):
+                        return candidate
+            day += timedelta(days=step)
+        raise ValueError("the cron expression never matches")
+
+    def next_after(self, moment: datetime) -> datetime:
+        return self._search(moment, 1)
+
+    def last_until(self, moment: datetime) -> datetime:
+        return self._search(moment, -1)
+
+    def count_between(self, start: datetime, end: datetime) -> int:
+        count, tick = 0, self.next_after(start)
+        while tick < end and count < 100_000:
+            count, tick = count + 1, self.next_after(tick)
+        return count
+
+
+def parse_timing(spec: str):
+    spec = _ALIASES.get(spec.strip(), spec.strip())
+    if spec.startswith('@every'):
+        value = spec[len('@every'):].strip()
+        if value[-1:] in _UNITS:
+            return Every(float(value[:-1]) * _UNITS[value[-1]])
+        return Every(float(value))
+    return Cron(spec)
+
+
+class ScheduledTask:
+    def __init__(self, name, fn, spec, catch_up, jitter):
+        self.name = name
+        self.fn = fn
+        self.spec = spec
+        self.timing = parse_timing(spec)
+        self.catch_up = catch_up
+        self.jitter = jitter
+        self.next_due = None
+
+
+class Scheduler:
+    def __init__(self):
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.registered = {}
+        self.tasks = {}
+
+    def schedule(self, name: str, spec: str, catch_up: bool = True, jitter: float = None):
+        # registers an async fn() -> dict | None; SCHEDULES can override the timing
+        def register(fn):
+            self.registered[name] = (fn, spec, catch_up, jitter)
+            return fn
+        return register
+
+    async def _last_scheduled(self, conn, name):
+        return (await conn.execute(
+            select(ScheduledRuns.last_scheduled_at).where(ScheduledRuns.name == name))).scalar()
+
+    def _due(self, task, last, now):
+        if last is None:
+            return task.timing.last_until(now) if task.catch_up else task.timing.next_after(now)
+        following = task.timing.next_after(last)
+        if following > now:
+            return following
+        # ticks were missed: run the latest of them now, or wait for the next one
+        return task.timing.last_until(now) if task.catch_up else task.timing.next_after(now)
+
+    async def _run_tick(self, task, tick):
+        key = f"schedule:{task.name}"
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            if not (await conn.execute(_TRY_LOCK, {'key': key})).scalar():
+                return
+            try:
+                last = await self._last_scheduled(conn, task.name)
+                started_at = datetime.utcnow()
+                if last is not None and last >= tick:
+                    return
+                late = (started_at - tick).total_seconds()
+                if not task.catch_up and late > task.jitter + Config.SCHEDULER_GRACE_SECONDS:
+                    return
+                missed = task.timing.count_between(last, tick) if last is not None else 0
+
+                status, error, started = 'succeeded', None, clock.perf_counter()
+                try:
+                    result = await task.fn()
+                    if result:
+                        print(f"scheduled {task.name}: {result}")
+                except Exception as e:
+                    status, error = 'failed', str(e) or e.__class__.__name__
+                    print(f"scheduled {task.name} failed: {error}")
+                duration_ms = (clock.perf_counter() - started) * 1000
+                await conn.execute(_RECORD, {
+                    'name': task.name, 'scheduled_at': tick, 'started_at': started_at,
+                    'finished_at': datetime.utcnow(), 'status': status, 'error': error,
+                    'duration_ms': duration_ms, 'lag_ms': late * 1000,
+                    'worker': self.worker, 'failed': int(status == 'failed'), 'missed': missed})
+            finally:
+                with suppress(Exception):
+                    await conn.execute(_UNLOCK, {'key': key})
+
+    async def _loop(self, task):
+        attempted = None
+        while True:
+            try:
+                async with engine.connect() as conn:
+                    last = await self._last_scheduled(conn, task.name)
+                if attempted is not None and (last is None or attempted > last):
+                    last = attempted
+                now = datetime.utcnow()
+                tick = task.next_due = self._due(task, last, now)
+                # jitter spreads the workers' lock attempts, only one of them runs the tick
+                await asyncio.sleep(max((tick - now).total_seconds(), 0) + random.uniform(0, task.jitter))
+                await self._run_tick(task, tick)
+                attempted = tick
+            except Exception as e:
+                print(f"scheduler failed for {task.name}, retrying in {_RETRY_SECONDS}s: {e}")
+                await asyncio.sleep(_RETRY_SECONDS)
+
+    async def run(self):
+        if not Config.SCHEDULER_ENABLED:
+            print("scheduler is disabled, periodic tasks run on other workers")
+            return
+        for name, (fn, spec, catch_up, jitter) in self.registered.items():
+            spec = Config.SCHEDULES.get(name, spec)
+            if spec.strip() == 'off':
+                continue
+            try:
+                self.tasks[name] = ScheduledTask(
+                    name, fn, spec, catch_up, Config.SCHEDULER_JITTER_SECONDS if jitter is None else jitter)
+            except ValueError as e:
+                print(f"invalid schedule for {name} ({spec}), not scheduled: {e}")
+        loops = [asyncio.create_task(self._loop(task)) for task in self.tasks.values()]
+        try:
+            await asyncio.gather(*loops)
+        finally:
+            for loop in loops:
+                loop.cancel()
+            await asyncio.gather(*loops, return_exceptions=True)
+
+
+def schedule_entry(task: ScheduledTask, run) -> dict:
+    entry = {'name': task.name, 'schedule': task.spec, 'catch_up': task.catch_up, 'next_due': task.next_due}
+    if run is not None:
+        entry.update({
+            'last_scheduled_at': run.last_scheduled_at,
+            'last_status': run.last_status,
+            'last_error': run.last_error,
+            'last_duration_ms': round(run.last_duration_ms, 1),
+            'last_lag_ms': round(run.last_lag_ms, 1),
+            'average_duration_ms': round(run.total_duration_ms / run.run_count, 1) if run.run_count else None,
+            'worker': run.worker,
+            'run_count': run.run_count,
+            'failure_count': run.failure_count,
+            'missed_count': run.missed_count
+        })
+    return entry
+
+
+def prometheus_metrics(runs) -> str:
+    lines = ["# TYPE scheduled_task_runs_total counter",
+             "# TYPE scheduled_task_failures_total counter",
+             "# TYPE scheduled_task_missed_total counter",
+             "# TYPE scheduled_task_last_duration_seconds gauge",
+             "# TYPE scheduled_task_last_lag_seconds gauge",
+             "# TYPE scheduled_task_last_run_timestamp_seconds gauge"]
+    for run in runs:
+        labels = f'{{task="{run.name}"}}'
+        lines += [f"scheduled_task_runs_total{labels} {run.run_count}",
+                  f"scheduled_task_failures_total{labels} {run.failure_count}",
+                  f"scheduled_task_missed_total{labels} {run.missed_count}",
+                  f"scheduled_task_last_duration_seconds{labels} {run.last_duration_ms / 1000}",
+                  f"scheduled_task_last_lag_seconds{labels} {run.last_lag_ms / 1000}",
+                  f"scheduled_task_last_run_timestamp_seconds{labels} "
+                  f"{(run.last_started_at - _EPOCH).total_seconds()}"]
+    return "\n".join(lines) + "\n"
+
+
+scheduler = Scheduler()
@@ -0,0 +1,42 @@
+from startup.db_config import Config
+from repositories.archive import archive_history
+from middleware.idempotency import purge_expired_keys
+from utils.scheduler import scheduler
+from utils.similar_books import refresh_similar_books, np
+from utils.rate_limit import purge_idle_buckets
+from utils.job_kinds import flag_overdue_loans
+
+# Tasks that work on shared rows and so must run once per tick for the whole
+# cluster. Per-worker state (popularity increments, the suggestion and text
+# indexes, replica lag) is still refreshed by each worker's own loop.
+
+
+@scheduler.schedule('overdue_sweep', "*/15 * * * *")
+async def overdue_sweep():
+    flagged = await flag_overdue_loans()
+    return {'flagged': flagged} if flagged else None
+
+
+@scheduler.schedule('archive_history', f"@every {Config.ARCHIVE_INTERVAL_SECONDS}")
+async def archive():
+    counts = await archive_history()
+    return counts if any(counts.values()) else None
+
+
+if np is not None:
+    @scheduler.schedule('similar_books_refresh', f"@every {Config.SIMILAR_BOOKS_REFRESH_SECONDS}")
+    async def refresh_similar():
+        refreshed = await refresh_similar_books()
+        return {'books': refreshed} if refreshed else None
+else:
+    print("numpy/scipy not installed, similar books will not be computed")
+
+
+@scheduler.schedule('purge_idempotency_keys', "@every 1h")
+async def purge_idempotency_keys():
+    await purge_expired_keys()
+
+
+@scheduler.schedule('purge_rate_limit_buckets', "@every 1h")
+async def purge_rate_limit_buckets():
+    await purge_idle_buckets()
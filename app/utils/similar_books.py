@@ -0,0 +1,121 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import delete, insert, func, union
+from sqlalchemy.future import select
+
+from startup.db_config import engine, Config
+from repositories.models import Requests, Transactions, RequestsArchive, TransactionsArchive, BookSimilarities
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+_BLOCK_SIZE = 1024
+_WRITE_CHUNK = 10_000
+
+# every (user, book) pair that ended in a transaction, i.e. the book was actually borrowed
+_BORROWED_PAIRS = union(select(Requests.user_id, Requests.book_id)
+                        .join(Transactions, Transactions.request_id == Requests.uid),
+                        select(RequestsArchive.user_id, RequestsArchive.book_id)
+                        .join(TransactionsArchive, TransactionsArchive.request_id == RequestsArchive.uid))
+
+refresh_lock = asyncio.Lock()
+
+
+def top_k_similar(user_idx, book_idx, n_users, n_books, targets, k):
+    # binary user x book matrix with L2-normalised book columns, so that the
+    # product of two columns is their cosine similarity
+    matrix = sparse.csr_matrix((np.ones(len(user_idx), dtype=np.float32), (user_idx, book_idx)),
+                               shape=(n_users, n_books))
+    norms = np.sqrt(np.asarray(matrix.sum(axis=0)).ravel())
+    norms[norms == 0] = 1
+    normalized = (matrix @ sparse.diags(1 / norms)).tocsc()
+    books_by_user = normalized.T.tocsr()
+
+    results = {}
+    for start in range(0, len(targets), _BLOCK_SIZE):
+        block = targets[start:start + _BLOCK_SIZE]
+        scores = (books_by_user[block] @ normalized).tocsr()
+        for row, book in enumerate(block):
+            begin, end = scores.indptr[row], scores.indptr[row + 1]
+            columns, values = scores.indices[begin:end], scores.data[begin:end]
+            keep = columns != book
+            columns, values = columns[keep], values[keep]
+            if len(values) > k:
+                top = np.argpartition(-values, k)[:k]
+                columns, values = columns[top], values[top]
+            order = np.argsort(-values, kind="stable")
+            results[book] = (columns[order], values[order])
+    return results
+
+
+async def _last_refresh():
+    async with engine.connect() as conn:
+        return (await conn.execute(select(func.max(BookSimilarities.updated_at)))).scalar()
+
+
+def _compute(pairs, changed_users, started_at, k):
+    # runs in a thread: indexing every borrowed pair takes seconds on a large history
+    user_index, book_index, book_uids = {}, {}, []
+    user_idx, book_idx = [], []
+    for user_id, book_id in pairs:
+        user_idx.append(user_index.setdefault(user_id, len(user_index)))
+        if book_id not in book_index:
+            book_index[book_id] = len(book_uids)
+            book_uids.append(book_id)
+        book_idx.append(book_index[book_id])
+
+    # a new borrowing changes the neighbours of every book that user has borrowed
+    if changed_users is None:
+        targets = list(range(len(book_uids)))
+    else:
+        targets = sorted({book_index[book_id] for user_id, book_id in pairs if user_id in changed_users})
+    if not targets:
+        return [], []
+
+    results = top_k_similar(np.array(user_idx, dtype=np.int32), np.array(book_idx, dtype=np.int32),
+                            len(user_index), len(book_uids), np.array(targets, dtype=np.int32), k)
+    rows = [{'book_id': book_uids[book], 'rank': rank, 'similar_book_id': book_uids[int(column)],
+             'score': float(score), 'updated_at': started_at}
+            for book, (columns, scores) in results.items()
+            for rank, (column, score) in enumerate(zip(columns, scores), start=1)]
+    return [book_uids[book] for book in targets], rows
+
+
+async def refresh_similar_books(full: bool = False) -> int:
+    if np is None:
+        raise Exception("numpy and scipy are required to compute similar books.")
+
+    async with refresh_lock:
+        started_at = datetime.utcnow()
+        # whichever worker refreshed last, the table says how far it got
+        since = None if full else await _last_refresh()
+
+        async with engine.connect() as conn:
+            pairs = (await conn.execute(_BORROWED_PAIRS)).all()
+            changed_users = None
+            if since is not None:
+                result = await conn.execute(
+                    select(Requests.user_id).distinct()
+                    .join(Transactions, Transactions.request_id == Requests.uid)
+                    .where(Transactions.created_at >= since))
+                changed_users = set(result.scalars().all())
+
+        target_uids, rows = await asyncio.to_thread(_compute, pairs, changed_users, started_at,
+                                                    Config.SIMILAR_BOOKS_TOP_K)
+        if not target_uids:
+            return 0
+
+        async with engine.begin() as conn:
+            if changed_users is None:
+                await conn.execute(delete(BookSimilarities))
+            else:
+                for start in range(0, len(target_uids), _WRITE_CHUNK):
+                    await conn.execute(delete(BookSimilarities)
+                                       .where(BookSimilarities.book_id.in_(target_uids[start:start + _WRITE_CHUNK])))
+            for start in range(0, len(rows), _WRITE_CHUNK):
+                await conn.execute(insert(BookSimilarities), rows[start:start + _WRITE_CHUNK])
+        return len(target_uids)
@@ -0,0 +1,90 @@
+import asyncio
+import time
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+import random
+import re
+
+from startup.db_config import engine, Config, listens_for_all
+
+slow_queries = deque(maxlen=Config.SLOW_QUERY_BUFFER_SIZE)
+
+_explaining: ContextVar[bool] = ContextVar("explaining", default=False)
+_pending_explains = 0
+_MAX_PENDING_EXPLAINS = 2
+# the loop only keeps weak references to tasks, an unreferenced EXPLAIN could be collected mid-run
+_explain_tasks = set()
+# statements that write or lock even though they start with SELECT or WITH: row locks, data
+# modifying CTEs, and calls whose effect survives the rollback (sequences, session advisory locks)
+_SIDE_EFFECTS = re.compile(
+    r"\bfor\s+(no\s+key\s+)?(update|share|key\s+share)\b|\b(insert|update|delete|merge)\b"
+    r"|\b(nextval|setval|pg_advisory_lock|pg_try_advisory_lock|pg_notify)\s*\(")
+
+
+def _plain_params(parameters):
+    if isinstance(parameters, dict):
+        parameters = list(parameters.values())
+    if not isinstance(parameters, (list, tuple)):
+        return str(parameters)
+    return [p if isinstance(p, (str, int, float, bool, type(None))) else str(p) for p in parameters]
+
+
+async def _explain(entry: dict, statement: str, parameters):
+    global _pending_explains
+    token = _explaining.set(True)
+    try:
+        # ANALYZE actually runs the statement, so only do it for plain reads; the
+        # transaction is never committed either way.
+        lowered = statement.lstrip().lower()
+        is_read = lowered.startswith(("select", "with")) and not _SIDE_EFFECTS.search(lowered)
+        options = "ANALYZE, BUFFERS, FORMAT TEXT" if is_read else "FORMAT TEXT"
+        async with engine.connect() as conn:
+            await conn.exec_driver_sql(
+                f"SET LOCAL statement_timeout = {int(Config.SLOW_QUERY_EXPLAIN_TIMEOUT_MS)}")
+            result = await conn.exec_driver_sql(f"EXPLAIN ({options}) {statement}", parameters)
+            entry['plan'] = "\n".join(row[0] for row in result.all())
+            await conn.rollback()
+    except Exception as e:
+        entry['plan_error'] = str(e)
+    finally:
+        _explaining.reset(token)
+        _pending_explains -= 1
+
+
+@listens_for_all("before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._slow_query_start = time.perf_counter()
+
+
+@listens_for_all("after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    global _pending_explains
+    if context is None or _explaining.get():
+        return
+    duration_ms = (time.perf_counter() - context._slow_query_start) * 1000
+    if duration_ms < Config.SLOW_QUERY_MS:
+        return
+
+    entry = {
+        'recorded_at': datetime.utcnow(),
+        'duration_ms': round(duration_ms, 2),
+        'statement': statement,
+        'parameters': _plain_params(parameters[0] if executemany else parameters),
+        'plan': None
+    }
+    slow_queries.append(entry)
+
+    if executemany or random.random() >= Config.SLOW_QUERY_EXPLAIN_SAMPLE_RATE:
+        return
+    if _pending_explains >= _MAX_PENDING_EXPLAINS:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    _pending_explains += 1
+    task = loop.create_task(_explain(entry, statement, parameters))
+    _explain_tasks.add(task)
+    task.add_done_callback(_explain_tasks.discard)
@@ -0,0 +1,200 @@
+import asyncio
+import json
+import re
+from bisect import bisect_left
+
+from sqlalchemy import text
+from sqlalchemy.future import select
+
+from startup.db_config import engine, Config
+from repositories.models import Books
+from utils.pg_listener import pg_listener
+
+# Prefix index over titles and authors: one sorted list of keys with a parallel
+# list of refs (doc id * 2 + kind). Titles and authors are indexed from their
+# start and from each later word of 3+ letters, keys are cut to
+# SUGGEST_KEY_LENGTH characters and the later-word keys are dropped once
+# SUGGEST_MAX_ENTRIES is reached. Book writes are sent to every worker through
+# NOTIFY so the per-worker copies stay in step.
+
+CHANNEL = "book_changes"
+TITLE, AUTHOR = 0, 1
+_NON_WORD = re.compile(r"[\W_]+")
+
+_NOTIFY = text("SELECT pg_notify(:channel, :payload)")
+
+
+def normalize(value: str) -> str:
+    return _NON_WORD.sub(" ", (value or "").lower()).strip()
+
+
+def index_keys(title: str, author: str):
+    # (key, kind, starts the field)
+    length = Config.SUGGEST_KEY_LENGTH
+    keys = []
+    for value, kind in ((title, TITLE), (author, AUTHOR)):
+        words = normalize(value).split()
+        for i, word in enumerate(words):
+            if i == 0 or len(word) >= 3:
+                keys.append((" ".join(words[i:])[:length], kind, i == 0))
+    return keys
+
+
+async def publish_book_changes(session, op: str, books):
+    # one notification per book, delivered when the transaction commits
+    params = []
+    for book in books:
+        payload = {'op': op, 'uid': str(book.uid)}
+        if op == 'upsert':
+            payload.update(title=book.title, author=book.author)
+        params.append({'channel': CHANNEL, 'payload': json.dumps(payload)})
+    await session.execute(_NOTIFY, params)
+
+
+class SuggestIndex:
+    def __init__(self):
+        self.keys = []
+        self.refs = []
+        self.docs = {}
+        self.doc_ids = {}
+        self.next_doc_id = 0
+        self.ready = False
+        self.loading = None
+        self.pending_changes = []
+        self.queued = {}
+        self.flush_handle = None
+
+    def _apply_batch(self, changes):
+        # list.insert/del on lists of up to SUGGEST_MAX_ENTRIES items moves every later item,
+        # so a batch of changes is merged in with one sliced pass over the lists instead
+        removed, added = set(), []
+        for change in changes:
+            doc_id = self.doc_ids.pop(change['uid'], None)
+            if doc_id is not None:
+                _, title, author = self.docs.pop(doc_id)
+                removed.update((key, doc_id * 2 + kind) for key, kind, _ in index_keys(title, author))
+            if change['op'] == 'upsert':
+                doc_id = self.next_doc_id
+                self.next_doc_id += 1
+                self.docs[doc_id] = (change['uid'], change['title'], change['author'])
+                self.doc_ids[change['uid']] = doc_id
+                full_only = len(self.keys) - len(removed) + len(added) >= Config.SUGGEST_MAX_ENTRIES
+                added.extend((key, doc_id * 2 + kind) for key, kind, starts in
+                             index_keys(change['title'], change['author']) if starts or not full_only)
+        if removed:
+            self._delete(removed)
+        if added:
+            self._merge(sorted(added))
+
+    def _delete(self, entries):
+        positions = []
+        for key, ref in entries:
+            position = bisect_left(self.keys, key)
+            while position < len(self.keys) and self.keys[position] == key:
+                if self.refs[position] == ref:
+                    positions.append(position)
+                    break
+                position += 1
+        keys, refs, start = [], [], 0
+        for position in sorted(positions):
+            keys += self.keys[start:position]
+            refs += self.refs[start:position]
+            start = position + 1
+        self.keys, self.refs = keys + self.keys[start:], refs + self.refs[start:]
+
+    def _merge(self, entries):
+        keys, refs, start = [], [], 0
+        for key, ref in entries:
+            position = bisect_left(self.keys, key, start)
+            keys += self.keys[start:position]
+            refs += self.refs[start:position]
+            keys.append(key)
+            refs.append(ref)
+            start = position
+        self.keys, self.refs = keys + self.keys[start:], refs + self.refs[start:]
+
+    def apply(self, change):
+        if not self.ready:
+            self.pending_changes.append(change)
+            return
+        # an import sends one notification per book, the burst is applied as one batch;
+        # a later change to the same book replaces the queued one
+        self.queued[change['uid']] = change
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self):
+        self.flush_handle = None
+        changes, self.queued = list(self.queued.values()), {}
+        self._apply_batch(changes)
+
+    def _on_notify(self, payload):
+        self.apply(json.loads(payload))
+
+    def _on_reconnect(self):
+        # changes may have been missed, start over from the database
+        self.schedule_load()
+
+    def schedule_load(self):
+        if self.loading is None or self.loading.done():
+            self.loading = asyncio.create_task(self._load_until_ready())
+        return self.loading
+
+    async def _load_until_ready(self):
+        while True:
+            try:
+                await self.load()
+                return
+            except Exception as e:
+                print(f"suggest index load failed, retrying: {e}")
+                await asyncio.sleep(5)
+
+    async def load(self):
+        self.ready = False
+        self.pending_changes = []
+        self.queued = {}
+        async with engine.connect() as conn:
+            rows = (await conn.execute(select(Books.uid, Books.title, Books.author))).all()
+        built = await asyncio.to_thread(self._build, rows)
+        self.keys, self.refs, self.docs, self.doc_ids, self.next_doc_id = built
+        self.ready = True
+        self._apply_batch({change['uid']: change for change in self.pending_changes}.values())
+        self.pending_changes = []
+        print(f"suggest index loaded with {len(self.docs)} books, {len(self.keys)} keys")
+
+    @staticmethod
+    def _build(rows):
+        docs, doc_ids, starts, inner = {}, {}, [], []
+        for doc_id, (uid, title, author) in enumerate(rows):
+            uid = str(uid)
+            docs[doc_id] = (uid, title, author)
+            doc_ids[uid] = doc_id
+            for key, kind, starts_field in index_keys(title, author):
+                (starts if starts_field else inner).append((key, doc_id * 2 + kind))
+        # over budget only the keys at the start of a title or author are kept for every book
+        entries = starts + inner[:max(Config.SUGGEST_MAX_ENTRIES - len(starts), 0)]
+        del starts, inner
+        entries.sort()
+        return [key for key, _ in entries], [ref for _, ref in entries], docs, doc_ids, len(rows)
+
+    def suggest(self, prefix: str, limit: int):
+        if not self.ready:
+            raise Exception("Suggestions are still loading.")
+        prefix = normalize(prefix)[:Config.SUGGEST_KEY_LENGTH]
+        results, seen = [], set()
+        if not prefix:
+            return results
+        position = bisect_left(self.keys, prefix)
+        while position < len(self.keys) and len(results) < limit and self.keys[position].startswith(prefix):
+            doc_id, kind = divmod(self.refs[position], 2)
+            if doc_id not in seen:
+                seen.add(doc_id)
+                uid, title, author = self.docs[doc_id]
+                results.append({'uid': uid, 'title': title, 'author': author,
+                                'match': 'title' if kind == TITLE else 'author'})
+            position += 1
+        return results
+
+
+suggest_index = SuggestIndex()
+pg_listener.listen(CHANNEL, suggest_index._on_notify, suggest_index._on_reconnect)
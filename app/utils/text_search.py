@@ -0,0 +1,191 @@
+import asyncio
+import fcntl
+import json
+import multiprocessing
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy.future import select
+
+from startup.db_config import engine, Config
+from repositories.models import Books
+
+try:
+    import numpy as np
+    from scipy import sparse
+    from utils import tfidf
+except ImportError:
+    np = sparse = tfidf = None
+
+# TF-IDF rows of every book, stored column-major (one postings list per hashed
+# term) in .npy files that each worker memory-maps. The store is rebuilt from
+# the database in a process pool by whichever worker gets the file lock; books
+# written since then live in a small per-worker delta that is searched along
+# with it.
+
+
+class StoredIndex:
+    def __init__(self, path, manifest):
+        self.generation = manifest['generation']
+        self.built_at = manifest['built_at']
+        self.n_docs = manifest['n_docs']
+        load = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        self.indptr, self.indices, self.data, self.uids = load("indptr"), load("indices"), load("data"), load("uids")
+        self.idf = tfidf.inverse_document_frequency(np.asarray(load("df")), self.n_docs)
+
+    def uid(self, row) -> uuid.UUID:
+        return uuid.UUID(bytes=self.uids[row].tobytes())
+
+
+def write_store(store_dir, generation, uids, chunks, built_at):
+    path = os.path.join(store_dir, generation)
+    os.makedirs(path)
+    n_features = Config.TFIDF_FEATURES
+    tf = sparse.vstack(chunks, format="csr") if chunks else sparse.csr_matrix((0, n_features), dtype=np.float32)
+    df = np.bincount(tf.indices, minlength=n_features).astype(np.int32)
+    matrix = tfidf.tfidf_rows(tf, tfidf.inverse_document_frequency(df, tf.shape[0])).tocsc()
+    arrays = {
+        'indptr': matrix.indptr.astype(np.int64),
+        'indices': matrix.indices.astype(np.int32),
+        'data': matrix.data.astype(np.float32),
+        'df': df,
+        'uids': np.frombuffer(b"".join(uid.bytes for uid in uids), dtype=np.uint8).reshape(-1, 16)
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), array)
+
+    manifest_path = os.path.join(store_dir, "current.json")
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump({'generation': generation, 'built_at': built_at, 'n_docs': len(uids)}, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    # workers that still have an older generation mapped keep reading it until they reload
+    for name in os.listdir(store_dir):
+        if name != generation and os.path.isdir(os.path.join(store_dir, name)):
+            shutil.rmtree(os.path.join(store_dir, name), ignore_errors=True)
+
+
+class TextSearch:
+    def __init__(self):
+        self.index = None
+        self.manifest_mtime = None
+        self.delta = {}
+        self._delta_matrix = None
+        self.pool = None
+        self.rebuild_lock = asyncio.Lock()
+
+    def reload(self):
+        manifest_path = os.path.join(Config.TFIDF_STORE_DIR, "current.json")
+        try:
+            mtime = os.stat(manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self.manifest_mtime:
+            return
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        self.index = StoredIndex(os.path.join(Config.TFIDF_STORE_DIR, manifest['generation']), manifest)
+        self.manifest_mtime = mtime
+        # anything written before the build started is in the store now
+        self.delta = {uid: entry for uid, entry in self.delta.items() if entry[0] >= self.index.built_at}
+        self._delta_matrix = None
+
+    def index_books(self, books):
+        if tfidf is None:
+            return
+        indexed_at = time.time()
+        for book in books:
+            self.delta[book.uid] = (indexed_at, tfidf.term_counts(
+                (book.title, book.author, book.category, book.summary), Config.TFIDF_FEATURES))
+        self._delta_matrix = None
+
+    def _idf(self):
+        if self.index is not None:
+            return self.index.idf
+        return np.ones(Config.TFIDF_FEATURES, dtype=np.float32)
+
+    def _delta(self):
+        if self._delta_matrix is None:
+            uids = list(self.delta)
+            tf = tfidf.counts_matrix([self.delta[uid][1] for uid in uids], Config.TFIDF_FEATURES)
+            self._delta_matrix = uids, tfidf.tfidf_rows(tf, self._idf())
+        return self._delta_matrix
+
+    def similar(self, fields, k: int, exclude=None):
+        if tfidf is None:
+            raise Exception("numpy and scipy are required for similarity search.")
+        self.reload()
+        if self.index is None and not self.delta:
+            raise Exception("The similarity index is still being built.")
+        features, weights = tfidf.query_terms(tfidf.term_counts(fields, Config.TFIDF_FEATURES),
+                                              self._idf(), Config.TFIDF_QUERY_TERMS)
+        results = []
+        if self.index is not None:
+            index = self.index
+            scores = tfidf.postings_scores(index.indptr, index.indices, index.data, index.n_docs, features, weights)
+            # some headroom for rows superseded by the delta
+            for row in tfidf.top_k(scores, 2 * k + 1):
+                uid = index.uid(row)
+                if uid != exclude and uid not in self.delta:
+                    results.append((uid, float(scores[row])))
+        if self.delta and len(features):
+            uids, matrix = self._delta()
+            query = sparse.csr_matrix((weights, (np.zeros(len(features), dtype=np.int64), features)),
+                                      shape=(1, Config.TFIDF_FEATURES))
+            scores = (matrix @ query.T).toarray().ravel()
+            for row in tfidf.top_k(scores, k + 1):
+                if uids[row] != exclude:
+                    results.append((uids[row], float(scores[row])))
+        results.sort(key=lambda result: -result[1])
+        return results[:k]
+
+    async def rebuild(self) -> bool:
+        async with self.rebuild_lock:
+            os.makedirs(Config.TFIDF_STORE_DIR, exist_ok=True)
+            with open(os.path.join(Config.TFIDF_STORE_DIR, ".lock"), "w") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # another worker is building, its result is picked up by reload()
+                    return False
+                if self.pool is None:
+                    self.pool = ProcessPoolExecutor(Config.TFIDF_WORKERS,
+                                                    mp_context=multiprocessing.get_context("spawn"))
+                started_at = time.time()
+                loop = asyncio.get_running_loop()
+                uids, pending = [], []
+                async with engine.connect() as conn:
+                    result = await conn.stream(select(Books.uid, Books.title, Books.author, Books.category, Books.summary))
+                    async for rows in result.partitions(Config.TFIDF_CHUNK_SIZE):
+                        uids.extend(row[0] for row in rows)
+                        pending.append(loop.run_in_executor(self.pool, tfidf.tf_matrix,
+                                                            [tuple(row[1:]) for row in rows], Config.TFIDF_FEATURES))
+                chunks = await asyncio.gather(*pending)
+                await asyncio.to_thread(write_store, Config.TFIDF_STORE_DIR, f"{int(started_at)}-{os.getpid()}",
+                                        uids, chunks, started_at)
+            self.reload()
+            return True
+
+    async def run(self):
+        if tfidf is None:
+            print("numpy/scipy not installed, text similarity search is disabled")
+            return
+        try:
+            while True:
+                try:
+                    self.reload()
+                    stale = self.index is None or time.time() - self.index.built_at > Config.TFIDF_REBUILD_SECONDS
+                    if (stale or len(self.delta) > Config.TFIDF_MAX_DELTA) and await self.rebuild():
+                        print(f"text similarity index rebuilt with {self.index.n_docs} books")
+                except Exception as e:
+                    print(f"text similarity index rebuild failed: {e}")
+                await asyncio.sleep(Config.TFIDF_CHECK_SECONDS)
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown(wait=False, cancel_futures=True)
+                self.pool = None
+
+
+text_search = TextSearch()
@@ -0,0 +1,86 @@
+import re
+import zlib
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+# Kept free of app imports: the functions here run in the process pool.
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have he her his in is it its of on or she that the their "
+    "they this to was were which who will with".split())
+# title, author, category, summary
+FIELD_WEIGHTS = (2.0, 1.0, 1.0, 1.0)
+
+
+def term_counts(fields, n_features: int) -> Counter:
+    # hashed with crc32 rather than hash(), which is salted per process
+    counts = Counter()
+    for text, weight in zip(fields, FIELD_WEIGHTS):
+        for token in _TOKEN.findall((text or "").lower()):
+            if len(token) > 1 and token not in STOP_WORDS:
+                counts[zlib.crc32(token.encode()) % n_features] += weight
+    return counts
+
+
+def tf_matrix(documents, n_features: int):
+    return counts_matrix([term_counts(fields, n_features) for fields in documents], n_features)
+
+
+def counts_matrix(rows, n_features: int):
+    indptr, indices, data = [0], [], []
+    for counts in rows:
+        indices.extend(counts.keys())
+        data.extend(counts.values())
+        indptr.append(len(indices))
+    data = np.array(data, dtype=np.float32)
+    # sublinear tf, every count is at least 1
+    np.log(data, out=data)
+    data += 1
+    return sparse.csr_matrix((data, np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int64)),
+                             shape=(len(rows), n_features))
+
+
+def inverse_document_frequency(df, n_docs: int):
+    return (np.log((1 + n_docs) / (1 + df.astype(np.float32))) + 1).astype(np.float32)
+
+
+def tfidf_rows(tf, idf):
+    tf = tf.tocsr(copy=True)
+    tf.data *= idf[tf.indices]
+    norms = np.sqrt(np.asarray(tf.multiply(tf).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return (sparse.diags(1 / norms) @ tf).tocsr()
+
+
+def query_terms(counts: Counter, idf, max_terms: int):
+    if not counts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    features = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    weights = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    weights = (np.log(weights) + 1) * idf[features]
+    if len(weights) > max_terms:
+        top = np.argpartition(-weights, max_terms)[:max_terms]
+        features, weights = features[top], weights[top]
+    return features, weights / np.linalg.norm(weights)
+
+
+def postings_scores(indptr, indices, data, n_docs: int, features, weights):
+    # walks only the postings of the query terms in the column-major store
+    scores = np.zeros(n_docs, dtype=np.float32)
+    for feature, weight in zip(features, weights):
+        begin, end = indptr[feature], indptr[feature + 1]
+        if begin != end:
+            scores[indices[begin:end]] += weight * data[begin:end]
+    return scores
+
+
+def top_k(scores, k: int):
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[scores[top] > 0]
+    return top[np.argsort(-scores[top], kind="stable")]
@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+import subprocess
+from datetime import datetime
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+APP_DIR = BENCH_DIR.parent / "app"
+RESULTS_DIR = BENCH_DIR / "results"
+
+# the app imports its modules relative to app/ and reads app/.env
+sys.path.insert(0, str(APP_DIR))
+if (APP_DIR / ".env").exists() and not Path(".env").exists():
+    os.chdir(APP_DIR)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, duration):
+    values = sorted(samples)
+    return {
+        'count': len(values),
+        'throughput_rps': round(len(values) / duration, 2) if duration else None,
+        'mean_ms': round(sum(values) / len(values) * 1000, 3) if values else None,
+        'p50_ms': round(percentile(values, 50) * 1000, 3) if values else None,
+        'p95_ms': round(percentile(values, 95) * 1000, 3) if values else None,
+        'p99_ms': round(percentile(values, 99) * 1000, 3) if values else None,
+        'max_ms': round(values[-1] * 1000, 3) if values else None
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def save_results(kind: str, payload: dict, output: str = None) -> Path:
+    payload = {
+        'kind': kind,
+        'revision': git_revision(),
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        **payload
+    }
+    if output:
+        path = Path(output)
+    else:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        path = RESULTS_DIR / f"{kind}-{datetime.utcnow():%Y%m%d-%H%M%S}.json"
+    path.write_text(json.dumps(payload, indent=2, default=str))
+    return path
@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import random
+import time
+from collections import defaultdict, Counter
+
+import asyncpg
+import httpx
+
+from common import summarize, save_results
+from startup.db_config import Config
+from seed import BENCH_PASSWORD, CATEGORIES, WORDS
+
+API = "/api/v1"
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = Counter()
+        self.statuses = defaultdict(Counter)
+        self.total = 0
+
+    async def call(self, client, name, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[name] += 1
+            return None
+        self.samples[name].append(time.perf_counter() - start)
+        self.total += 1
+        self.statuses[name][response.status_code] += 1
+        if response.status_code >= 500:
+            self.errors[name] += 1
+        return response
+
+    def report(self, duration):
+        return {
+            name: {**summarize(samples, duration),
+                   'errors': self.errors[name],
+                   'statuses': dict(self.statuses[name])}
+            for name, samples in sorted(self.samples.items())
+        }
+
+
+def auth(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+async def login(client, username):
+    response = await client.post(f"{API}/user/login/", json={"username": username, "password": BENCH_PASSWORD})
+    response.raise_for_status()
+    return response.json()['resp_data']['access_token']
+
+
+async def browse_catalog(client, rec, ctx, rng):
+    filters = {"page": rng.randint(1, 20), "limit": 20}
+    roll = rng.random()
+    if roll < 0.4:
+        filters["category"] = rng.choice(CATEGORIES)
+    elif roll < 0.7:
+        filters["title"] = rng.choice(WORDS)
+    elif roll < 0.85:
+        filters["author"] = rng.choice(WORDS)[:3]
+    if rng.random() < 0.5:
+        filters["availability"] = True
+    await rec.call(client, "POST /books/filter", "POST", f"{API}/books/filter", json=filters)
+    await rec.call(client, "GET /books/available", "GET", f"{API}/books/available")
+    await rec.call(client, "POST /books/by-title", "POST", f"{API}/books/by-title",
+                   json={"title": rng.choice(WORDS)[:rng.randint(2, 5)]}, headers=auth(ctx['user_token']))
+
+
+async def borrow_flow(client, rec, ctx, rng):
+    headers = auth(ctx['user_token'])
+    await rec.call(client, "POST /transaction/borrow-request/", "POST", f"{API}/transaction/borrow-request/",
+                   json={"book_id": str(rng.choice(ctx['book_uids'])), "duration": rng.choice([3, 7, 14])},
+                   headers=headers)
+    await rec.call(client, "POST /transaction/user-pending-request/", "POST",
+                   f"{API}/transaction/user-pending-request/", json={"page": 1, "limit": 10}, headers=headers)
+    await rec.call(client, "GET /user/summary/", "GET", f"{API}/user/summary/", headers=headers)
+
+    admin_headers = auth(ctx['admin_token'])
+    response = await rec.call(client, "POST /transaction/pending-request/", "POST",
+                              f"{API}/transaction/pending-request/", json={"page": 1, "limit": 10},
+                              headers=admin_headers)
+    if response is not None and response.status_code == 200 and response.json()['resp_data']:
+        pending = rng.choice(response.json()['resp_data'])
+        action = "accept" if rng.random() < 0.7 else "reject"
+        await rec.call(client, f"POST /transaction/{action}/", "POST", f"{API}/transaction/{action}/",
+                       json={"request_id": str(pending['uid'])}, headers=admin_headers)
+
+    response = await rec.call(client, "POST /transaction/ongoing-transaction/", "POST",
+                              f"{API}/transaction/ongoing-transaction/",
+                              json={"page": rng.randint(1, 5), "limit": 10}, headers=admin_headers)
+    if response is not None and response.status_code == 200 and response.json()['resp_data']:
+        trx = rng.choice(response.json()['resp_data'])
+        await rec.call(client, "POST /transaction/return/", "POST", f"{API}/transaction/return/",
+                       json={"transaction_id": str(trx['uid'])}, headers=admin_headers)
+
+
+async def admin_paging(client, rec, ctx, rng):
+    headers = auth(ctx['admin_token'])
+    for route in ("pending-request", "processed-request", "ongoing-transaction", "finished-transaction"):
+        await rec.call(client, f"POST /transaction/{route}/", "POST", f"{API}/transaction/{route}/",
+                       json={"page": rng.randint(1, 50), "limit": 20}, headers=headers)
+
+
+WORKLOADS = {
+    'browse': browse_catalog,
+    'borrow': borrow_flow,
+    'admin': admin_paging
+}
+
+
+def parse_mix(mix: str):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in WORKLOADS:
+            raise SystemExit(f"Unknown workload '{name}', expected one of {', '.join(WORKLOADS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+async def sample_book_uids(limit):
+    conn = await asyncpg.connect(user=Config.POSTGRES_USER, password=Config.POSTGRES_PASSWORD,
+                                 host=Config.POSTGRES_HOST, port=Config.POSTGRES_PORT,
+                                 database=Config.POSTGRES_DB)
+    try:
+        rows = await conn.fetch("SELECT uid FROM books ORDER BY uid LIMIT $1", limit)
+    finally:
+        await conn.close()
+    return [row['uid'] for row in rows]
+
+
+async def read_rss(client, args, admin_token):
+    if not args.base_url:
+        from utils.memory import current_rss
+        return current_rss()
+    response = await client.get(f"{API}/admin/memory/", params={"history": 0}, headers=auth(admin_token))
+    response.raise_for_status()
+    return response.json()['resp_data']['current']['rss_bytes']
+
+
+async def monitor_memory(client, rec, args, points, stop):
+    # one RSS reading every --soak-every requests; in-process this is the
+    # benchmark's own process, otherwise the worker that answers the poll
+    admin_token = await login(client, "admin0")
+    next_mark = 0
+    while not stop.is_set():
+        if rec.total >= next_mark:
+            points.append((rec.total, await read_rss(client, args, admin_token)))
+            next_mark = rec.total + args.soak_every
+        await asyncio.sleep(0.2)
+    points.append((rec.total, await read_rss(client, args, admin_token)))
+
+
+def memory_growth(points, per):
+    if len(points) < 2:
+        return None
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x if var_x else 0
+    return {
+        'rss_start_bytes': points[0][1],
+        'rss_end_bytes': points[-1][1],
+        'growth_per_interval_bytes': round(slope * per),
+        'interval_requests': per,
+        'points': [{'requests': x, 'rss_bytes': y} for x, y in points]
+    }
+
+
+def make_client(args):
+    if args.base_url:
+        return httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout)
+    from startup import db_config
+    db_config.engine.echo = False
+    from main import app
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=args.timeout)
+
+
+async def virtual_user(index, client, rec, args, weights, book_uids, deadline):
+    rng = random.Random(args.seed * 1000 + index)
+    ctx = {
+        'user_token': await login(client, f"user{index % args.users}"),
+        'admin_token': await login(client, f"admin{index % args.admins}"),
+        'book_uids': book_uids
+    }
+    names, values = list(weights), list(weights.values())
+    while time.perf_counter() < deadline:
+        workload = WORKLOADS[rng.choices(names, values)[0]]
+        await workload(client, rec, ctx, rng)
+
+
+async def run(args):
+    weights = parse_mix(args.mix)
+    book_uids = await sample_book_uids(args.book_sample)
+    rec = Recorder()
+    async with make_client(args) as client:
+        stop, points = asyncio.Event(), []
+        monitor = asyncio.create_task(monitor_memory(client, rec, args, points, stop)) if args.soak else None
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(virtual_user(i, client, rec, args, weights, book_uids, deadline)
+                               for i in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+        if monitor is not None:
+            stop.set()
+            await monitor
+
+    routes = rec.report(elapsed)
+    print(f"{'route':45} {'count':>8} {'rps':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'err':>5}")
+    for name, stats in routes.items():
+        print(f"{name:45} {stats['count']:>8} {stats['throughput_rps']:>9} {stats['p50_ms']:>9} "
+              f"{stats['p95_ms']:>9} {stats['p99_ms']:>9} {stats['errors']:>5}")
+    soak = memory_growth(points, args.soak_every) if args.soak else None
+    if soak is not None:
+        print(f"RSS {soak['rss_start_bytes'] / 2**20:.1f} MiB -> {soak['rss_end_bytes'] / 2**20:.1f} MiB, "
+              f"growth {soak['growth_per_interval_bytes'] / 2**20:+.2f} MiB per {args.soak_every} requests")
+    path = save_results("soak" if args.soak else "load", {
+        'target': args.base_url or "in-process",
+        'args': vars(args),
+        'duration_s': round(elapsed, 3),
+        'total_requests': sum(stats['count'] for stats in routes.values()),
+        'routes': routes,
+        'memory': soak
+    }, args.output)
+    print(f"Results written to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Drive a mixed workload against the app (in-process through ASGI, or a running "
+                    "server with --base-url) and report per-route throughput and latency percentiles. "
+                    "Expects a database prepared with seed.py.")
+    parser.add_argument("--base-url", help="e.g. http://127.0.0.1:8004; in-process when omitted")
+    parser.add_argument("--duration", type=float, default=60, help="seconds")
+    parser.add_argument("--concurrency", type=int, default=20, help="number of virtual users")
+    parser.add_argument("--mix", default="browse=70,borrow=20,admin=10")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--users", type=int, default=200_000, help="seeded user count")
+    parser.add_argument("--admins", type=int, default=20, help="seeded admin count")
+    parser.add_argument("--book-sample", type=int, default=5000)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--soak", action="store_true",
+                        help="also track RSS and report its growth per --soak-every requests "
+                             "(run with a long --duration)")
+    parser.add_argument("--soak-every", type=int, default=10_000)
+    parser.add_argument("--output", help="result file (default: benchmarks/results/load-<time>.json)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
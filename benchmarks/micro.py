@@ -0,0 +1,118 @@
+import os
+import sys
+import json
+import argparse
+import timeit
+import uuid
+from datetime import datetime, timedelta
+
+# no database is touched here, the settings only need to be parseable
+for key, value in {"POSTGRES_USER": "bench", "POSTGRES_PASSWORD": "bench", "POSTGRES_HOST": "localhost",
+                   "POSTGRES_PORT": "5432", "POSTGRES_DB": "bench", "JWT_SECRET": "micro-benchmark-secret",
+                   "JWT_ALGORITHM": "HS256"}.items():
+    os.environ.setdefault(key, value)
+
+from common import BENCH_DIR, save_results
+from pydantic import TypeAdapter
+from api.schemas.book import AddBook, FilterBook
+from api.schemas.transaction import Pagination, OngoingTransactionPage
+from api.routes.transaction import pick_fields, TRANSACTION_FIELDS
+from repositories.models import Users, Books, Requests, Transactions
+from utils.auth import create_access_token, decode_token
+
+BASELINE_PATH = BENCH_DIR / "baselines" / "micro.json"
+
+
+def make_transactions(n):
+    now = datetime(2024, 1, 1, 12, 30)
+    transactions = []
+    for i in range(n):
+        user = Users(uid=uuid.uuid4(), username=f"user{i}", password="x", role="user",
+                     name=f"NAME {i}", address="ADDRESS", created_at=now)
+        book = Books(uid=uuid.uuid4(), title=f"Title {i}", author="Author", category="Fiction",
+                     total_copies=1, available_copies=0, summary="summary", admin_id=uuid.uuid4(), created_at=now, updated_at=now)
+        request = Requests(uid=uuid.uuid4(), user_id=user.uid, book_id=book.uid, requested_at=now,
+                           updated_at=now, duration=7, status="accepted")
+        request.request_user = user
+        request.borrowed_book = book
+        trx = Transactions(uid=uuid.uuid4(), admin_id=uuid.uuid4(), request_id=request.uid, created_at=now,
+                           due_date=now + timedelta(days=7), is_overdue=False)
+        trx.transaction_from_request = request
+        transactions.append(trx)
+    return transactions
+
+
+def build_cases():
+    user_data = {"uid": str(uuid.uuid4()), "username": "user1", "role": "user"}
+    token = create_access_token(dict(user_data))
+    filter_payload = {"page": 3, "limit": 20, "title": "river", "category": "Fiction", "availability": True}
+    books_adapter = TypeAdapter(list[AddBook])
+    books_payload = [{"title": f"Title {i}", "author": "Author", "category": "Fiction",
+                      "summary": "A summary of the book " * 5} for i in range(500)]
+    transactions = make_transactions(20)
+
+    fields = OngoingTransactionPage(page=1, limit=20).selected_fields()
+
+    def ongoing_transaction_response():
+        return [pick_fields(TRANSACTION_FIELDS, fields, trx) for trx in transactions]
+
+    return {
+        'auth.create_access_token': lambda: create_access_token(dict(user_data)),
+        'auth.decode_token': lambda: decode_token(token),
+        'schema.FilterBook': lambda: FilterBook.model_validate(filter_payload),
+        'schema.Pagination': lambda: Pagination.model_validate({"page": 1, "limit": 10}),
+        'schema.list[AddBook] x500': lambda: books_adapter.validate_python(books_payload),
+        'response.ongoing_transaction x20': ongoing_transaction_response
+    }
+
+
+def measure(func, repeat):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return best / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time pure-Python request-processing hot spots (no database needed) and compare "
+                    "them against a stored baseline.")
+    parser.add_argument("--filter", help="only run cases whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save-baseline", action="store_true", help=f"write results to {BASELINE_PATH}")
+    parser.add_argument("--check", action="store_true",
+                        help="exit with status 1 when a case is slower than the baseline by more than --threshold")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative slowdown (0.25 = 25%%)")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    baseline = json.loads(BASELINE_PATH.read_text())['cases'] if BASELINE_PATH.exists() else {}
+    results, regressions = {}, []
+    print(f"{'case':36} {'us/op':>10} {'baseline':>10} {'change':>8}")
+    for name, func in build_cases().items():
+        if args.filter and args.filter not in name:
+            continue
+        per_op = round(measure(func, args.repeat), 3)
+        results[name] = per_op
+        base = baseline.get(name)
+        change = (per_op - base) / base if base else None
+        if change is not None and change > args.threshold:
+            regressions.append(name)
+        print(f"{name:36} {per_op:>10} {base if base else '-':>10} "
+              f"{f'{change:+.1%}' if change is not None else '-':>8}")
+
+    if args.save_baseline:
+        BASELINE_PATH.parent.mkdir(exist_ok=True)
+        BASELINE_PATH.write_text(json.dumps({'python': sys.version.split()[0], 'cases': {**baseline, **results}},
+                                            indent=2) + "\n")
+        print(f"Baseline written to {BASELINE_PATH}")
+    if args.output:
+        save_results("micro", {'cases_us_per_op': results, 'baseline': baseline}, args.output)
+
+    if args.check and regressions:
+        print(f"Regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import argparse
+import asyncio
+import random
+import uuid
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+import asyncpg
+
+import common  # noqa: F401  (puts app/ on sys.path)
+from startup.db_config import Config, init_db
+from utils.auth import get_password_hash
+
+BENCH_PASSWORD = "benchmark"
+BASE_TIME = datetime(2024, 1, 1)
+CHUNK_SIZE = 50_000
+
+CATEGORIES = ["Fiction", "Science", "History", "Biography", "Poetry", "Technology", "Philosophy",
+              "Economics", "Art", "Travel", "Children", "Religion", "Mystery", "Romance", "Health"]
+WORDS = ["river", "shadow", "garden", "empire", "silent", "storm", "winter", "light", "ocean", "code",
+         "theory", "journey", "secret", "glass", "forest", "machine", "crown", "memory", "stone", "star",
+         "city", "night", "fire", "island", "letter", "mirror", "paper", "house", "road", "dream"]
+NAMES = ["ANDI", "BUDI", "CITRA", "DEWI", "EKA", "FAJAR", "GITA", "HADI", "INDAH", "JOKO",
+         "KARTIKA", "LINA", "MAYA", "NANDA", "OKTA", "PUTRI", "RIZKY", "SARI", "TONO", "WULAN"]
+
+
+def new_uid(rng: random.Random) -> uuid.UUID:
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def chunks(rows, size=CHUNK_SIZE):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def copy_rows(conn, table, columns, rows):
+    total = 0
+    for chunk in chunks(rows):
+        await conn.copy_records_to_table(table, records=chunk, columns=columns)
+        total += len(chunk)
+    print(f"  {table}: {total} rows")
+
+
+def generate_users(rng, n_admins, n_users, password_hash):
+    for i in range(n_admins + n_users):
+        is_admin = i < n_admins
+        username = f"admin{i}" if is_admin else f"user{i - n_admins}"
+        yield (new_uid(rng), username, password_hash, "admin" if is_admin else "user",
+               f"{rng.choice(NAMES)} {rng.choice(NAMES)}", f"JL. {rng.choice(WORDS).upper()} NO. {rng.randint(1, 300)}",
+               BASE_TIME + timedelta(minutes=i))
+
+
+def generate_books(rng, n_books, admin_uids):
+    for i in range(n_books):
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))).title()
+        author = f"{rng.choice(NAMES).title()} {rng.choice(NAMES).title()}"
+        summary = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 60)))
+        created_at = BASE_TIME + timedelta(seconds=i)
+        yield (new_uid(rng), title, author, rng.choice(CATEGORIES), 1, 1, summary,
+               rng.choice(admin_uids), created_at, created_at)
+
+
+async def seed(args):
+    rng = random.Random(args.seed)
+    await init_db()
+
+    conn = await asyncpg.connect(user=Config.POSTGRES_USER, password=Config.POSTGRES_PASSWORD,
+                                 host=Config.POSTGRES_HOST, port=Config.POSTGRES_PORT,
+                                 database=Config.POSTGRES_DB)
+    try:
+        if args.reset:
+            await conn.execute("TRUNCATE reviews, transactions, requests, books, users CASCADE")
+
+        print("Seeding (seed=%d)" % args.seed)
+        # bcrypt is far too slow to run per row; every seeded account shares one hash
+        password_hash = get_password_hash(BENCH_PASSWORD)
+
+        users = list(generate_users(rng, args.admins, args.users, password_hash))
+        await copy_rows(conn, "users",
+                        ["uid", "username", "password", "role", "name", "address", "created_at"], users)
+        admin_uids = [row[0] for row in users[:args.admins]]
+        user_uids = [row[0] for row in users[args.admins:]]
+        del users
+
+        books = list(generate_books(rng, args.books, admin_uids))
+        book_uids = [row[0] for row in books]
+        await copy_rows(conn, "books",
+                        ["uid", "title", "author", "category", "total_copies", "available_copies", "summary", "admin_id",
+                         "created_at", "updated_at"], books)
+        del books
+
+        # requests and their transactions are generated together so that at most
+        # one transaction per book is still ongoing (that book is then unavailable)
+        borrowed_books = set()
+        requests, transactions = [], []
+
+        async def flush():
+            await conn.copy_records_to_table(
+                "requests", records=requests,
+                columns=["uid", "user_id", "book_id", "requested_at", "updated_at", "duration", "status", "description"])
+            await conn.copy_records_to_table(
+                "transactions", records=transactions,
+                columns=["uid", "admin_id", "request_id", "created_at", "due_date", "returned_at", "is_overdue"])
+            requests.clear()
+            transactions.clear()
+
+        span = args.history_days * 86400
+        n_transactions = 0
+        for i in range(args.requests):
+            book_index = rng.randrange(len(book_uids))
+            requested_at = BASE_TIME + timedelta(seconds=rng.randrange(span))
+            duration = rng.choice([3, 7, 14, 30])
+            roll = rng.random()
+            if roll < args.pending_ratio:
+                status, description, updated_at = "pending", None, requested_at
+            elif roll < args.pending_ratio + args.rejected_ratio:
+                status, description = "rejected", "Rejected by benchmark seed"
+                updated_at = requested_at + timedelta(hours=rng.randint(1, 48))
+            else:
+                status, description = "accepted", None
+                updated_at = requested_at + timedelta(hours=rng.randint(1, 48))
+            request_uid = new_uid(rng)
+            requests.append((request_uid, rng.choice(user_uids), book_uids[book_index], requested_at,
+                             updated_at, duration, status, description))
+
+            if status == "accepted":
+                due_date = (updated_at + timedelta(days=duration)).replace(hour=23, minute=59, second=59)
+                if book_index not in borrowed_books and rng.random() < args.ongoing_ratio:
+                    borrowed_books.add(book_index)
+                    returned_at, is_overdue = None, False
+                else:
+                    returned_at = updated_at + timedelta(days=rng.randint(1, duration + 5))
+                    is_overdue = returned_at > due_date
+                transactions.append((new_uid(rng), rng.choice(admin_uids), request_uid, updated_at,
+                                     due_date, returned_at, is_overdue))
+                n_transactions += 1
+
+            if len(requests) >= CHUNK_SIZE:
+                await flush()
+        await flush()
+
+        print(f"  requests: {args.requests} rows")
+        print(f"  transactions: {n_transactions} rows")
+        await conn.execute("UPDATE books SET available_copies = 0 WHERE uid = ANY($1::uuid[])",
+                           [book_uids[index] for index in borrowed_books])
+
+        seen = set()
+
+        def generate_reviews():
+            while len(seen) < min(args.reviews, len(user_uids) * len(book_uids)):
+                pair = (rng.randrange(len(user_uids)), rng.randrange(len(book_uids)))
+                if pair in seen:
+                    continue
+                seen.add(pair)
+                created_at = BASE_TIME + timedelta(seconds=rng.randrange(span))
+                yield (new_uid(rng), user_uids[pair[0]], book_uids[pair[1]],
+                       Decimal(rng.randint(10, 50)) / 10, " ".join(rng.choice(WORDS) for _ in range(12)),
+                       created_at, created_at)
+
+        await copy_rows(conn, "reviews",
+                        ["uid", "user_id", "book_id", "rating", "description", "created_at", "updated_at"],
+                        generate_reviews())
+
+        print("Analyzing tables")
+        await conn.execute("ANALYZE users, books, requests, transactions, reviews")
+    finally:
+        await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Seed the configured PostgreSQL database with deterministic benchmark data using COPY. "
+                    f"Every seeded account (adminN / userN) has the password '{BENCH_PASSWORD}'.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--admins", type=int, default=20)
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--books", type=int, default=500_000)
+    parser.add_argument("--requests", type=int, default=5_000_000)
+    parser.add_argument("--reviews", type=int, default=2_000_000)
+    parser.add_argument("--history-days", type=int, default=730)
+    parser.add_argument("--pending-ratio", type=float, default=0.05)
+    parser.add_argument("--rejected-ratio", type=float, default=0.25)
+    parser.add_argument("--ongoing-ratio", type=float, default=0.02,
+                        help="share of accepted requests whose book is still out")
+    parser.add_argument("--reset", action="store_true", help="truncate all tables first")
+    asyncio.run(seed(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()